@@ -0,0 +1 @@
+"""Бенчмарки генерации планов на локальном моке LLM"""
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк генерации планов против локального мока LLM.
+
+Запуск из каталога bot/:
+    python -m benchmarks.bench --requests 200 --concurrency 20 --latency 1.5 --jitter 0.5
+    python -m benchmarks.bench --scenarios plan,stream --error-rate 0.05 --output bench.json
+    python -m benchmarks.bench --baseline bench.json --max-regression 0.2
+
+Сценарии: plan (generate_plan_async), edit (generate_plan_with_edit_async),
+stream (stream_plan_async, плюс время до первого фрагмента),
+handler (run_generation_job + on_generation_done с Bot API на том же моке).
+
+handler пишет черновики в заглушку БД; с --real-db — в Postgres из DATABASE_URL
+(он должен быть доступен). Несохранённый черновик считается ошибкой запроса.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.mock_llm import MockConfig, start_mock_server
+
+SCENARIOS = ("plan", "edit", "stream", "handler")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float, extra: Optional[Dict[str, List[float]]] = None) -> Dict[str, Any]:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    report: Dict[str, Any] = {
+        "requests": len(latencies) + errors,
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(max(latencies)) if latencies else None,
+        },
+    }
+    for name, values in (extra or {}).items():
+        report[f"{name}_ms"] = {"p50": ms(percentile(values, 50)), "p95": ms(percentile(values, 95)),
+                                "p99": ms(percentile(values, 99))}
+    return report
+
+
+def anketa(i: int) -> Dict[str, Any]:
+    # Разные рост/вес — разные ключи кэша планов, каждый запрос идёт в LLM
+    return {
+        "id": i + 1,
+        "user_id": 100000 + i,
+        "username": f"bench{i}",
+        "name": f"Клиент {i}",
+        "age": 20 + i % 40,
+        "height": 150 + i % 50,
+        "weight": 45 + i // 50,
+        "fitness_level": ("начинающий", "средний", "продвинутый")[i % 3],
+        "goals": "похудение, выносливость",
+        "injuries": "нет",
+    }
+
+
+async def run_scenario(call: Callable[[int], Awaitable[Any]], requests: int, concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    ttfb: List[float] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await call(i)
+            except Exception as e:
+                logging.getLogger(__name__).debug(f"Запрос {i}: {e}")
+                result = None
+            if not result:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            if isinstance(result, tuple):
+                ttfb.append(result[1] - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - started, {"ttfb": ttfb} if ttfb else None)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mock = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      chunk_delay=args.chunk_delay, chunks=args.chunks, seed=args.seed)
+    runner, url = await start_mock_server(mock)
+
+    # Окружение задаётся до импорта модулей бота: они читают его при импорте
+    os.environ.update({
+        "PROXY_API_URL": f"{url}/v1",
+        "PROXY_API_KEY": "mock",
+        "PROXY_MODEL": "mock",
+        "PROXY_HEDGE_MODEL": "",
+        "PROXY_HEDGE_API_URL": "",
+        "GIGACHAT_API_KEY": "",
+        "PROVIDER_PROBE_INTERVAL": "0",
+        "PLAN_CACHE_DB": "0",
+        "BOT_TOKEN": os.getenv("BOT_TOKEN") or "123456:mock",
+        "TRAINER_CHAT_ID": os.getenv("TRAINER_CHAT_ID") or "1",
+        "LLM_MAX_CONCURRENCY": str(max(args.concurrency, int(os.getenv("LLM_MAX_CONCURRENCY", "8")))),
+        "GENERATION_MAX_IN_FLIGHT": str(max(args.concurrency, int(os.getenv("GENERATION_MAX_IN_FLIGHT", "4")))),
+    })
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from gigachat_integration import (
+        generate_plan_async, generate_plan_with_edit_async, stream_plan_async, close_llm_providers,
+    )
+
+    async def plan(i: int) -> Any:
+        return await generate_plan_async(anketa(i))
+
+    async def edit(i: int) -> Any:
+        return await generate_plan_with_edit_async(anketa(i), "Убрать бег, добавить плавание 2 раза в неделю")
+
+    async def stream(i: int) -> Any:
+        first = None
+        text = ""
+        async for chunk in stream_plan_async(anketa(i)):
+            if first is None:
+                first = time.perf_counter()
+            text += chunk
+        return (text, first) if text else None
+
+    bot: Optional[Bot] = None
+    draft_ids = itertools.count(1)
+
+    def install_db(real_db: bool) -> None:
+        import handlers.trainer_choice as trainer_choice
+        save = trainer_choice.save_plan
+
+        async def save_plan(data: Dict[str, Any], durable: Optional[bool] = None) -> int:
+            plan_id = await save(data, durable) if real_db else next(draft_ids)
+            if not plan_id:
+                raise RuntimeError("черновик не сохранён в БД")
+            return plan_id
+        trainer_choice.save_plan = save_plan
+
+    async def handler(i: int) -> Any:
+        from handlers.trainer_choice import run_generation_job, on_generation_done
+        from utils.jobs import GenerationJob
+        job = GenerationJob(kind="plan", payload={"user_data": anketa(i + args.requests)})
+        job.result = await run_generation_job(job)
+        await on_generation_done(job)
+        return job.result
+
+    calls = {"plan": plan, "edit": edit, "stream": stream, "handler": handler}
+    results: Dict[str, Any] = {}
+    try:
+        for name in args.scenarios:
+            if name == "handler" and bot is None:
+                from utils import set_bot
+                bot = Bot(token=os.environ["BOT_TOKEN"],
+                          session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+                set_bot(bot)
+                install_db(args.real_db)
+            if args.warmup:
+                await run_scenario(calls[name], min(args.warmup, args.requests), args.concurrency)
+            results[name] = await run_scenario(calls[name], args.requests, args.concurrency)
+            print(f"{name:8} {results[name]['throughput_rps']:8.2f} rps  "
+                  f"p50 {results[name]['latency_ms']['p50']} мс  p95 {results[name]['latency_ms']['p95']} мс  "
+                  f"p99 {results[name]['latency_ms']['p99']} мс  ошибок {results[name]['errors']}")
+    finally:
+        await close_llm_providers()
+        if bot is not None:
+            await bot.session.close()
+        await runner.cleanup()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "requests": args.requests, "concurrency": args.concurrency, "latency": args.latency,
+            "jitter": args.jitter, "error_rate": args.error_rate, "chunk_delay": args.chunk_delay,
+            "chunks": args.chunks, "seed": args.seed, "real_db": args.real_db,
+        },
+        "mock": mock.stats,
+        "scenarios": results,
+    }
+
+
+def check_regression(report: Dict[str, Any], baseline_path: str, max_regression: float) -> List[str]:
+    """Сценарии, где p95 вырос или пропускная способность упала больше чем на max_regression"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = []
+    for name, current in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        p95, p95_before = current["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        if p95 and p95_before and p95 > p95_before * (1 + max_regression):
+            problems.append(f"{name}: p95 {p95_before} → {p95} мс")
+        rps, rps_before = current["throughput_rps"], before["throughput_rps"]
+        if rps_before and rps < rps_before * (1 - max_regression):
+            problems.append(f"{name}: {rps_before} → {rps} rps")
+    return problems
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк генерации планов на моке LLM")
+    parser.add_argument("--scenarios", default="plan,edit,stream",
+                        help=f"через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=5, help="запросов прогрева перед замером")
+    parser.add_argument("--latency", type=float, default=1.0, help="задержка ответа мока, с")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержки, ± с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="пауза между фрагментами потока, с")
+    parser.add_argument("--chunks", type=int, default=40, help="фрагментов в потоковом ответе")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real-db", action="store_true",
+                        help="handler: писать черновики в Postgres (DATABASE_URL) вместо заглушки")
+    parser.add_argument("--output", default="benchmark.json", help="куда записать JSON-отчёт")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📊 Отчёт: {args.output}")
+
+    if args.baseline:
+        problems = check_regression(report, args.baseline, args.max_regression)
+        for problem in problems:
+            print(f"❌ Регрессия: {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон конвейера апдейтов aiogram без сети.
+
+Каждый синтетический пользователь проходит /start, шесть ответов анкеты,
+затем тренер отвечает «+», нажимает «Внести правки», пишет правку и
+нажимает «Устроил». Апдейты идут прямо в Dispatcher с роутерами из
+main.py; Bot работает на фейковой сессии, БД и LLM заменены заглушками
+с настраиваемой задержкой.
+
+Запуск из каталога bot/:
+    python -m benchmarks.load --users 2000 --concurrency 200
+    python -m benchmarks.load --users 500 --llm-latency 2 --db-latency 0.005 --output load.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import EditMessageText, SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, Update
+
+from benchmarks.bench import percentile
+
+ROUTERS = ("start", "anketa", "trainer_choice")
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot без сети: отвечает на методы Bot API с задержкой latency"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            chat_id = method.chat_id if isinstance(method.chat_id, int) else 0
+            return Message(
+                message_id=getattr(method, "message_id", None) or next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id or 0, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, *args: Any, **kwargs: Any) -> AsyncIterator[bytes]:
+        yield b""
+
+    async def close(self) -> None:
+        return None
+
+
+class TimingMiddleware(BaseMiddleware):
+    """Время обработчиков роутера (только для апдейтов, которые он обработал)"""
+
+    def __init__(self, name: str, samples: Dict[str, List[float]]) -> None:
+        self.name = name
+        self.samples = samples
+
+    async def __call__(self, handler: Any, event: Any, data: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[self.name].append(time.perf_counter() - started)
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже планового просыпается sleep(interval)"""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class Stubs:
+    """Заглушки БД и LLM, подставляемые в модули обработчиков"""
+
+    def __init__(self, db_latency: float, llm_latency: float, llm_jitter: float) -> None:
+        self.db_latency = db_latency
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.anketas: Dict[int, Dict[str, Any]] = {}
+        self.by_user: Dict[int, int] = {}
+        self.plans: Dict[int, Dict[str, Any]] = {}
+        self.last_plan: Dict[int, int] = {}
+        self._ids = itertools.count(1)
+
+    async def _db(self) -> None:
+        if self.db_latency:
+            await asyncio.sleep(self.db_latency)
+
+    async def _llm(self) -> None:
+        await asyncio.sleep(max(0.0, self.llm_latency + random.uniform(-self.llm_jitter, self.llm_jitter)))
+
+    async def save_anketa(self, data: Dict[str, Any], durable: Optional[bool] = None) -> int:
+        await self._db()
+        anketa_id = next(self._ids)
+        self.anketas[anketa_id] = {**data, "id": anketa_id}
+        self.by_user[data["user_id"]] = anketa_id
+        return anketa_id
+
+    async def get_anketa(self, anketa_id: int) -> Optional[Dict[str, Any]]:
+        await self._db()
+        data = self.anketas.get(anketa_id)
+        return dict(data) if data else None
+
+    async def save_plan(self, data: Dict[str, Any], durable: Optional[bool] = None) -> int:
+        await self._db()
+        plan_id = len(self.plans) + 1
+        self.plans[plan_id] = dict(data)
+        self.last_plan[data.get("user_id")] = plan_id
+        return plan_id
+
+    async def get_plan_text(self, plan_id: int) -> Optional[str]:
+        await self._db()
+        plan = self.plans.get(plan_id)
+        return plan["plan_text"] if plan else None
+
+    async def approve_plan(self, plan_id: int) -> Optional[Dict[str, Any]]:
+        await self._db()
+        plan = self.plans.get(plan_id)
+        if not plan or plan.get("status") not in ("draft", "edited"):
+            return None
+        previous, plan["status"] = plan["status"], "approved"
+        return {"user_id": plan["user_id"], "plan_text": plan["plan_text"], "previous_status": previous}
+
+    async def revert_plan_approval(self, plan_id: int, status: str) -> bool:
+        await self._db()
+        plan = self.plans.get(plan_id)
+        if not plan or plan.get("status") != "approved":
+            return False
+        plan["status"] = status
+        return True
+
+    async def generate_plan(self, data: Dict[str, Any]) -> str:
+        from fallback_plans import build_fallback_plan
+        await self._llm()
+        return build_fallback_plan(data)
+
+    async def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str,
+                                      base_plan: Optional[str] = None) -> str:
+        return f"{await self.generate_plan(data)}\n\nПравки: {edit_text}"
+
+    async def generate_plan_slo(self, data: Dict[str, Any], deadline: Optional[float] = None) -> Any:
+        from utils.hedging import GenerationResult
+        started = time.monotonic()
+        return GenerationResult(await self.generate_plan(data), "primary", latency=time.monotonic() - started)
+
+    async def stream_plan(self, data: Dict[str, Any]) -> AsyncIterator[str]:
+        plan = await self.generate_plan(data)
+        step = max(1, len(plan) // 4)
+        for i in range(0, len(plan), step):
+            yield plan[i:i + step]
+            await asyncio.sleep(0)
+
+    def install(self) -> None:
+        from handlers import anketa, trainer_choice
+        anketa.save_anketa = self.save_anketa
+        for name in ("get_anketa", "save_plan", "get_plan_text", "approve_plan", "revert_plan_approval",
+                     "generate_plan", "generate_plan_with_edit", "generate_plan_slo", "stream_plan"):
+            setattr(trainer_choice, name, getattr(self, name))
+
+
+class LoadGenerator:
+    def __init__(self, dp: Dispatcher, bot: Bot, stubs: Stubs, trainer_id: int,
+                 job_timeout: float = 120.0) -> None:
+        self.dp = dp
+        self.bot = bot
+        self.stubs = stubs
+        self.trainer_id = trainer_id
+        self.job_timeout = job_timeout
+        # (вид задачи, пользователь) → событие завершения генерации
+        self._jobs: Dict[Tuple[str, int], asyncio.Event] = {}
+        self.flows_completed = 0
+        self.flows_incomplete = 0
+        # Ожидание правки хранится в FSM чата тренера — он правит по одному плану
+        self._trainer_lock = asyncio.Lock()
+        self.updates = 0
+        self.unhandled = 0
+        self.errors = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str, reply_to: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if reply_to:
+            message["reply_to_message"] = reply_to
+        return message
+
+    async def _feed(self, payload: Dict[str, Any]) -> None:
+        update = Update.model_validate({"update_id": next(self._update_ids), **payload},
+                                       context={"bot": self.bot})
+        self.updates += 1
+        try:
+            result = await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors += 1
+            logging.getLogger(__name__).debug(f"Апдейт {update.update_id}: {e}")
+            return
+        if result is UNHANDLED:
+            self.unhandled += 1
+
+    async def send(self, user_id: int, text: str, reply_to: Optional[Dict[str, Any]] = None) -> None:
+        await self._feed({"message": self._message(user_id, text, reply_to)})
+
+    async def press(self, user_id: int, data: str, message_text: str) -> None:
+        bot_message = self._message(user_id, message_text)
+        bot_message["from"] = {"id": self.bot.id, "is_bot": True, "first_name": "bot"}
+        await self._feed({"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "message": bot_message,
+            "data": data,
+        }})
+
+    def job_done(self, job: Any) -> None:
+        """Колбэк очереди (успех или отказ): тренер может нажимать кнопки черновика"""
+        user_id = job.payload.get("user_id") or job.payload["user_data"]["user_id"]
+        self._jobs.setdefault((job.kind, user_id), asyncio.Event()).set()
+
+    async def _wait_job(self, kind: str, user_id: int) -> bool:
+        event = self._jobs.setdefault((kind, user_id), asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=self.job_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def user_flow(self, index: int) -> None:
+        from callbacks import PlanAction
+
+        user_id = 10_000_000 + index
+        await self.send(user_id, "/start")
+        for answer in (f"Клиент {index}", str(18 + index % 50), str(150 + index % 50),
+                       str(50 + index % 60), "похудение, выносливость", "нет"):
+            await self.send(user_id, answer)
+
+        anketa_id = self.stubs.by_user.get(user_id)
+        if anketa_id is None or not self.trainer_id:
+            return
+        trainer = self.trainer_id
+        card = self._message(trainer, f"📋 Новая анкета #{anketa_id} от @user{user_id}")
+        await self.send(trainer, "+", reply_to=card)
+
+        # Кнопки черновика тренер нажимает, когда черновик готов (как в жизни)
+        draft = f"📋 Черновик плана для @user{user_id} (ID: {user_id})\n\n## Неделя 1\nПрисед 3×12"
+        if not await self._wait_job("plan", user_id):
+            self.flows_incomplete += 1
+            return
+        plan_id = self.stubs.last_plan.get(user_id, 0)
+        async with self._trainer_lock:
+            await self.press(trainer, PlanAction(action="edit", anketa_id=anketa_id, plan_id=plan_id).pack(), draft)
+            await self.send(trainer, "Добавь растяжку после тренировки")
+        if not await self._wait_job("edit", user_id):
+            self.flows_incomplete += 1
+            return
+        plan_id = self.stubs.last_plan.get(user_id, plan_id)
+        await self.press(trainer, PlanAction(action="approve", anketa_id=anketa_id, plan_id=plan_id).pack(), draft)
+        self.flows_completed += 1
+
+
+def router_report(samples: Dict[str, List[float]]) -> Dict[str, Any]:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        name: {
+            "handled": len(values),
+            "p50_ms": ms(percentile(values, 50)),
+            "p95_ms": ms(percentile(values, 95)),
+            "p99_ms": ms(percentile(values, 99)),
+            "max_ms": ms(max(values)) if values else None,
+        }
+        for name, values in samples.items()
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    os.environ.setdefault("BOT_TOKEN", "123456:load")
+    os.environ.setdefault("PROXY_API_KEY", "load")
+    os.environ.setdefault("TRAINER_CHAT_ID", "1")
+    os.environ["JOB_WORKERS"] = str(args.workers)
+    os.environ["GENERATION_MAX_IN_FLIGHT"] = str(args.workers)
+    # Все пользователи прогона отвечают одному тренеру — его лимит по умолчанию выключен
+    os.environ["ADMISSION_ENABLED"] = "1" if args.admission else "0"
+
+    from config import TRAINER_CHAT_ID
+    from handlers import start, anketa, trainer_choice
+    from utils import set_bot
+    from utils.admission import install_admission, admission_stats
+
+    stubs = Stubs(args.db_latency, args.llm_latency, args.llm_jitter)
+    stubs.install()
+
+    session = FakeSession(args.telegram_latency)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    set_bot(bot)
+
+    samples: Dict[str, List[float]] = defaultdict(list)
+    dp = Dispatcher(storage=MemoryStorage())
+    for name, module in zip(ROUTERS, (start, anketa, trainer_choice)):
+        middleware = TimingMiddleware(name, samples)
+        module.router.message.middleware(middleware)
+        module.router.callback_query.middleware(middleware)
+        install_admission(module.router, name)
+        dp.include_router(module.router)
+
+    queue = trainer_choice.generation_queue
+    completed = Counter()
+    on_complete = queue.on_complete
+
+    async def count_completed(job: Any) -> None:
+        completed[job.kind] += 1
+        if on_complete is not None:
+            await on_complete(job)
+        generator.job_done(job)
+    queue.on_complete = count_completed
+
+    generator = LoadGenerator(dp, bot, stubs, TRAINER_CHAT_ID, job_timeout=args.drain_timeout)
+    on_failure = queue.on_failure
+
+    async def count_failed(job: Any) -> None:
+        if on_failure is not None:
+            await on_failure(job)
+        generator.job_done(job)
+    queue.on_failure = count_failed
+    monitor = LoopLagMonitor(args.lag_interval)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index: int) -> None:
+        async with semaphore:
+            await generator.user_flow(index)
+
+    await queue.start()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(i) for i in range(args.users)))
+    pipeline_elapsed = time.perf_counter() - started
+
+    # Дожидаемся, пока воркеры разберут поставленные генерации
+    deadline = time.monotonic() + args.drain_timeout
+    while (await queue.size() or queue.in_flight) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    total_elapsed = time.perf_counter() - started
+    await monitor.stop()
+    await queue.stop()
+
+    lag = monitor.samples
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "users": args.users, "concurrency": args.concurrency, "workers": args.workers,
+            "db_latency": args.db_latency, "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter, "telegram_latency": args.telegram_latency,
+            "admission": args.admission,
+        },
+        "updates": generator.updates,
+        "unhandled": generator.unhandled,
+        "errors": generator.errors,
+        "flows": {"completed": generator.flows_completed, "incomplete": generator.flows_incomplete},
+        "elapsed_s": round(pipeline_elapsed, 3),
+        "updates_per_sec": round(generator.updates / pipeline_elapsed, 1) if pipeline_elapsed else 0.0,
+        "routers": router_report({name: samples[name] for name in ROUTERS}),
+        "loop_lag_ms": {
+            "p50": round((percentile(lag, 50) or 0) * 1000, 3),
+            "p99": round((percentile(lag, 99) or 0) * 1000, 3),
+            "max": round(max(lag, default=0) * 1000, 3),
+        },
+        "jobs": {"completed": dict(completed), "drain_s": round(total_elapsed - pipeline_elapsed, 3)},
+        "telegram_calls": dict(session.calls),
+        "admission": admission_stats(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон конвейера апдейтов")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных пользователей")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("JOB_WORKERS", "4")),
+                        help="воркеров очереди генераций")
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-jitter", type=float, default=0.01)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--lag-interval", type=float, default=0.01)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--admission", action="store_true", help="включить лимит частоты на пользователя и тренера")
+    parser.add_argument("--output", default="load.json")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"Апдейтов: {report['updates']} за {report['elapsed_s']} с — {report['updates_per_sec']} в секунду "
+          f"(необработано {report['unhandled']}, ошибок {report['errors']})")
+    print(f"  полных сценариев: {report['flows']['completed']}, не дождались генерации: {report['flows']['incomplete']}")
+    for name, stats in report["routers"].items():
+        print(f"  {name:15} {stats['handled']:7} обработано  p50 {stats['p50_ms']} мс  "
+              f"p95 {stats['p95_ms']} мс  p99 {stats['p99_ms']} мс")
+    print(f"  event loop lag: p50 {report['loop_lag_ms']['p50']} мс  p99 {report['loop_lag_ms']['p99']} мс  "
+          f"max {report['loop_lag_ms']['max']} мс")
+    print(f"  генераций: {report['jobs']['completed']}")
+    if args.admission:
+        rejected = {role: report["admission"][role]["rejected"] for role in ("users", "trainers")}
+        print(f"  отклонено лимитом частоты: {rejected}")
+    print(f"📊 Отчёт: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
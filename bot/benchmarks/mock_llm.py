@@ -0,0 +1,121 @@
+"""
+Локальный мок OpenAI-совместимого API (и методов Telegram Bot API для сценария handler):
+задержка, разброс, потоковая отдача и доля ошибок задаются в MockConfig
+"""
+
+import json
+import time
+import random
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, Tuple
+
+from aiohttp import web
+
+PLAN_TEXT = (
+    "## Цели и оценка\nПостепенное снижение веса и рост выносливости.\n\n"
+    "## Неделя 1\nПн: присед 3×12, отжимания от скамьи 3×10, планка 3×30 с.\n"
+    "Ср: ходьба 30 мин.\nПт: выпады 3×10, тяга резинки 3×12.\n\n"
+    "## Недели 2–4\nПрибавляйте по 1–2 повтора в неделю.\n\n"
+    "## Питание\nДефицит 300–400 ккал, белок 1.6 г/кг.\n\n"
+    "## Восстановление\nСон 7–9 часов, растяжка 10 минут после тренировки.\n\n"
+    "## Меры предосторожности\nБоль в суставах — повод снизить нагрузку.\n"
+)
+
+
+@dataclass
+class MockConfig:
+    latency: float = 1.0          # время до ответа (до первого фрагмента при stream)
+    jitter: float = 0.2           # равномерный разброс ± jitter секунд
+    error_rate: float = 0.0       # доля ответов 500
+    chunk_delay: float = 0.02     # пауза между фрагментами потока
+    chunks: int = 40              # на сколько фрагментов резать ответ
+    plan_text: str = PLAN_TEXT
+    seed: int = 0
+    stats: Dict[str, int] = field(default_factory=lambda: {"requests": 0, "errors": 0, "telegram": 0})
+
+
+def _delay(config: MockConfig, rng: random.Random) -> float:
+    return max(0.0, config.latency + rng.uniform(-config.jitter, config.jitter))
+
+
+def _usage(text: str) -> Dict[str, int]:
+    completion = max(1, len(text) // 3)
+    return {"prompt_tokens": 150, "completion_tokens": completion, "total_tokens": 150 + completion}
+
+
+def create_mock_app(config: MockConfig) -> web.Application:
+    rng = random.Random(config.seed)
+    message_ids = iter(range(1, 10 ** 9))
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        config.stats["requests"] += 1
+        if rng.random() < config.error_rate:
+            config.stats["errors"] += 1
+            await asyncio.sleep(_delay(config, rng) / 2)
+            return web.json_response({"error": {"message": "mock failure", "type": "server_error"}}, status=500)
+
+        model = body.get("model", "mock")
+        text = config.plan_text if body.get("max_tokens", 0) > 50 else "OK"
+        created = int(time.time())
+        await asyncio.sleep(_delay(config, rng))
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": _usage(text),
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        size = max(1, len(text) // config.chunks)
+
+        async def send(payload: Dict[str, Any]) -> None:
+            await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode())
+
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model}
+        for i in range(0, len(text), size):
+            await send({**base, "choices": [{"index": 0, "delta": {"content": text[i:i + size]},
+                                             "finish_reason": None}]})
+            await asyncio.sleep(config.chunk_delay)
+        await send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({**base, "choices": [], "usage": _usage(text)})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    async def telegram(request: web.Request) -> web.Response:
+        # Любой метод Bot API: sendMessage/editMessageText получают правдоподобное Message
+        config.stats["telegram"] += 1
+        data = dict(await request.post())
+        chat_id = int(data.get("chat_id") or 1)
+        return web.json_response({"ok": True, "result": {
+            "message_id": int(data.get("message_id") or next(message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": str(data.get("text", "")),
+        }})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", models)
+    app.router.add_post("/bot{token}/{method}", telegram)
+    return app
+
+
+async def start_mock_server(config: MockConfig, host: str = "127.0.0.1",
+                            port: int = 0) -> Tuple[web.AppRunner, str]:
+    """Запуск мока; port=0 — свободный порт. Возвращает runner и базовый URL"""
+    runner = web.AppRunner(create_mock_app(config), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    return runner, f"http://{host}:{bound}"
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Время старта бота: импорт модулей (разбор -X importtime) и готовность
+(Bot, Dispatcher и роутеры созданы, без сети и БД).
+
+Запуск из каталога bot/:
+    python -m benchmarks.startup --runs 5 --top 15
+    python -m benchmarks.startup --output startup.json --baseline startup.json --max-regression 0.2
+
+Каждый прогон — отдельный процесс python, поэтому кэш импортов не мешает
+замеру; первый прогон (компиляция .pyc) не учитывается.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.bench import percentile
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READY_SNIPPET = """
+import time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from aiogram import Dispatcher
+from handlers import start, anketa, trainer_choice
+from utils import create_bot
+bot = create_bot()
+dp = Dispatcher()
+for router_module in (start, anketa, trainer_choice):
+    dp.include_router(router_module.router)
+print(imported - started, time.perf_counter() - started)
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """Строки «import time: self | cumulative | name» → (модуль, глубина, self мкс, cumulative мкс)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_part, cumulative, name = line[len("import time:"):].split("|", 2)
+            self_us, cumulative_us = int(self_part), int(cumulative)
+        except ValueError:
+            continue
+        # Вложенность импорта — по два пробела на уровень
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), depth, self_us, cumulative_us))
+    return rows
+
+
+def _first_party(name: str) -> bool:
+    top = name.split(".")[0]
+    return os.path.exists(os.path.join(BOT_DIR, f"{top}.py")) or os.path.isdir(os.path.join(BOT_DIR, top))
+
+
+def run_once(module: str, env: Dict[str, str]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", READY_SNIPPET.format(module=module)],
+        cwd=BOT_DIR, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        tail = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError("\n".join(tail[-10:]) or f"код выхода {proc.returncode}")
+    imported, ready = (float(value) for value in proc.stdout.split()[-2:])
+    return {"wall": wall, "import": imported, "ready": ready, "modules": parse_importtime(proc.stderr)}
+
+
+def summarize(runs: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+    def ms(values: List[float]) -> Dict[str, Optional[float]]:
+        return {
+            "p50": round(statistics.median(values) * 1000, 1),
+            "p95": round(percentile(values, 95) * 1000, 1),
+            "max": round(max(values) * 1000, 1),
+        }
+
+    self_us: Dict[str, List[int]] = defaultdict(list)
+    cumulative_us: Dict[str, List[int]] = defaultdict(list)
+    for run in runs:
+        for name, _, self_time, cumulative in run["modules"]:
+            self_us[name].append(self_time)
+            cumulative_us[name].append(cumulative)
+
+    def ranked(values: Dict[str, List[int]], names: List[str]) -> List[Dict[str, Any]]:
+        rows = sorted(((statistics.median(values[name]), name) for name in names), reverse=True)
+        return [{"module": name, "ms": round(us / 1000, 1)} for us, name in rows[:top]]
+
+    names = list(self_us)
+    return {
+        "runs": len(runs),
+        "process_ms": ms([run["wall"] for run in runs]),
+        "import_ms": ms([run["import"] for run in runs]),
+        "ready_ms": ms([run["ready"] for run in runs]),
+        "modules_imported": round(statistics.median(len(run["modules"]) for run in runs)),
+        "top_self": ranked(self_us, names),
+        "top_cumulative_first_party": ranked(cumulative_us, [name for name in names if _first_party(name)]),
+    }
+
+
+def check_regression(report: Dict[str, Any], baseline_path: str, max_regression: float) -> List[str]:
+    """Метрики, где медиана выросла больше чем на max_regression"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = []
+    for key in ("import_ms", "ready_ms"):
+        before, now = baseline.get(key, {}).get("p50"), report[key]["p50"]
+        if before and now > before * (1 + max_regression):
+            problems.append(f"{key}: {before} → {now} мс")
+    return problems
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Профиль времени старта бота")
+    parser.add_argument("--module", default="main", help="модуль точки входа")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="сколько модулей показать")
+    parser.add_argument("--output", default="startup.json", help="куда записать JSON-отчёт")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Ключи-заглушки: при импорте ничего не проверяется, но create_bot требует формат токена
+    env = dict(os.environ, BOT_TOKEN=os.getenv("BOT_TOKEN") or "123456:mock")
+    run_once(args.module, env)  # прогрев: .pyc и файловый кэш
+    runs = [run_once(args.module, env) for _ in range(args.runs)]
+
+    summary = summarize(runs, args.top)
+    print(f"процесс p50 {summary['process_ms']['p50']} мс, импорт p50 {summary['import_ms']['p50']} мс, "
+          f"готовность p50 {summary['ready_ms']['p50']} мс, модулей {summary['modules_imported']}")
+    print("Дольше всего (собственное время импорта):")
+    for row in summary["top_self"]:
+        print(f"  {row['ms']:8.1f} мс  {row['module']}")
+    print("Модули бота (вместе с зависимостями):")
+    for row in summary["top_cumulative_first_party"]:
+        print(f"  {row['ms']:8.1f} мс  {row['module']}")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "module": args.module,
+        **summary,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📊 Отчёт: {args.output}")
+
+    if args.baseline:
+        problems = check_regression(report, args.baseline, args.max_regression)
+        for problem in problems:
+            print(f"❌ Регрессия: {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
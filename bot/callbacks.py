@@ -0,0 +1,22 @@
+"""
+Callback-данные inline-кнопок тренера
+"""
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class PlanAction(CallbackData, prefix="plan"):
+    """
+    Действие тренера над анкетой: generate / approve / edit / cancel_edit;
+    plan_id — черновик плана в таблице plans (0 — у кнопки «Сгенерировать»)
+    """
+    action: str
+    anketa_id: int
+    plan_id: int = 0
+
+    @classmethod
+    def unpack(cls, value: str) -> "PlanAction":
+        # Кнопки, отправленные до появления plan_id, — без последней части
+        if value.count(cls.__separator__) == 2:
+            value += f"{cls.__separator__}0"
+        return super().unpack(value)
@@ -3,20 +3,116 @@
 """
 
 import os
+import logging
 
 # Токен бота из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 
 # ID тренера для отправки планов на проверку
-TRAINER_CHAT_ID = os.getenv('TRAINER_CHAT_ID', '')
+# Число: обработчики сравнивают его с from_user.id
+TRAINER_CHAT_ID = int(os.getenv('TRAINER_CHAT_ID', '0') or 0)
 
 # Настройки ProxyAPI
 PROXY_API_KEY = os.getenv('PROXY_API_KEY', '')
 PROXY_MODEL = os.getenv('PROXY_MODEL', 'openai/gpt-5-nano')
 
-# Проверка обязательных переменных
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не установлен в .env файле")
+# Настройки базы данных и пула соединений
+DB_URL = os.getenv('DB_URL', os.getenv('DATABASE_URL', ''))
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '256'))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', '10'))
+DB_AUTO_MIGRATE = os.getenv('DB_AUTO_MIGRATE', '1') == '1'
 
-if not PROXY_API_KEY:
-    print("⚠️  Внимание: PROXY_API_KEY не установлен. Генерация планов будет использовать fallback.")
+# Буфер записи анкет и планов: пачка до WRITE_BUFFER_BATCH строк или раз в WRITE_BUFFER_INTERVAL секунд
+WRITE_BUFFER_BATCH = int(os.getenv('WRITE_BUFFER_BATCH', '200'))
+WRITE_BUFFER_INTERVAL = float(os.getenv('WRITE_BUFFER_INTERVAL', '0.2'))
+WRITE_BUFFER_MAX_PENDING = int(os.getenv('WRITE_BUFFER_MAX_PENDING', '5000'))
+# Ждать ли коммита пачки, прежде чем подтверждать пользователю
+ANKETA_DURABLE_WRITES = os.getenv('ANKETA_DURABLE_WRITES', '1') == '1'
+PLAN_DURABLE_WRITES = os.getenv('PLAN_DURABLE_WRITES', '0') == '1'
+
+# Потоковая генерация: черновик у тренера редактируется по мере поступления текста
+PLAN_STREAMING = os.getenv('PLAN_STREAMING', '1') == '1'
+PLAN_STREAM_EDIT_INTERVAL = float(os.getenv('PLAN_STREAM_EDIT_INTERVAL', '1.5'))
+
+# Бюджет задержки генерации: после PLAN_HEDGE_AFTER с — хедж-запрос (PROXY_HEDGE_MODEL/PROXY_HEDGE_API_URL),
+# после PLAN_SLO_SECONDS с — предварительный план из шаблонов
+PLAN_SLO_SECONDS = float(os.getenv('PLAN_SLO_SECONDS', '20'))
+PLAN_HEDGE_AFTER = float(os.getenv('PLAN_HEDGE_AFTER', '8'))
+
+# Локальные планы без LLM: off, standard (анкеты, полностью покрытые каталогом) или always
+PLAN_OFFLINE_MODE = os.getenv('PLAN_OFFLINE_MODE', 'off')
+
+# Кэш планов по нормализованной анкете
+PLAN_CACHE_SIZE = int(os.getenv('PLAN_CACHE_SIZE', '512'))
+PLAN_CACHE_TTL = float(os.getenv('PLAN_CACHE_TTL', str(7 * 24 * 3600)))
+PLAN_CACHE_DB = os.getenv('PLAN_CACHE_DB', '0') == '1'
+
+# Одинаковые одновременные генерации (та же анкета и тот же промпт) выполняются
+# один раз; готовый результат отдаётся повторным запросам ещё PLAN_COALESCE_WINDOW секунд
+PLAN_COALESCE_WINDOW = float(os.getenv('PLAN_COALESCE_WINDOW', '5'))
+
+# Правки тренера: переписывать только затронутые разделы плана, если правка
+# касается не больше PLAN_REVISION_MAX_SHARE разделов (иначе план целиком)
+PLAN_REVISION = os.getenv('PLAN_REVISION', '1') == '1'
+PLAN_REVISION_MAX_SHARE = float(os.getenv('PLAN_REVISION_MAX_SHARE', '0.6'))
+
+# Очередь генераций: memory (в памяти процесса) или postgres (таблица plan_jobs)
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# postgres: задача, чья аренда не продлевалась JOB_LEASE_SECONDS (воркер упал), выдаётся снова
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '120'))
+# Веса заказчиков в справедливой очереди: '{"<telegram id>": 2}', по умолчанию 1
+JOB_FAIR_WEIGHTS = os.getenv('JOB_FAIR_WEIGHTS', '')
+
+# Контроль допуска: событий в секунду и запас (burst) на пользователя и на тренера,
+# не больше GENERATION_MAX_IN_FLIGHT генераций одновременно на процесс
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', '1'))
+ADMISSION_USER_BURST = float(os.getenv('ADMISSION_USER_BURST', '10'))
+ADMISSION_TRAINER_RATE = float(os.getenv('ADMISSION_TRAINER_RATE', '3'))
+ADMISSION_TRAINER_BURST = float(os.getenv('ADMISSION_TRAINER_BURST', '30'))
+GENERATION_MAX_IN_FLIGHT = int(os.getenv('GENERATION_MAX_IN_FLIGHT', '4'))
+
+# Соединения с api.telegram.org (общий Bot на процесс)
+TELEGRAM_CONNECTION_LIMIT = int(os.getenv('TELEGRAM_CONNECTION_LIMIT', '100'))
+TELEGRAM_KEEPALIVE_TIMEOUT = float(os.getenv('TELEGRAM_KEEPALIVE_TIMEOUT', '60'))
+
+# Хранилище FSM: memory, postgres (таблица fsm_state) или redis
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Незаполненные анкеты и брошенные правки живут не дольше FSM_TTL секунд
+FSM_TTL = float(os.getenv('FSM_TTL', str(24 * 3600)))
+# 0 — сквозная запись FSM (по умолчанию); > 0 — буфер в процессе: быстрее, но другие
+# процессы в это окно видят старое состояние, а при падении записи теряются
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0'))
+FSM_BATCH_SIZE = int(os.getenv('FSM_BATCH_SIZE', '100'))
+
+# Webhook вместо long polling: включается, если задан WEBHOOK_URL
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Сколько апдейтов одна реплика обрабатывает одновременно
+WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', '64'))
+# Сколько принятых апдейтов может ждать обработки; сверх — 429, Telegram повторит позже
+WEBHOOK_MAX_BACKLOG = int(os.getenv('WEBHOOK_MAX_BACKLOG', str(WEBHOOK_CONCURRENCY * 4)))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+
+def validate_config() -> None:
+    """
+    Проверка обязательных переменных при запуске бота (не при импорте:
+    скрипты, бенчмарки и воркеры импортируют config без токена)
+    """
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN не установлен в .env файле")
+
+    if not PROXY_API_KEY:
+        logging.getLogger(__name__).warning(
+            "⚠️ PROXY_API_KEY не установлен. Генерация планов будет использовать fallback."
+        )
@@ -1,34 +1,410 @@
-FALLBACK_PLANS = {
-    "beginner_weight_loss": """Базовый план для новичка (похудение):
-    
-    1. Кардио (3-4 раза в неделю):
-       - Бег/ходьба: 30 минут
-       - Велосипед: 20 минут
-       
-    2. Силовые тренировки (2-3 раза):
-       - Приседания: 3х15
-       - Отжимания: 3х10
-       - Планка: 3х30 секунд
-       
-    Питание:
-    - Дефицит калорий 300-500 ккал
-    - Белок: 1.5г на кг веса
-    - Пить 2+ литра воды""",
-    
-    "beginner_muscle_gain": """Базовый план для набора массы:
-    
-    1. Силовые тренировки (3-4 раза):
-       - Жим штанги: 4х8
-       - Тяга: 4х8
-       - Приседания: 4х8
-       
-    Питание:
-    - Профицит калорий 300-500 ккал
-    - Белок: 2г на кг веса
-    - Углеводы перед тренировкой"""
-}
-
-def get_fallback_plan(fitness_level="beginner", goal="weight_loss"):
+"""
+Локальный генератор планов без обращения к LLM
+
+План на 4 недели собирается из каталога упражнений и питания. Каталог
+индексируется по цели, уровню, противопоказаниям и диапазону ИМТ; таблицы
+строятся один раз при импорте, поэтому сборка плана — это несколько
+обращений к словарям и форматирование строки (доли миллисекунды).
+"""
+
+import re
+from itertools import product
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+GOALS = ("weight_loss", "muscle_gain", "endurance", "general")
+LEVELS = ("beginner", "intermediate", "advanced")
+BMI_BANDS = ("under", "normal", "over", "obese")
+
+# Противопоказания: тег -> основы слов, по которым он ищется в поле «травмы»
+INJURY_TAGS: Dict[str, Tuple[str, ...]] = {
+    "knees": ("колен", "мениск", "крестообраз"),
+    "back": ("спин", "поясниц", "позвон", "грыж", "протруз", "сколиоз"),
+    "shoulders": ("плеч", "ротатор", "ключиц"),
+    "wrists": ("запяст", "кист", "локт", "локоть"),
+    "heart": ("сердц", "давлен", "гиперто", "аритм"),
+}
+_TAG_BITS = {tag: 1 << i for i, tag in enumerate(INJURY_TAGS)}
+# Ударная нагрузка (прыжки, бег) исключается при травмах колен и при ИМТ 35+
+_IMPACT = _TAG_BITS["knees"] | _TAG_BITS["heart"]
+
+_GOAL_WORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("weight_loss", ("похуд", "сброс", "снизить вес", "снижение веса", "жир", "сушк")),
+    ("muscle_gain", ("масс", "мышц", "набор", "рельеф", "сил")),
+    ("endurance", ("вынослив", "марафон", "бег", "кардио", "дыхан")),
+    ("general", ("здоров", "тонус", "самочувств", "укреп", "осанк", "гибк")),
+)
+# Основы ищутся с начала слова: «сил» — это «сила», «силовые», но не «усилить»
+_GOAL_RES = tuple(
+    (goal, re.compile(rf"\b(?:{'|'.join(re.escape(word) for word in words)})"))
+    for goal, words in _GOAL_WORDS
+)
+
+_LEVEL_WORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("advanced", ("продвинут", "опытн", "профи", "advanced")),
+    ("intermediate", ("средн", "любител", "intermediate")),
+    ("beginner", ("начина", "новичок", "beginner", "нет опыта")),
+)
+
+# Перечисление травм в анкете: «колено, астма», «спина и давление»
+_INJURY_SPLIT = re.compile(r"[,;/\n]|\s(?:и|а также|плюс)\s")
+
+_NO_INJURIES = {"", "нет", "нету", "no", "none", "-", "—", "не", "отсутствуют", "нет травм"}
+
+
+class Exercise(NamedTuple):
+    name: str
+    # lower | upper | core | cardio | mobility
+    category: str
+    min_level: int
+    contraindications: Tuple[str, ...] = ()
+
+
+EXERCISES: Tuple[Exercise, ...] = (
+    # Ноги и ягодицы
+    Exercise("Ягодичный мостик", "lower", 0),
+    Exercise("Приседания с собственным весом", "lower", 0, ("knees",)),
+    Exercise("Подъёмы на носки", "lower", 0),
+    Exercise("Отведение ноги лёжа на боку", "lower", 0),
+    Exercise("Выпады назад", "lower", 1, ("knees",)),
+    Exercise("Румынская тяга с гантелями", "lower", 1, ("back",)),
+    Exercise("Жим ногами в тренажёре", "lower", 1, ("knees",)),
+    Exercise("Приседания со штангой", "lower", 2, ("knees", "back")),
+    Exercise("Болгарские сплит-приседания", "lower", 2, ("knees",)),
+    # Верх тела
+    Exercise("Тяга резинового амортизатора к поясу", "upper", 0),
+    Exercise("Тяга верхнего блока к груди", "upper", 0, ("shoulders",)),
+    Exercise("Отжимания от скамьи", "upper", 0, ("wrists",)),
+    Exercise("Тяга гантели в наклоне с опорой", "upper", 1, ("back",)),
+    Exercise("Жим гантелей сидя", "upper", 1, ("shoulders",)),
+    Exercise("Отжимания от пола", "upper", 1, ("wrists", "shoulders")),
+    Exercise("Подтягивания", "upper", 2, ("shoulders",)),
+    Exercise("Жим штанги лёжа", "upper", 2, ("shoulders", "wrists")),
+    # Кор
+    Exercise("Мёртвый жук", "core", 0),
+    Exercise("Птица-собака", "core", 0),
+    Exercise("Планка на предплечьях", "core", 0),
+    Exercise("Скручивания лёжа", "core", 0, ("back",)),
+    Exercise("Боковая планка", "core", 1, ("shoulders",)),
+    Exercise("Подъём ног в висе", "core", 2, ("shoulders", "back")),
+    # Кардио
+    Exercise("Быстрая ходьба", "cardio", 0),
+    Exercise("Велотренажёр", "cardio", 0),
+    Exercise("Эллиптический тренажёр", "cardio", 0),
+    Exercise("Плавание", "cardio", 0, ("shoulders",)),
+    Exercise("Гребной тренажёр", "cardio", 1, ("back",)),
+    Exercise("Бег трусцой", "cardio", 1, ("knees", "heart")),
+    Exercise("Скакалка", "cardio", 1, ("knees", "heart")),
+    Exercise("Интервальный бег", "cardio", 2, ("knees", "heart")),
+    # Мобильность
+    Exercise("Кошка-корова", "mobility", 0),
+    Exercise("Растяжка сгибателей бедра", "mobility", 0),
+    Exercise("Мобилизация грудного отдела", "mobility", 0),
+    Exercise("Растяжка задней поверхности бедра", "mobility", 0, ("back",)),
+)
+
+# Подходы и повторения по цели и уровню
+_DOSAGE: Dict[Tuple[str, int], str] = {
+    ("weight_loss", 0): "3×15", ("weight_loss", 1): "3×15–20", ("weight_loss", 2): "4×15–20",
+    ("muscle_gain", 0): "3×10–12", ("muscle_gain", 1): "4×8–10", ("muscle_gain", 2): "5×6–8",
+    ("endurance", 0): "2×15–20", ("endurance", 1): "3×20", ("endurance", 2): "4×20–25",
+    ("general", 0): "3×12", ("general", 1): "3×12–15", ("general", 2): "4×12",
+}
+# Упражнения на кор: повторения или удержание
+_CORE_DOSAGE = ("3×10 / 30 с", "3×12 / 45 с", "4×12 / 60 с")
+# Минут кардио за тренировку по цели и уровню
+_CARDIO_MINUTES: Dict[Tuple[str, int], int] = {
+    ("weight_loss", 0): 25, ("weight_loss", 1): 35, ("weight_loss", 2): 40,
+    ("muscle_gain", 0): 10, ("muscle_gain", 1): 15, ("muscle_gain", 2): 15,
+    ("endurance", 0): 30, ("endurance", 1): 45, ("endurance", 2): 60,
+    ("general", 0): 20, ("general", 1): 25, ("general", 2): 30,
+}
+# Сколько упражнений каждой категории в тренировке
+_PER_SESSION = {"lower": 2, "upper": 2, "core": 2, "mobility": 2}
+_SESSIONS_PER_WEEK = (3, 4, 5)
+
+# Типы тренировок по уровню: (название, категории силовой части)
+_SESSION_TEMPLATES: Tuple[Tuple[Tuple[str, Tuple[str, ...]], ...], ...] = (
+    (("Всё тело", ("lower", "upper", "core")),
+     ("Всё тело + кардио", ("lower", "upper", "core")),
+     ("Кардио и мобильность", ())),
+    (("Ноги и кор", ("lower", "core")),
+     ("Верх тела", ("upper", "core")),
+     ("Кардио и мобильность", ()),
+     ("Всё тело", ("lower", "upper", "core"))),
+    (("Ноги", ("lower", "core")),
+     ("Верх тела", ("upper", "core")),
+     ("Кардио (интервалы)", ()),
+     ("Всё тело", ("lower", "upper", "core")),
+     ("Кардио и мобильность", ())),
+)
+
+_WEEKS = (
+    ("Неделя 1 — адаптация", "техника, умеренный темп, RPE 6 из 10"),
+    ("Неделя 2 — объём", "+1 подход в первых двух упражнениях, кардио +5 минут"),
+    ("Неделя 3 — интенсивность", "+10–15% к весу или темпу, отдых между подходами 60–90 с"),
+    ("Неделя 4 — разгрузка и контроль", "объём −30%, в конце недели замер веса, обхватов и самочувствия"),
+)
+
+# Питание: (калорийность, белок г/кг, пример дня)
+_NUTRITION: Dict[str, Tuple[str, float, Tuple[str, ...]]] = {
+    "weight_loss": ("дефицит 300–500 ккал от поддержания", 1.6, (
+        "Завтрак: омлет из 2 яиц с овощами, цельнозерновой хлеб",
+        "Обед: куриная грудка, гречка, салат из свежих овощей",
+        "Перекус: греческий йогурт или творог 5%",
+        "Ужин: запечённая рыба с овощами",
+    )),
+    "muscle_gain": ("профицит 250–400 ккал", 1.8, (
+        "Завтрак: овсянка на молоке с бананом и орехами, 2 яйца",
+        "Обед: говядина или индейка, рис, овощи",
+        "Перекус: творог с ягодами, горсть орехов",
+        "Ужин: лосось, картофель, овощной салат",
+        "Перед сном: кефир или казеиновый коктейль",
+    )),
+    "endurance": ("поддержание веса, углеводы 5–7 г/кг в дни тренировок", 1.4, (
+        "Завтрак: овсянка с фруктами, йогурт",
+        "Обед: паста из твёрдых сортов, курица, овощи",
+        "Перекус за 1–2 часа до тренировки: банан, хлебцы",
+        "Ужин: рыба, рис, тушёные овощи",
+    )),
+    "general": ("поддержание веса", 1.3, (
+        "Завтрак: творог или яйца, каша, фрукты",
+        "Обед: белок + крупа + овощи (правило тарелки)",
+        "Перекус: фрукты, орехи",
+        "Ужин: белок и овощи",
+    )),
+}
+_BMI_NOTES = {
+    "under": "Вес ниже нормы: калорийность не снижать, добавить 300 ккал к поддержанию.",
+    "normal": "",
+    "over": "Избыточный вес: упор на шаги (8–10 тыс. в день) и регулярность.",
+    "obese": "ИМТ 35+: только нагрузка без ударов и прыжков, контроль пульса (до 130 уд/мин).",
+}
+
+_INJURY_NOTES = {
+    "knees": "колени — без прыжков и глубоких приседаний, амплитуда без боли",
+    "back": "спина — без осевой нагрузки, нейтральная поясница, больше упражнений на кор",
+    "shoulders": "плечи — без жимов над головой, вес умеренный",
+    "wrists": "запястья/локти — упор на кулаках или с ручками, без лишнего веса",
+    "heart": "сердце/давление — пульс до 130 уд/мин, без задержки дыхания, согласовать с врачом",
+}
+
+
+class PlanProfile(NamedTuple):
+    """Профиль клиента в терминах каталога"""
+    goal: str
+    level: str
+    injury_mask: int
+    bmi_band: str
+    # все поля анкеты распознаны однозначно
+    standard: bool
+    # травмы из анкеты, которых нет в каталоге противопоказаний
+    unknown_injuries: Tuple[str, ...] = ()
+
+
+def _bmi_band(height: Optional[int], weight: Optional[int]) -> Optional[str]:
+    if not height or not weight or height < 100:
+        return None
+    bmi = weight / (height / 100) ** 2
+    if bmi < 18.5:
+        return "under"
+    if bmi < 25:
+        return "normal"
+    if bmi < 35:
+        return "over"
+    return "obese"
+
+
+def _number(value: Any) -> Optional[int]:
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+
+def _match(text: str, table: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Optional[str]:
+    for key, words in table:
+        if any(word in text for word in words):
+            return key
+    return None
+
+
+def _goals(text: str) -> List[str]:
+    """Все цели, упомянутые в тексте, в порядке таблицы"""
+    return [goal for goal, pattern in _GOAL_RES if pattern.search(text)]
+
+
+def profile_from_anketa(data: Dict[str, Any]) -> PlanProfile:
+    """Разбор анкеты: цель, уровень, противопоказания, диапазон ИМТ"""
+    goals = _goals(str(data.get("goals") or "").lower().replace("ё", "е"))
+    # Несколько целей сразу шаблон не совмещает — такую анкету решает LLM
+    goal = goals[0] if goals else None
+
+    level_text = str(data.get("fitness_level") or "").lower()
+    level = _match(level_text, _LEVEL_WORDS) or ("beginner" if not level_text else None)
+
+    injuries = re.sub(r"\s+", " ", str(data.get("injuries") or "").lower()).strip(" .!")
+    mask = 0
+    unknown: List[str] = []
+    if injuries not in _NO_INJURIES:
+        # Каждая перечисленная травма должна найтись в каталоге, иначе план её не учитывает
+        for part in _INJURY_SPLIT.split(injuries):
+            part = part.strip(" .!-—")
+            if not part or part in _NO_INJURIES:
+                continue
+            tags = [tag for tag, stems in INJURY_TAGS.items() if any(stem in part for stem in stems)]
+            for tag in tags:
+                mask |= _TAG_BITS[tag]
+            if not tags:
+                unknown.append(part)
+
+    band = _bmi_band(_number(data.get("height")), _number(data.get("weight")))
+
+    standard = len(goals) == 1 and level is not None and not unknown and band is not None
+    return PlanProfile(goal or "general", level or "beginner", mask, band or "normal", standard,
+                       tuple(unknown))
+
+
+def _build_exercise_index() -> Dict[Tuple[str, int], Tuple[Tuple[str, int], ...]]:
+    """(категория, уровень) -> ((название, маска противопоказаний), ...) в порядке приоритета"""
+    index: Dict[Tuple[str, int], List[Tuple[str, int]]] = {}
+    for level in range(len(LEVELS)):
+        for exercise in EXERCISES:
+            if exercise.min_level > level:
+                continue
+            mask = 0
+            for tag in exercise.contraindications:
+                mask |= _TAG_BITS[tag]
+            index.setdefault((exercise.category, level), []).append((exercise.name, mask))
+        # Для опытных первыми идут упражнения своего уровня
+        for key in [k for k in index if k[1] == level]:
+            names = {e.name: e.min_level for e in EXERCISES}
+            index[key].sort(key=lambda item: -names[item[0]])
+    return {key: tuple(value) for key, value in index.items()}
+
+
+# Таблицы строятся один раз при импорте
+_EXERCISE_INDEX = _build_exercise_index()
+
+
+def _pick(category: str, level: int, mask: int, count: int, offset: int = 0) -> List[str]:
+    """Первые count подходящих упражнений; offset сдвигает выбор, чтобы дни не повторялись"""
+    allowed = [name for name, contra in _EXERCISE_INDEX.get((category, level), ())
+               if not contra & mask]
+    if not allowed:
+        return []
+    start = offset * count % len(allowed)
+    return [allowed[(start + i) % len(allowed)] for i in range(min(count, len(allowed)))]
+
+
+def _build_plan_body(goal: str, level_name: str, mask: int, band: str) -> str:
+    """Неизменная часть плана для профиля (без имени и веса клиента)"""
+    level = LEVELS.index(level_name)
+    # Исключения для подбора упражнений; меры предосторожности — только по травмам клиента
+    exclude = mask | _IMPACT if band == "obese" else mask
+    dosage = _DOSAGE[(goal, level)]
+    cardio_minutes = _CARDIO_MINUTES[(goal, level)]
+    cardio = _pick("cardio", level, exclude, 2) or ["Быстрая ходьба"]
+
+    lines = ["## Расписание тренировок", ""]
+    for day, (title, categories) in enumerate(_SESSION_TEMPLATES[level], start=1):
+        lines.append(f"День {day}: {title}")
+        for category in categories:
+            amount = _CORE_DOSAGE[level] if category == "core" else dosage
+            for name in _pick(category, level, exclude, _PER_SESSION[category], day - 1):
+                lines.append(f"• {name} — {amount}")
+        if categories:
+            lines.append(f"• Кардио: {cardio[0].lower()} — {max(10, cardio_minutes // 2)} мин")
+        else:
+            lines.append(f"• {cardio[-1]} — {cardio_minutes} мин в комфортном темпе")
+            for name in _pick("mobility", level, exclude, _PER_SESSION["mobility"], day - 1):
+                lines.append(f"• {name} — 2×40 с")
+        lines.append("")
+
+    lines += ["## Прогрессия по неделям", ""]
+    for title, note in _WEEKS:
+        lines.append(f"• {title}: {note}")
+    lines.append("")
+
+    calories, _, menu = _NUTRITION[goal]
+    lines += ["## Питание", "", f"• Калорийность: {calories}"]
+    lines += [f"• {meal}" for meal in menu]
+    if _BMI_NOTES[band]:
+        lines.append(f"• {_BMI_NOTES[band]}")
+    lines.append("")
+
+    lines += ["## Восстановление", "",
+              "• Сон 7–9 часов, не менее 1 дня полного отдыха в неделю",
+              "• Разминка 5–10 минут перед каждой тренировкой, заминка и растяжка после",
+              ""]
+
+    cautions = [note for tag, note in _INJURY_NOTES.items() if mask & _TAG_BITS[tag]]
+    lines += ["## Меры предосторожности", ""]
+    lines += [f"• {note}" for note in cautions] or ["• При острой боли упражнение прекратить"]
+    if cautions:
+        lines.append("• При острой боли упражнение прекратить")
+    return "\n".join(lines)
+
+
+# Все профили (цель × уровень × противопоказания × ИМТ) собираются при импорте:
+# около 1.5 тыс. текстов, первый запрос любого профиля — уже поиск в словаре
+_PLAN_BODIES: Dict[Tuple[str, str, int, str], str] = {
+    key: _build_plan_body(*key)
+    for key in product(GOALS, LEVELS, range(1 << len(INJURY_TAGS)), BMI_BANDS)
+}
+
+
+def _plan_body(goal: str, level_name: str, mask: int, band: str) -> str:
+    return _PLAN_BODIES[(goal, level_name, mask, band)]
+
+
+_GOAL_TITLES = {
+    "weight_loss": "снижение веса",
+    "muscle_gain": "набор мышечной массы",
+    "endurance": "выносливость",
+    "general": "общее укрепление здоровья",
+}
+_LEVEL_TITLES = {"beginner": "начальный", "intermediate": "средний", "advanced": "продвинутый"}
+
+
+def build_plan(data: Dict[str, Any], profile: Optional[PlanProfile] = None) -> str:
+    """Полный 4-недельный план по анкете без обращения к сети"""
+    profile = profile or profile_from_anketa(data)
+    weight = _number(data.get("weight"))
+    _, protein_per_kg, _ = _NUTRITION[profile.goal]
+
+    header = [
+        f"# План на 4 недели для {data.get('name') or 'клиента'}",
+        "",
+        f"Цель: {_GOAL_TITLES[profile.goal]} • Уровень: {_LEVEL_TITLES[profile.level]} • "
+        f"{_SESSIONS_PER_WEEK[LEVELS.index(profile.level)]} тренировки в неделю",
+    ]
+    if weight:
+        header.append(f"Белок: {round(weight * protein_per_kg)} г в день • Вода: {weight * 30 / 1000:.1f} л в день")
+    if profile.unknown_injuries:
+        # В начале плана: тренер видит это в превью черновика
+        header.append(f"⚠️ Не учтены ограничения: {', '.join(profile.unknown_injuries)} — "
+                      "упражнения под них не подбирались, проверьте план вручную")
+    header.append("")
+    return "\n".join(header) + "\n" + _plan_body(profile.goal, profile.level, profile.injury_mask, profile.bmi_band)
+
+
+def is_standard_profile(data: Dict[str, Any]) -> bool:
+    """Анкета полностью покрывается каталогом и может обойтись без LLM"""
+    return profile_from_anketa(data).standard
+
+
+def build_fallback_plan(data: Dict[str, Any]) -> str:
+    """Резервный план с данными клиента (когда LLM недоступна или не успела)"""
+    return build_plan(data)
+
+
+def get_fallback_plan(fitness_level: str = "beginner", goal: str = "weight_loss") -> str:
     """Получение резервного плана тренировок"""
-    key = f"{fitness_level}_{goal}"
-    return FALLBACK_PLANS.get(key, FALLBACK_PLANS.get("beginner_weight_loss"))
+    level = fitness_level if fitness_level in LEVELS else "beginner"
+    goal = goal if goal in GOALS else "weight_loss"
+    return _plan_body(goal, level, 0, "normal")
+
+
+# Совместимость со старым словарём "{level}_{goal}" -> план
+FALLBACK_PLANS = {
+    f"{level}_{goal}": get_fallback_plan(level, goal)
+    for level in LEVELS for goal in GOALS
+}
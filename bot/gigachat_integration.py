@@ -4,15 +4,20 @@
 """
 
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, List
 
 logger = logging.getLogger(__name__)
 
-# Пробуем использовать ProxyAPI
-try:
+from proxy_openai_integration import OPENAI_AVAILABLE
+
+# ProxyAPI, если установлен openai SDK
+if OPENAI_AVAILABLE:
     from proxy_openai_integration import generate_plan as proxy_generate_plan
     from proxy_openai_integration import generate_plan_with_edit as proxy_generate_plan_with_edit
-    from proxy_openai_integration import proxy_api
+    from proxy_openai_integration import get_proxy_api
+    from proxy_openai_integration import close_async_proxy_api
+    from proxy_openai_integration import PROMPT_VERSION
+    from llm_providers import build_default_registry, ProviderRegistry
     
     logger.info("✅ Используется OpenAI через ProxyAPI")
     
@@ -23,40 +28,60 @@ try:
     def generate_plan_with_edit(data: Dict[str, Any], edit_text: str) -> Optional[str]:
         return proxy_generate_plan_with_edit(data, edit_text)
     
-    # Для обратной совместимости
-    gigachat_api = proxy_api
+    # Асинхронные версии идут через реестр провайдеров
+    _registry: Optional[ProviderRegistry] = None
+    
+    def get_registry() -> ProviderRegistry:
+        global _registry
+        if _registry is None:
+            _registry = build_default_registry()
+        return _registry
+    
+    async def generate_plan_async(data: Dict[str, Any]) -> Optional[str]:
+        return await get_registry().generate_plan(data)
+    
+    async def generate_plan_with_edit_async(data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        return await get_registry().generate_plan_with_edit(data, edit_text)
+    
+    async def revise_section_async(data: Dict[str, Any], section: str, edit_text: str,
+                                   titles: Optional[List[str]] = None) -> Optional[str]:
+        return await get_registry().revise_section(data, section, edit_text, titles)
+    
+    def stream_plan_async(data: Dict[str, Any]) -> AsyncIterator[str]:
+        return get_registry().stream_plan(data)
     
-except ImportError as e:
-    logger.error(f"❌ Ошибка импорта ProxyAPI: {e}")
+    async def hedge_generate_plan_async(data: Dict[str, Any]) -> Optional[str]:
+        # Хедж начинает со второго по скорости провайдера
+        return await get_registry().generate_plan(data, skip=1)
+    
+    def hedge_enabled() -> bool:
+        return len(get_registry()) >= 2
+    
+    async def close_llm_providers() -> None:
+        global _registry
+        if _registry is not None:
+            await _registry.aclose()
+            _registry = None
+    
+    # Для обратной совместимости: gigachat_api — синхронный клиент, создаётся при первом обращении
+    def __getattr__(name: str) -> Any:
+        if name == "gigachat_api":
+            return get_proxy_api()
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    
+else:
+    logger.error("❌ ProxyAPI недоступен: не установлен пакет openai")
     
     # Fallback на простые шаблоны
     logger.info("🔄 Используем автономные шаблоны")
     
-    FALLBACK_PLANS = [
-        """️ **ФИТНЕС-ПЛАН** (4 недели)
-
-**НЕДЕЛЯ 1-2: АДАПТАЦИЯ**
-- Кардио: 30 мин, 3 раза/неделю
-- Силовые: приседания, отжимания, планка
-
-**НЕДЕЛЯ 3-4: ПРОГРЕСС**
-- Увеличить нагрузку на 20%
-- Добавить новые упражнения""",
-    ]
+    from fallback_plans import build_fallback_plan
     
-    import random
+    PROMPT_VERSION = "fallback"
     
     def generate_plan(data: Dict[str, Any]) -> Optional[str]:
-        plan = random.choice(FALLBACK_PLANS)
-        personalized = f"""**ПЛАН ДЛЯ {data.get('name', 'клиента')}**
-
-Данные:
-• Возраст: {data.get('age', 'Н/Д')}
-• Цели: {data.get('goals', 'общее укрепление')}
-• Ограничения: {data.get('injuries', 'нет')}
-
-{plan}"""
-        return personalized
+        # Детерминированный план из локального каталога
+        return build_fallback_plan(data)
     
     def generate_plan_with_edit(data: Dict[str, Any], edit_text: str) -> Optional[str]:
         base_plan = generate_plan(data)
@@ -66,6 +91,38 @@ except ImportError as e:
 
 {base_plan}"""
     
+    async def generate_plan_async(data: Dict[str, Any]) -> Optional[str]:
+        return generate_plan(data)
+    
+    async def generate_plan_with_edit_async(data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        return generate_plan_with_edit(data, edit_text)
+    
+    async def revise_section_async(data: Dict[str, Any], section: str, edit_text: str,
+                                   titles: Optional[List[str]] = None) -> Optional[str]:
+        # Шаблоны не переписываются по разделам — план собирается целиком
+        return None
+    
+    async def stream_plan_async(data: Dict[str, Any]) -> AsyncIterator[str]:
+        # Шаблон готов сразу, отдаём его одним фрагментом
+        plan = generate_plan(data)
+        if plan:
+            yield plan
+    
+    async def hedge_generate_plan_async(data: Dict[str, Any]) -> Optional[str]:
+        return None
+    
+    def hedge_enabled() -> bool:
+        return False
+    
+    async def close_async_proxy_api() -> None:
+        return None
+    
+    def get_registry() -> None:
+        return None
+    
+    async def close_llm_providers() -> None:
+        return None
+    
     class DummyAPI:
         def test_connection(self):
             return False
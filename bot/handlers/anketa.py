@@ -53,7 +53,8 @@ async def process_injuries(message: Message, state: FSMContext) -> None:
     data["user_id"] = user.id
     data["username"] = user.username or "не_указан"
 
-    await save_anketa(data)
+    # id анкеты уходит тренеру в callback_data кнопок
+    data["id"] = await save_anketa(data)
     await send_to_trainer(data)
 
     await message.answer("Спасибо! Анкета отправлена тренеру на проверку.")
@@ -1,41 +1,61 @@
-from aiogram import Router, types
+import re
+from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message
 from aiogram.filters import Command
-from typing import Dict, Any, Optional
+from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from typing import Dict, Any, List, Optional
 import asyncio
+import time
 from aiogram import Bot
-from utils import generate_plan, generate_plan_with_edit, get_last_anketa, save_plan, token_refresher_task
-from config import TRAINER_CHAT_ID, BOT_TOKEN
+from utils import (
+    generate_plan, generate_plan_slo, generate_plan_with_edit, stream_plan, get_anketa,
+    save_plan, approve_plan, revert_plan_approval, get_plan_text, get_bot
+)
+from utils.hedging import GenerationResult, record_served, finish_in_background
+from fallback_plans import build_fallback_plan
+from callbacks import PlanAction
+from states.trainer import TrainerStates
+from utils.jobs import JobQueue, GenerationJob, create_job_backend
+from utils.admission import generation_slots, fair_weights
+from config import (
+    TRAINER_CHAT_ID, PLAN_STREAMING, PLAN_STREAM_EDIT_INTERVAL, PLAN_SLO_SECONDS,
+    JOB_BACKEND, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_LEASE_SECONDS
+)
 
 router = Router()
 
-# Храним состояние ожидания правок
-awaiting_edits: Dict[int, Dict[str, Any]] = {}
-
-# Флаг для отслеживания запуска фоновой задачи
-_token_refresher_started = False
-
-# --- 1. Инициализация фоновой задачи ---
-async def start_token_refresher():
-    """Запуск фоновой задачи обновления токена"""
-    global _token_refresher_started
-    if not _token_refresher_started:
-        _token_refresher_started = True
-        asyncio.create_task(token_refresher_task())
-        print("✅ Фоновая задача обновления токена запущена")
+# Предел длины одного сообщения Telegram
+TELEGRAM_TEXT_LIMIT = 4096
 
 # --- 2. Отправка плана тренеру с кнопками ---
-async def send_plan_to_trainer(plan_text: str, user_data: Dict[str, Any]) -> None:
-    """Отправка сгенерированного плана тренеру на проверку"""
-    bot = Bot(token=BOT_TOKEN)
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[
+def _review_keyboard(anketa_id: int, plan_id: int) -> InlineKeyboardMarkup:
+    # id анкеты и черновика едут в callback_data: не ищем «последнюю» анкету и не разбираем текст
+    return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Устроил", callback_data="approve"),
-            InlineKeyboardButton(text="📝 Внести правки", callback_data="edit")
+            InlineKeyboardButton(
+                text="✅ Устроил",
+                callback_data=PlanAction(action="approve", anketa_id=anketa_id, plan_id=plan_id).pack()
+            ),
+            InlineKeyboardButton(
+                text="📝 Внести правки",
+                callback_data=PlanAction(action="edit", anketa_id=anketa_id, plan_id=plan_id).pack()
+            )
         ]
     ])
-    
+
+async def _save_draft(plan_text: str, user_data: Dict[str, Any]) -> int:
+    """Черновик — строка в plans целиком (у тренера только начало); 0 — не сохранён"""
+    # Ждём записи: кнопка с id не должна появиться раньше строки в БД
+    plan_id = await save_plan({
+        "user_id": user_data.get("user_id"),
+        "plan_text": plan_text,
+        "status": "draft"
+    }, durable=True)
+    return plan_id or 0
+
+def _draft_text(plan_text: str, user_data: Dict[str, Any], provisional: bool = False) -> str:
+    """Текст черновика для тренера"""
     username = user_data.get('username', 'не_указан')
     user_id = user_data.get('user_id', 'N/A')
     
@@ -44,13 +64,25 @@ async def send_plan_to_trainer(plan_text: str, user_data: Dict[str, Any]) -> Non
     if len(plan_text) > 800:
         plan_preview += "..."
     
-    text = f"""
+    # Шаблонный план помечаем, чтобы тренер не утвердил его не глядя
+    note = "\n⚠️ _Предварительный план из шаблона: нейросеть не ответила вовремя._\n" if provisional else ""
+    
+    return f"""
 📋 *Черновик плана для @{username} (ID: {user_id})*
-
+{note}
 {plan_preview}
 
 _Нажмите кнопку ниже или напишите текст правки._
 """
+
+async def send_plan_to_trainer(plan_text: str, user_data: Dict[str, Any], bot: Optional[Bot] = None,
+                               provisional: bool = False) -> None:
+    """Отправка сгенерированного плана тренеру на проверку"""
+    # Общий бот с прогретой HTTP-сессией, сессию не закрываем
+    bot = bot or get_bot()
+    
+    kb = _review_keyboard(user_data["id"], await _save_draft(plan_text, user_data))
+    text = _draft_text(plan_text, user_data, provisional)
     
     try:
         await bot.send_message(
@@ -61,104 +93,302 @@ _Нажмите кнопку ниже или напишите текст пра
         )
     except Exception as e:
         print(f"Ошибка отправки тренеру: {e}")
-    finally:
-        await bot.session.close()
 
-# --- 3. Обработка реакции "+" от тренера ---
-@router.message(lambda m: m.text and m.text.strip() == "+")
-async def trainer_plus_reaction(message: Message):
-    """Обработка '+' для генерации плана"""
-    if not message.from_user or not message.bot:
-        return
+async def _safe_edit(bot: Bot, chat_id: Any, message_id: int, text: str, **kwargs: Any) -> bool:
+    """Редактирование черновика; False, если Telegram попросил подождать"""
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, **kwargs)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        return False
+    except TelegramBadRequest as e:
+        # Текст не изменился или Markdown ещё не закрыт — не критично
+        if "not modified" not in str(e):
+            print(f"Ошибка редактирования черновика: {e}")
+    return True
+
+async def _drain_late(first: "asyncio.Future[str]", stream: Any) -> None:
+    """Опоздавший поток дочитывается до конца: stream_plan сам положит план в кэш"""
+    await first
+    async for _ in stream:
+        pass
+
+async def stream_plan_to_trainer(bot: Bot, user_data: Dict[str, Any],
+                                 state: Optional[Dict[str, Any]] = None) -> Optional[GenerationResult]:
+    """
+    Потоковая генерация: черновик у тренера обновляется по мере поступления текста.
+    state (payload задачи) хранит id сообщения-черновика, чтобы повтор задачи
+    редактировал то же сообщение, а не присылал новое
+    """
+    message_id = (state or {}).get("draft_message_id")
+    if message_id:
+        await _safe_edit(bot, TRAINER_CHAT_ID, message_id, "⏳ Генерирую черновик плана (повтор)...")
+    else:
+        draft = await bot.send_message(chat_id=TRAINER_CHAT_ID, text="⏳ Генерирую черновик плана...")
+        message_id = draft.message_id
+        if state is not None:
+            state["draft_message_id"] = message_id
     
-    # Только тренер
-    if message.from_user.id != TRAINER_CHAT_ID:
+    started = time.monotonic()
+    plan_text = ""
+    provisional = False
+    last_edit = 0.0
+    stream = stream_plan(user_data).__aiter__()
+    try:
+        # Первый фрагмент ждём не дольше PLAN_SLO_SECONDS, иначе — шаблон;
+        # сам поток не отменяем: оплаченный ответ LLM дойдёт до кэша планов
+        first = asyncio.ensure_future(stream.__anext__())
+        done, _ = await asyncio.wait({first}, timeout=PLAN_SLO_SECONDS)
+        if not done:
+            finish_in_background(_drain_late(first, stream))
+            plan_text = build_fallback_plan(user_data)
+            provisional = True
+        elif isinstance(first.exception(), StopAsyncIteration):
+            plan_text = build_fallback_plan(user_data)
+            provisional = True
+        else:
+            plan_text = first.result()
+        
+        if not provisional:
+            async for chunk in stream:
+                plan_text += chunk
+                # Не чаще одного редактирования в PLAN_STREAM_EDIT_INTERVAL секунд (лимиты Telegram)
+                if time.monotonic() - last_edit < PLAN_STREAM_EDIT_INTERVAL:
+                    continue
+                preview = _draft_text(plan_text, user_data) + f"\n⏳ Генерация... {len(plan_text)} символов"
+                # Черновик без parse_mode: незакрытая разметка ломает Markdown
+                await _safe_edit(bot, TRAINER_CHAT_ID, message_id, preview)
+                last_edit = time.monotonic()
+    except Exception:
+        await _safe_edit(bot, TRAINER_CHAT_ID, message_id, "❌ Генерация прервана.")
+        raise
+    
+    if not plan_text:
+        await _safe_edit(bot, TRAINER_CHAT_ID, message_id, "❌ Не удалось сгенерировать план.")
+        return None
+    
+    # Финальное редактирование с кнопками; если Markdown не разобрался — без разметки
+    text = _draft_text(plan_text, user_data, provisional)
+    kb = _review_keyboard(user_data["id"], await _save_draft(plan_text, user_data))
+    try:
+        await bot.edit_message_text(
+            text=text,
+            chat_id=TRAINER_CHAT_ID,
+            message_id=message_id,
+            parse_mode="Markdown",
+            reply_markup=kb
+        )
+    except TelegramBadRequest:
+        await bot.edit_message_text(
+            text=text,
+            chat_id=TRAINER_CHAT_ID,
+            message_id=message_id,
+            reply_markup=kb
+        )
+    return record_served(GenerationResult(
+        plan_text,
+        "fallback" if provisional else "stream",
+        provisional=provisional,
+        latency=time.monotonic() - started,
+    ))
+
+def _split_text(text: str, limit: int = TELEGRAM_TEXT_LIMIT) -> List[str]:
+    """Текст частями не длиннее limit: режем по абзацам, затем по строкам"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+async def send_plan_to_user(bot: Bot, user_id: int, plan_text: str) -> None:
+    """
+    Утверждённый план пользователю: длинный — несколькими сообщениями, часть
+    с незакрытым Markdown (частое дело для ответа LLM) — без разметки
+    """
+    text = f"🎉 *Ваш персональный фитнес-план готов!*\n\n{plan_text}\n\n_План одобрен тренером_ ✅"
+    for part in _split_text(text):
+        try:
+            await bot.send_message(chat_id=user_id, text=part, parse_mode="Markdown")
+        except TelegramBadRequest:
+            await bot.send_message(chat_id=user_id, text=part)
+
+# --- 3. Очередь генераций ---
+async def run_generation_job(job: GenerationJob) -> Optional[str]:
+    """Выполнение задачи воркером очереди"""
+    data = job.payload["user_data"]
+    
+    # Не больше GENERATION_MAX_IN_FLIGHT генераций одновременно, сколько бы ни было воркеров
+    async with generation_slots.acquire():
+        if job.kind == "edit":
+            # Основа правки — черновик из кнопки; без него — последний сохранённый план пользователя
+            base_plan = job.payload.get("base_plan")
+            if not base_plan and job.payload.get("plan_id"):
+                base_plan = await get_plan_text(job.payload["plan_id"])
+            plan_text = await generate_plan_with_edit(data, job.payload["edit_text"], base_plan)
+        else:
+            if PLAN_STREAMING:
+                # Черновик появляется у тренера сразу и дописывается по мере генерации
+                result = await stream_plan_to_trainer(get_bot(), data, job.payload)
+                job.payload["delivered"] = bool(result)
+            else:
+                # Не дольше PLAN_SLO_SECONDS: хедж-запрос или шаблон
+                result = await generate_plan_slo(data)
+            plan_text = result.text if result else None
+            if result:
+                job.payload["source"] = result.source
+                job.payload["provisional"] = result.provisional
+    
+    if not plan_text:
+        raise RuntimeError("LLM вернула пустой план")
+    return plan_text
+
+async def on_generation_done(job: GenerationJob) -> None:
+    """Колбэк завершения: черновик тренеру, план с правками — тренеру и клиенту"""
+    data = job.payload["user_data"]
+    plan_text = job.result or ""
+    
+    if job.kind == "plan":
+        if not job.payload.get("delivered"):
+            await send_plan_to_trainer(plan_text, data, provisional=job.payload.get("provisional", False))
         return
     
-    # Запускаем фоновую задачу при первом обращении
-    await start_token_refresher()
+    user_id = job.payload["user_id"]
+    edit_text = job.payload["edit_text"]
+    bot = get_bot()
+    
+    # Сохраняем план: это новый черновик, его id — в кнопках
+    plan_id = await save_plan({
+        "user_id": user_id,
+        "plan_text": plan_text,
+        "status": "edited",
+        "trainer_feedback": edit_text
+    }, durable=True)
+    
+    plan_preview = plan_text[:800]
+    if len(plan_text) > 800:
+        plan_preview += "..."
     
-    await message.answer("🔄 Запускаю генерацию фитнес-плана...")
+    # Отправляем обновлённый план тренеру с кнопками
+    await bot.send_message(
+        chat_id=TRAINER_CHAT_ID,
+        text=f"📋 *Обновлённый план*\n\n{plan_preview}",
+        parse_mode="Markdown",
+        reply_markup=_review_keyboard(data["id"], plan_id or 0)
+    )
     
-    # Получаем последнюю анкету
-    data = await get_last_anketa()
+    # Отправляем пользователю
+    await bot.send_message(
+        chat_id=user_id,
+        text=f"📋 *Ваш план обновлён с учётом правок тренера*\n\n{plan_text}",
+        parse_mode="Markdown"
+    )
+
+async def on_generation_failed(job: GenerationJob) -> None:
+    """Все попытки исчерпаны — сообщаем тренеру"""
+    what = "плана с правками" if job.kind == "edit" else "плана"
+    await get_bot().send_message(
+        chat_id=TRAINER_CHAT_ID,
+        text=f"❌ Ошибка генерации {what} после {job.attempts} попыток: {(job.error or '')[:200]}"
+    )
+
+generation_queue = JobQueue(
+    backend=create_job_backend(JOB_BACKEND, weights=fair_weights, lease=JOB_LEASE_SECONDS),
+    executor=run_generation_job,
+    on_complete=on_generation_done,
+    on_failure=on_generation_failed,
+    workers=JOB_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+)
+
+async def _queued_note(job: GenerationJob) -> str:
+    """Сразу после постановки: место в очереди или «уже в работе»"""
+    position = await generation_queue.position(job.id)
+    if position:
+        return f"⏳ В очереди, позиция {position}"
+    return "⚙️ Уже в работе"
+
+# --- 4. Запуск генерации тренером ---
+_ANKETA_ID_RE = re.compile(r"анкета #(\d+)", re.IGNORECASE)
+
+async def _enqueue_plan(anketa_id: int, message: Message, trainer_id: int) -> None:
+    """Постановка генерации плана по конкретной анкете в очередь"""
+    data = await get_anketa(anketa_id)
     if not data:
         await message.answer("❌ Анкета не найдена. Пользователь должен сначала заполнить анкету.")
         return
     
     try:
-        # Генерируем план
-        await message.answer("⏳ Обращаюсь к GigaChat API...")
-        plan_text = await generate_plan(data)
-        
-        # Отправляем тренеру на проверку
-        await send_plan_to_trainer(plan_text, data)
-        
-        await message.answer("✅ План сгенерирован и отправлен на проверку.")
+        # Генерация идёт в фоне, тренер может сразу ставить в очередь следующих клиентов
+        job = await generation_queue.enqueue("plan", {"user_data": data}, requested_by=trainer_id)
+        await message.answer(f"📥 Генерация плана по анкете #{anketa_id}: {await _queued_note(job)}.")
         
     except Exception as e:
-        error_msg = str(e)
-        if "Client ID" in error_msg or "GIGA_CLIENT_ID" in error_msg:
-            await message.answer("❌ Ошибка: GigaChat не настроен. Проверьте GIGA_CLIENT_ID в .env файле.")
-        else:
-            await message.answer(f"❌ Ошибка генерации плана: {error_msg[:200]}")
-        print(f"Ошибка генерации плана: {e}")
+        await message.answer(f"❌ Ошибка постановки в очередь: {str(e)[:200]}")
+        print(f"Ошибка постановки генерации в очередь: {e}")
 
-# --- 4. Обработка кнопок тренера ---
-@router.callback_query(lambda c: c.data in ["approve", "edit"])
-async def trainer_choice(call: CallbackQuery):
-    """Обработка выбора тренера (одобрить/править)"""
-    if not call.message or not call.bot:
+@router.callback_query(PlanAction.filter(F.action == "generate"))
+async def trainer_generate(call: CallbackQuery, callback_data: PlanAction):
+    """Кнопка «Сгенерировать план» под анкетой"""
+    if not call.message:
         return
-    
-    action = call.data
     await call.answer()
+    await _enqueue_plan(callback_data.anketa_id, call.message, call.from_user.id)
+
+@router.message(lambda m: m.text and m.text.strip() == "+")
+async def trainer_plus_reaction(message: Message):
+    """Обработка '+' в ответ на сообщение с анкетой"""
+    if not message.from_user or not message.bot:
+        return
     
-    # Получаем анкету
-    data = await get_last_anketa()
-    if not data:
-        await call.message.answer("❌ Анкета не найдена.")
+    # Только тренер
+    if message.from_user.id != TRAINER_CHAT_ID:
         return
     
-    user_id = data.get("user_id")
-    if not user_id:
-        await call.message.answer("❌ ID пользователя не найден.")
+    # Номер анкеты берём из сообщения, на которое ответил тренер
+    replied = message.reply_to_message
+    match = _ANKETA_ID_RE.search(replied.text or "") if replied else None
+    if not match:
+        await message.answer("ℹ️ Ответьте '+' на сообщение с анкетой или нажмите кнопку «Сгенерировать план».")
         return
     
+    await _enqueue_plan(int(match.group(1)), message, message.from_user.id)
+
+# --- 5. Обработка кнопок тренера ---
+@router.callback_query(PlanAction.filter(F.action.in_({"approve", "edit"})))
+async def trainer_choice(call: CallbackQuery, callback_data: PlanAction, state: FSMContext):
+    """Обработка выбора тренера (одобрить/править)"""
+    if not call.message or not call.bot:
+        return
+    
+    action = callback_data.action
+    await call.answer()
+    
     if action == "approve":
-        # Генерируем финальный план (или берём из сообщения)
+        # Черновик уже лежит в plans: утверждение — один UPDATE по id и отправка
         try:
-            # Получаем текст плана из сообщения
-            message_text = call.message.text or call.message.caption or ""
-            
-            # Ищем план в сообщении (после первой пустой строки)
-            lines = message_text.split('\n')
-            plan_start = 0
-            for i, line in enumerate(lines):
-                if line.strip() and 'черновик плана' in line.lower():
-                    plan_start = i + 2  # Пропускаем заголовок и пустую строку
-                    break
-            
-            if plan_start > 0 and plan_start < len(lines):
-                plan_text = '\n'.join(lines[plan_start:])
-            else:
-                # Если не нашли, генерируем заново
-                await call.message.answer("🔄 Генерирую финальный план...")
-                plan_text = await generate_plan(data)
-            
-            # Сохраняем план
-            await save_plan({
-                "user_id": user_id,
-                "plan_text": plan_text,
-                "status": "approved"
-            })
+            plan = await approve_plan(callback_data.plan_id) if callback_data.plan_id else None
+            if not plan:
+                await call.message.answer("❌ Черновик не найден или уже утверждён. Сгенерируйте план заново.")
+                return
+            user_id = plan["user_id"]
             
-            # Отправляем пользователю
-            await call.bot.send_message(
-                chat_id=user_id,
-                text=f"🎉 *Ваш персональный фитнес-план готов!*\n\n{plan_text}\n\n_План одобрен тренером_ ✅",
-                parse_mode="Markdown"
-            )
+            # Отправляем пользователю; не дошло — черновик снова ждёт утверждения
+            try:
+                await send_plan_to_user(call.bot, user_id, plan["plan_text"])
+            except Exception as e:
+                await revert_plan_approval(callback_data.plan_id, plan["previous_status"])
+                await call.message.answer(
+                    f"❌ План не доставлен пользователю ({str(e)[:200]}). "
+                    "Черновик не утверждён — нажмите «Устроил» ещё раз."
+                )
+                return
             
             # Обновляем сообщение у тренера
             await call.message.edit_text(
@@ -168,28 +398,45 @@ async def trainer_choice(call: CallbackQuery):
             
         except Exception as e:
             await call.message.answer(f"❌ Ошибка: {str(e)[:200]}")
+        return
+    
+    # Получаем анкету по id из кнопки
+    data = await get_anketa(callback_data.anketa_id)
+    if not data:
+        await call.message.answer("❌ Анкета не найдена.")
+        return
     
-    elif action == "edit":
-        # Запрашиваем правки
-        awaiting_edits[call.from_user.id] = {
+    user_id = data.get("user_id")
+    if not user_id:
+        await call.message.answer("❌ ID пользователя не найден.")
+        return
+    
+    if action == "edit":
+        # Запрашиваем правки; ожидание хранится в FSM, чтобы его видели все процессы бота
+        await state.set_state(TrainerStates.awaiting_edit)
+        await state.set_data({
+            "anketa_id": callback_data.anketa_id,
+            "plan_id": callback_data.plan_id,
             "message_id": call.message.message_id,
-            "user_id": user_id,
-            "original_data": data,
-            "original_plan": call.message.text or ""
-        }
+        })
         
         await call.message.edit_text(
             f"✏️ *Требуются правки для пользователя ID: {user_id}*\n\n"
             "Напишите в ответ на это сообщение, что нужно изменить:",
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_edit")]
+                [InlineKeyboardButton(
+                    text="❌ Отмена",
+                    callback_data=PlanAction(
+                        action="cancel_edit", anketa_id=callback_data.anketa_id, plan_id=callback_data.plan_id
+                    ).pack()
+                )]
             ])
         )
 
-# --- 5. Обработка текстовых правок ---
-@router.message()
-async def trainer_edit(message: Message):
+# --- 6. Обработка текстовых правок ---
+@router.message(TrainerStates.awaiting_edit)
+async def trainer_edit(message: Message, state: FSMContext):
     """Обработка текстовых правок от тренера"""
     if not message.from_user or not message.text or not message.bot:
         return
@@ -198,99 +445,58 @@ async def trainer_edit(message: Message):
     if message.from_user.id != TRAINER_CHAT_ID:
         return
     
-    # Проверяем, ожидаем ли мы правки
-    if message.from_user.id not in awaiting_edits:
-        # Это обычное сообщение, не связанное с правками
-        return
-    
     edit_text = message.text.strip()
     if not edit_text or edit_text == "+":
         return
     
-    feedback_data = awaiting_edits[message.from_user.id]
-    data = feedback_data.get("original_data")
-    user_id = feedback_data.get("user_id")
+    feedback_data = await state.get_data()
+    data = await get_anketa(feedback_data.get("anketa_id", 0))
+    user_id = data.get("user_id") if data else None
     
     if not data or not user_id:
         await message.answer("❌ Данные не найдены.")
         return
     
-    await message.answer("🔄 Перерабатываю план с учётом ваших правок...")
-    
     try:
-        # Генерируем план с правками
-        plan_text = await generate_plan_with_edit(data, edit_text)
-        
-        # Сохраняем план
-        await save_plan({
+        job = await generation_queue.enqueue("edit", {
+            "user_data": data,
             "user_id": user_id,
-            "plan_text": plan_text,
-            "status": "edited",
-            "trainer_feedback": edit_text
-        })
-        
-        # Отправляем обновлённый план тренеру с кнопками
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Устроил", callback_data="approve"),
-                InlineKeyboardButton(text="📝 Внести правки", callback_data="edit")
-            ]
-        ])
+            "edit_text": edit_text,
+            # Правится черновик, на котором тренер нажал «Внести правки»
+            "plan_id": feedback_data.get("plan_id") or 0
+        }, requested_by=message.from_user.id)
         
-        plan_preview = plan_text[:800]
-        if len(plan_text) > 800:
-            plan_preview += "..."
+        # Правка принята, дальше план переработает воркер очереди
+        await state.clear()
         
-        await message.answer(
-            f"📋 *Обновлённый план*\n\n{plan_preview}",
-            parse_mode="Markdown",
-            reply_markup=kb
-        )
-        
-        # Отправляем пользователю
-        await message.bot.send_message(
-            chat_id=user_id,
-            text=f"📋 *Ваш план обновлён с учётом правок тренера*\n\n{plan_text}",
-            parse_mode="Markdown"
-        )
-        
-        # Удаляем из ожидания
-        del awaiting_edits[message.from_user.id]
+        await message.answer(f"🔄 Перерабатываю план с учётом ваших правок ({await _queued_note(job)}).")
         
     except Exception as e:
         await message.answer(f"❌ Ошибка: {str(e)[:200]}")
-        print(f"Ошибка генерации плана с правками: {e}")
+        print(f"Ошибка постановки правок в очередь: {e}")
 
-# --- 6. Отмена правок ---
-@router.callback_query(lambda c: c.data == "cancel_edit")
-async def cancel_edit(call: CallbackQuery):
+# --- 7. Отмена правок ---
+@router.callback_query(PlanAction.filter(F.action == "cancel_edit"))
+async def cancel_edit(call: CallbackQuery, callback_data: PlanAction, state: FSMContext):
     """Отмена режима правок"""
     if not call.message:
         return
     
-    if call.from_user.id in awaiting_edits:
-        del awaiting_edits[call.from_user.id]
+    await state.clear()
     
     await call.message.edit_text(
         "❌ Режим правок отменён. Используйте кнопки для действий.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Устроил", callback_data="approve"),
-                InlineKeyboardButton(text="📝 Внести правки", callback_data="edit")
-            ]
-        ])
+        reply_markup=_review_keyboard(callback_data.anketa_id, callback_data.plan_id)
     )
     await call.answer()
 
-# --- 7. Команда для проверки GigaChat ---
+# --- 8. Команда для проверки GigaChat ---
 @router.message(Command("test_giga"))
 async def test_giga_command(message: Message):
     """Тестовая команда для проверки GigaChat"""
     if not message.from_user or message.from_user.id != TRAINER_CHAT_ID:
         return
     
-    await start_token_refresher()
-    
     test_data = {
         "name": "Иван",
         "age": "25",
@@ -307,8 +513,8 @@ async def test_giga_command(message: Message):
         plan = await generate_plan(test_data)
         await message.answer(f"✅ GigaChat работает!\n\n{plan[:500]}...")
     except Exception as e:
-        error_msg = str(e)
-        if "Client ID" in error_msg:
-            await message.answer("❌ Ошибка: GIGA_CLIENT_ID не установлен в .env файле")
-        else:
-            await message.answer(f"❌ Ошибка: {error_msg[:200]}")
+        # Ключи провайдеров читает реестр LLM (llm_providers)
+        await message.answer(
+            f"❌ Ошибка: {str(e)[:200]}\n"
+            "Проверьте GIGACHAT_API_KEY и PROXY_API_KEY в .env файле"
+        )
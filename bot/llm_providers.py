@@ -0,0 +1,477 @@
+"""
+Реестр LLM-провайдеров: общий асинхронный интерфейс, проверка здоровья,
+скользящая статистика задержек/ошибок и circuit breaker
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from prompts import build_plan_prompt, build_edit_prompt, build_section_prompt, log_token_report
+from token_manager import TokenManager
+from metrics import REGISTRY, LLM_REQUEST_SECONDS, LLM_PROVIDER_UP
+from usage_ledger import usage_ledger
+from resolver import aiohttp_connector_kwargs
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_PROBE_INTERVAL = float(os.getenv('PROVIDER_PROBE_INTERVAL', '60'))
+PROVIDER_STATS_WINDOW = int(os.getenv('PROVIDER_STATS_WINDOW', '50'))
+# Сколько ошибок подряд размыкает цепь и сколько секунд провайдер отдыхает
+PROVIDER_FAILURE_THRESHOLD = int(os.getenv('PROVIDER_FAILURE_THRESHOLD', '3'))
+PROVIDER_COOLDOWN = float(os.getenv('PROVIDER_COOLDOWN', '30'))
+
+GIGACHAT_API_KEY = os.getenv('GIGACHAT_API_KEY', '')
+GIGACHAT_AUTH_URL = os.getenv('GIGACHAT_AUTH_URL', 'https://ngw.devices.sberbank.ru:9443/api/v2/oauth')
+GIGACHAT_API_URL = os.getenv('GIGACHAT_API_URL', 'https://gigachat.devices.sberbank.ru/api/v1')
+GIGACHAT_MODEL = os.getenv('GIGACHAT_MODEL', 'GigaChat')
+GIGACHAT_SCOPE = os.getenv('GIGACHAT_SCOPE', 'GIGACHAT_API_PERS')
+# Общий для воркеров кэш токена и за сколько секунд до expires_at его обновлять
+GIGACHAT_TOKEN_FILE = os.getenv('GIGACHAT_TOKEN_FILE', '/opt/ai-fit/.jwt')
+GIGACHAT_TOKEN_REFRESH_AHEAD = float(os.getenv('GIGACHAT_TOKEN_REFRESH_AHEAD', '300'))
+
+
+class ProviderUnavailable(Exception):
+    """Провайдер не вернул план (ошибка, пустой ответ или разомкнутая цепь)"""
+
+
+class LLMProvider:
+    """Общий интерфейс провайдера"""
+
+    name = "provider"
+
+    async def generate_plan(self, data: Dict[str, Any]) -> Optional[str]:
+        raise NotImplementedError
+
+    async def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def revise_section(self, data: Dict[str, Any], section: str, edit_text: str,
+                             titles: Optional[List[str]] = None) -> Optional[str]:
+        """Один раздел плана с правкой тренера (plan_revision)"""
+        raise NotImplementedError
+
+    async def stream_plan(self, data: Dict[str, Any]) -> AsyncIterator[str]:
+        # Провайдеры без потоковой генерации отдают план одним фрагментом
+        plan = await self.generate_plan(data)
+        if plan:
+            yield plan
+
+    async def test_connection(self) -> bool:
+        raise NotImplementedError
+
+    async def start(self) -> None:
+        return None
+
+    async def aclose(self) -> None:
+        return None
+
+
+class ProxyOpenAIProvider(LLMProvider):
+    """OpenAI-совместимый API через ProxyAPI (AsyncProxyOpenAI)"""
+
+    def __init__(self, name: str, factory: Callable[[], Any]) -> None:
+        self.name = name
+        self._factory = factory
+        self._client: Any = None
+
+    @property
+    def client(self) -> Any:
+        # Клиент создаётся внутри event loop при первом запросе
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
+
+    async def generate_plan(self, data: Dict[str, Any]) -> Optional[str]:
+        return await self.client.generate_plan(data)
+
+    async def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        return await self.client.generate_plan_with_edit(data, edit_text)
+
+    async def revise_section(self, data: Dict[str, Any], section: str, edit_text: str,
+                             titles: Optional[List[str]] = None) -> Optional[str]:
+        return await self.client.revise_section(data, section, edit_text, titles)
+
+    async def stream_plan(self, data: Dict[str, Any]) -> AsyncIterator[str]:
+        async for chunk in self.client.stream_plan(data):
+            yield chunk
+
+    async def test_connection(self) -> bool:
+        return await self.client.test_connection()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class GigaChatProvider(LLMProvider):
+    """GigaChat REST API: одна aiohttp-сессия, токен из TokenManager"""
+
+    name = "gigachat"
+
+    def __init__(self, api_key: str = GIGACHAT_API_KEY, model: str = GIGACHAT_MODEL,
+                 token_file: Optional[str] = GIGACHAT_TOKEN_FILE) -> None:
+        self.api_key = api_key if api_key.startswith(("Basic ", "Bearer ")) else f"Basic {api_key}"
+        self.model = model
+        self._session: Any = None
+        self.tokens = TokenManager(self._fetch_token, cache_path=token_file or None,
+                                   refresh_ahead=GIGACHAT_TOKEN_REFRESH_AHEAD, name="gigachat")
+
+    def _get_session(self) -> Any:
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**aiohttp_connector_kwargs()),
+                timeout=aiohttp.ClientTimeout(total=60, connect=10),
+            )
+        return self._session
+
+    async def _fetch_token(self) -> Tuple[str, float]:
+        async with self._get_session().post(
+            GIGACHAT_AUTH_URL,
+            headers={
+                "Authorization": self.api_key,
+                "RqUID": str(uuid.uuid4()),
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json",
+            },
+            data={"scope": GIGACHAT_SCOPE},
+        ) as response:
+            response.raise_for_status()
+            result = await response.json()
+        # expires_at приходит в миллисекундах
+        return result["access_token"], result.get("expires_at", (time.time() + 1800) * 1000) / 1000
+
+    async def _chat(self, messages: List[Dict[str, str]], max_tokens: int) -> Tuple[Optional[str], Any]:
+        token = await self.tokens.get_token()
+        async with self._get_session().post(
+            f"{GIGACHAT_API_URL}/chat/completions",
+            headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+            json={"model": self.model, "messages": messages, "temperature": 0.7, "max_tokens": max_tokens},
+        ) as response:
+            if response.status == 401:
+                # Токен отозван раньше срока — следующий запрос возьмёт новый
+                self.tokens.invalidate(token)
+            if response.status != 200:
+                raise ProviderUnavailable(f"GigaChat API error {response.status}: {(await response.text())[:200]}")
+            result = await response.json()
+        usage = result.get("usage") or {}
+        return result["choices"][0]["message"]["content"], usage
+
+    async def generate_plan(self, data: Dict[str, Any]) -> Optional[str]:
+        built = build_plan_prompt(data, model=self.model)
+        started = time.monotonic()
+        plan, usage = await self._chat(built.messages, built.max_tokens)
+        log_token_report(built, _Usage(usage) if usage else None)
+        self._record_usage("plan", data, usage, started)
+        return plan
+
+    async def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        built = build_edit_prompt(data, edit_text, model=self.model)
+        started = time.monotonic()
+        plan, usage = await self._chat(built.messages, built.max_tokens)
+        log_token_report(built, _Usage(usage) if usage else None, "правки")
+        self._record_usage("edit", data, usage, started, cache="bypass")
+        return plan
+
+    async def revise_section(self, data: Dict[str, Any], section: str, edit_text: str,
+                             titles: Optional[List[str]] = None) -> Optional[str]:
+        built = build_section_prompt(data, section, edit_text, titles, model=self.model)
+        started = time.monotonic()
+        text, usage = await self._chat(built.messages, built.max_tokens)
+        log_token_report(built, _Usage(usage) if usage else None, "раздел")
+        self._record_usage("revise", data, usage, started, cache="bypass")
+        return text
+
+    def _record_usage(self, kind: str, data: Dict[str, Any], usage: Dict[str, Any], started: float,
+                      cache: str = "miss") -> None:
+        usage_ledger.record(
+            kind, self.model, provider=self.name, user_id=data.get("user_id"),
+            prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0),
+            latency=time.monotonic() - started, cache=cache,
+        )
+
+    async def test_connection(self) -> bool:
+        try:
+            # Ошибка HTTP поднимает исключение; пустой текст на лимите в 5 токенов — не сбой
+            await self._chat([{"role": "user", "content": "Ответь 'OK'"}], 5)
+            return True
+        except Exception:
+            return False
+
+    async def start(self) -> None:
+        # Токен обновляется в фоне заранее, запросы планов его не ждут
+        await self.tokens.start()
+
+    async def aclose(self) -> None:
+        await self.tokens.stop()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class _Usage:
+    """usage из JSON-ответа в виде атрибутов, как у OpenAI SDK"""
+
+    def __init__(self, usage: Dict[str, Any]) -> None:
+        self.prompt_tokens = usage.get("prompt_tokens", 0)
+        self.completion_tokens = usage.get("completion_tokens", 0)
+
+
+class ProviderState:
+    """Скользящая статистика провайдера и состояние circuit breaker"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: int, failure_threshold: int, cooldown: float) -> None:
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.healthy = True
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        """
+        Решает только circuit breaker. Неудачная проба (healthy=False) лишь
+        сдвигает провайдера в конец ranked(): если нездоровы все, первый
+        из них всё равно получит запрос.
+        """
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # В полуоткрытом состоянии пропускаем один пробный запрос
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.samples.append((latency, ok))
+        self.trial_in_flight = False
+        if ok:
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+            self.healthy = True
+            return
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    @property
+    def latency_p50(self) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        return latencies[len(latencies) // 2] if latencies else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        p50 = self.latency_p50
+        return {
+            "state": self.state,
+            "healthy": self.healthy,
+            "samples": len(self.samples),
+            "error_rate": round(self.error_rate, 3),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+        }
+
+
+class ProviderRegistry:
+    """Маршрутизация запросов к самому быстрому здоровому провайдеру"""
+
+    def __init__(
+        self,
+        window: int = PROVIDER_STATS_WINDOW,
+        failure_threshold: int = PROVIDER_FAILURE_THRESHOLD,
+        cooldown: float = PROVIDER_COOLDOWN,
+        probe_interval: float = PROVIDER_PROBE_INTERVAL,
+    ) -> None:
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.providers: Dict[str, LLMProvider] = {}
+        self.states: Dict[str, ProviderState] = {}
+        self._order: List[str] = []
+        self._prober: Optional["asyncio.Task[None]"] = None
+        self._started = False
+
+    def register(self, provider: LLMProvider) -> None:
+        self.providers[provider.name] = provider
+        self.states[provider.name] = ProviderState(self.window, self.failure_threshold, self.cooldown)
+        self._order.append(provider.name)
+        logger.info(f"🔌 LLM-провайдер: {provider.name}")
+
+    def __len__(self) -> int:
+        return len(self.providers)
+
+    def ranked(self) -> List[str]:
+        """Провайдеры по возрастанию p50; без статистики — в порядке регистрации"""
+        def key(name: str) -> Tuple[int, float, int]:
+            state = self.states[name]
+            p50 = state.latency_p50
+            # Нездоровых и с разомкнутой цепью — в конец, но не выкидываем: allow() решит, пускать ли
+            if p50 is None:
+                # Без успешных ответов: новый провайдер пробуем первым, сплошь ошибочный — последним
+                p50 = float("inf") if state.samples else 0.0
+            return (0 if state.healthy and state.state == ProviderState.CLOSED else 1,
+                    p50, self._order.index(name))
+        return sorted(self._order, key=key)
+
+    async def _call(self, operation: str, call: Callable[[LLMProvider], Any], skip: int = 0,
+                    kind: str = "plan") -> Optional[str]:
+        candidates = self.ranked()[skip:] or self.ranked()
+        for name in candidates:
+            state = self.states[name]
+            if not state.allow():
+                continue
+            started = time.monotonic()
+            try:
+                result = await call(self.providers[name])
+            except asyncio.CancelledError:
+                state.trial_in_flight = False
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ {name}: {operation} не удалась ({e})")
+                result = None
+            latency = time.monotonic() - started
+            state.record(latency, bool(result))
+            LLM_REQUEST_SECONDS.observe(latency, provider=name, operation=kind,
+                                        outcome="ok" if result else "error")
+            if result:
+                return result
+            if state.state == ProviderState.OPEN:
+                logger.warning(f"🔌 {name}: цепь разомкнута на {self.cooldown:.0f} с")
+        return None
+
+    async def generate_plan(self, data: Dict[str, Any], skip: int = 0) -> Optional[str]:
+        """skip > 0 начинает с менее быстрых провайдеров (для хедж-запросов)"""
+        return await self._call("генерация", lambda p: p.generate_plan(data), skip)
+
+    async def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        return await self._call("генерация с правками", lambda p: p.generate_plan_with_edit(data, edit_text),
+                                kind="edit")
+
+    async def revise_section(self, data: Dict[str, Any], section: str, edit_text: str,
+                             titles: Optional[List[str]] = None) -> Optional[str]:
+        return await self._call("переработка раздела",
+                                lambda p: p.revise_section(data, section, edit_text, titles), kind="revise")
+
+    async def stream_plan(self, data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Поток от первого доступного провайдера; до первого фрагмента можно переключиться"""
+        for name in self.ranked():
+            state = self.states[name]
+            if not state.allow():
+                continue
+            started = time.monotonic()
+            received = False
+            # Пока не известно иное — поток прерван снаружи (отмена, aclose(), break, GC)
+            outcome = "aborted"
+            try:
+                async for chunk in self.providers[name].stream_plan(data):
+                    received = True
+                    yield chunk
+                outcome = "ok" if received else "error"
+            except Exception as e:
+                outcome = "error"
+                logger.warning(f"⚠️ {name}: потоковая генерация не удалась ({e})")
+                if received:
+                    raise
+                continue
+            finally:
+                # Любой выход снимает пробный запрос, иначе HALF_OPEN не восстановится
+                latency = time.monotonic() - started
+                if outcome == "aborted" and not received:
+                    state.trial_in_flight = False
+                else:
+                    # Прерванный после первых фрагментов поток — провайдер отвечал
+                    ok = outcome != "error"
+                    state.record(latency, ok)
+                    LLM_REQUEST_SECONDS.observe(latency, provider=name, operation="stream",
+                                                outcome="ok" if ok else "error")
+            if received:
+                return
+
+    async def probe(self) -> None:
+        """Проверка всех провайдеров через test_connection"""
+        async def _probe(name: str) -> None:
+            state = self.states[name]
+            started = time.monotonic()
+            try:
+                ok = await asyncio.wait_for(self.providers[name].test_connection(), timeout=15)
+            except Exception:
+                ok = False
+            if ok and state.state == ProviderState.OPEN:
+                # Проба прошла — даём провайдеру пробный запрос, не дожидаясь cooldown
+                state.state = ProviderState.HALF_OPEN
+            if state.healthy != ok:
+                logger.info(f"{'✅' if ok else '❌'} {name}: {'доступен' if ok else 'недоступен'} "
+                            f"({time.monotonic() - started:.2f} с)")
+            state.healthy = ok
+        await asyncio.gather(*(_probe(name) for name in self._order))
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.error(f"❌ Ошибка проверки провайдеров: {e}")
+
+    async def _collect_metrics(self) -> None:
+        for name, state in self.states.items():
+            up = state.healthy and state.state != ProviderState.OPEN
+            LLM_PROVIDER_UP.set(1 if up else 0, provider=name)
+
+    async def start(self) -> None:
+        if not self._started:
+            self._started = True
+            REGISTRY.add_collector(self._collect_metrics)
+        for provider in self.providers.values():
+            await provider.start()
+        if self._prober is None and self.probe_interval > 0:
+            self._prober = asyncio.create_task(self._probe_loop(), name="llm-provider-probe")
+
+    async def aclose(self) -> None:
+        if self._prober is not None:
+            self._prober.cancel()
+            await asyncio.gather(self._prober, return_exceptions=True)
+            self._prober = None
+        for provider in self.providers.values():
+            await provider.aclose()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: self.states[name].as_dict() for name in self._order}
+
+
+def build_default_registry() -> ProviderRegistry:
+    """ProxyAPI (основная и хедж-модель) и GigaChat — те, что настроены в окружении"""
+    registry = ProviderRegistry()
+    from proxy_openai_integration import OPENAI_AVAILABLE, AsyncProxyOpenAI, PROXY_HEDGE_MODEL, PROXY_HEDGE_API_URL
+    if os.getenv('PROXY_API_KEY') and not OPENAI_AVAILABLE:
+        logger.error("❌ ProxyAPI недоступен: не установлен пакет openai")
+    elif os.getenv('PROXY_API_KEY'):
+        model = os.getenv('PROXY_MODEL', 'openai/gpt-5-nano')
+        registry.register(ProxyOpenAIProvider(f"proxyapi:{model}", AsyncProxyOpenAI))
+        if PROXY_HEDGE_MODEL or PROXY_HEDGE_API_URL:
+            registry.register(ProxyOpenAIProvider(
+                f"proxyapi:{PROXY_HEDGE_MODEL or model}@hedge",
+                lambda: AsyncProxyOpenAI(model=PROXY_HEDGE_MODEL or None,
+                                         base_url=PROXY_HEDGE_API_URL or None),
+            ))
+    if GIGACHAT_API_KEY:
+        registry.register(GigaChatProvider())
+    return registry
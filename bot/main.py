@@ -1,44 +1,90 @@
-# 0. ПАТЧ DNS ДО ВСЕХ импортов, которые могут юзать requests
-import socket
-import requests.packages.urllib3.util.connection as conn
+# Закрепление адресов хостов и кэш DNS — в resolver.py (общий для aiohttp и httpx)
 
-DNS_MAP = {
-    "ngw.devices.sberbank.ru": "185.157.96.168",
-    "gigachat.devices.sberbank.ru": "185.157.96.168"
-}
-
-_orig_create_connection = conn.create_connection
-def patched_create_connection(address, *args, **kwargs):
-    host, port = address
-    host = DNS_MAP.get(host, host)
-    return _orig_create_connection((host, port), *args, **kwargs)
-
-conn.create_connection = patched_create_connection
-
-# 1. Стандартные библиотеки – безопасно
+# 1. Стандартные библиотеки
 import asyncio
 import logging
 
-# 2. aiogram – безопасно (не юзает requests)
+# 2. aiogram
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
-# 3. Наш конфиг – безопасно
-from config import BOT_TOKEN
+# 3. Наш конфиг
+from config import DB_AUTO_MIGRATE, FSM_STORAGE, WEBHOOK_URL, validate_config
 
-# 4. Импортируем handlers ПОСЛЕ патча
+# 4. Handlers и инфраструктура
 from handlers import start, anketa, trainer_choice
+from utils.db import init_pool, close_pool, pool_stats
+from gigachat_integration import close_async_proxy_api, close_llm_providers, get_registry
+from utils import plan_cache, coalesce_stats, create_bot, set_bot, close_bot, start_write_buffers, stop_write_buffers
+from utils.schema import apply_migrations
+from utils.hedging import served_paths
+from utils.admission import install_admission, admission_stats
+from utils.fsm_storage import PostgresStorage, create_fsm_storage
+from webhook import run_webhook
+from usage_ledger import usage_ledger
+from metrics import METRICS_PORT, instrument_router, start_metrics_server
 
 # 5. Остальной код
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def on_startup(dispatcher: Dispatcher) -> None:
+    # Один пул соединений на всё приложение; без миграций он создаётся при первом запросе к БД
+    if DB_AUTO_MIGRATE:
+        await init_pool()
+        await apply_migrations()
+    if isinstance(dispatcher.storage, PostgresStorage):
+        await dispatcher.storage.start()
+    await start_write_buffers()
+    await usage_ledger.start()
+    registry = get_registry()
+    if registry is not None:
+        await registry.start()
+    await trainer_choice.generation_queue.start()
+
+async def on_shutdown() -> None:
+    # Сначала дожидаемся текущих генераций, потом закрываем пул и клиентов
+    await trainer_choice.generation_queue.stop()
+    await stop_write_buffers()
+    await usage_ledger.stop()
+    logger.info(f"📊 Пул БД перед остановкой: {pool_stats()}")
+    logger.info(f"📊 Кэш планов: {plan_cache.stats_dict()}")
+    logger.info(f"📊 Пути генерации планов: {dict(served_paths)}")
+    logger.info(f"📊 Контроль допуска: {admission_stats()}")
+    logger.info(f"📊 Склеенные генерации: {coalesce_stats()}")
+    registry = get_registry()
+    if registry is not None:
+        logger.info(f"📊 LLM-провайдеры: {registry.stats()}")
+    await close_pool()
+    await close_llm_providers()
+    await close_async_proxy_api()
+    await close_bot()
 
 async def main() -> None:
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(start.router)
-    dp.include_router(anketa.router)
-    dp.include_router(trainer_choice.router)
-    await dp.start_polling(bot)
+    # Обязательные переменные проверяются здесь, а не при импорте config
+    validate_config()
+    # Единственный Bot процесса: его же используют handlers (через инъекцию) и utils (через get_bot)
+    bot = create_bot()
+    set_bot(bot)
+    # Общее хранилище FSM: анкеты и правки переживают рестарт и видны всем процессам
+    dp = Dispatcher(storage=create_fsm_storage(FSM_STORAGE))
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    for name, module in (("start", start), ("anketa", anketa), ("trainer_choice", trainer_choice)):
+        instrument_router(module.router, name)
+        # Лимит частоты на пользователя и тренера: лишние события сразу получают ответ
+        install_admission(module.router, name)
+        dp.include_router(module.router)
+    if WEBHOOK_URL:
+        # За балансировщиком: несколько реплик принимают апдейты параллельно
+        await run_webhook(dp, bot)
+    else:
+        # /metrics в режиме polling — на отдельном порту
+        metrics_runner = await start_metrics_server() if METRICS_PORT else None
+        try:
+            await dp.start_polling(bot)
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
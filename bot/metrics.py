@@ -0,0 +1,319 @@
+"""
+Метрики процесса в формате Prometheus: счётчики, гейджи и гистограммы
+без внешних зависимостей, текстовый /metrics
+"""
+
+import os
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Отдельный порт /metrics в режиме polling (в режиме webhook — на том же приложении); 0 — выключено
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+LLM_LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 6, 8, 10, 15, 20, 30, 45, 60, 90)
+TOKEN_BUCKETS = (50, 100, 200, 400, 800, 1200, 1600, 2200, 3000, 3500, 5000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Текущее значение; set_function — вычисление при каждом чтении"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                logger.error(f"❌ Метрика {self.name}: {e}")
+                return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # По меткам: (счётчики корзин без накопления, сумма, количество)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+        counts, totals = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Замер длительности блока (подходит и для await внутри)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        entry = self._values.get(self._key(labels))
+        return int(entry[1][1]) if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, (total, count)) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {_format_value(count)}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса; коллекторы обновляют гейджи перед выдачей"""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        self._collectors.append(collector)
+
+    async def collect(self) -> None:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сбора метрик: {e}")
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+# --- LLM ---
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "aifit_llm_request_seconds", "Длительность запроса к LLM-провайдеру",
+    ("provider", "operation", "outcome"), LLM_LATENCY_BUCKETS)
+LLM_TOKENS = REGISTRY.histogram(
+    "aifit_llm_tokens", "Токены на запрос", ("kind", "direction"), TOKEN_BUCKETS)
+LLM_PROVIDER_UP = REGISTRY.gauge(
+    "aifit_llm_provider_up", "Провайдер доступен и цепь замкнута (1/0)", ("provider",))
+PLAN_SERVED = REGISTRY.counter(
+    "aifit_plans_served_total", "Планы по пути получения", ("source",))
+
+# --- БД ---
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "aifit_db_query_seconds", "Длительность SQL-запросов", ("statement", "outcome"))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "aifit_db_pool_wait_seconds", "Ожидание соединения из пула")
+DB_POOL_CONNECTIONS = REGISTRY.gauge(
+    "aifit_db_pool_connections", "Соединения пула", ("state",))
+
+# --- Telegram ---
+TELEGRAM_REQUEST_SECONDS = REGISTRY.histogram(
+    "aifit_telegram_request_seconds", "Длительность вызовов Bot API", ("method", "outcome"))
+HANDLER_SECONDS = REGISTRY.histogram(
+    "aifit_handler_seconds", "Длительность обработчиков по роутерам", ("router", "event"))
+
+# --- DNS ---
+DNS_LOOKUPS = REGISTRY.counter(
+    "aifit_dns_lookups_total", "Разрешение имён общим резолвером", ("result",))
+DNS_RESOLVE_SECONDS = REGISTRY.histogram(
+    "aifit_dns_resolve_seconds", "Время запроса к системному DNS (промахи кэша)", ("outcome",))
+
+# --- Кэш и очередь ---
+PLAN_CACHE_REQUESTS = REGISTRY.counter(
+    "aifit_plan_cache_requests_total", "Обращения к кэшу планов", ("result",))
+PLAN_COALESCED = REGISTRY.counter(
+    "aifit_plan_coalesced_total", "Генерации: выполнены (leader) или взяты у такой же (shared)", ("kind", "role"))
+JOB_QUEUE_DEPTH = REGISTRY.gauge(
+    "aifit_job_queue_depth", "Задач генерации в очереди")
+GENERATIONS_IN_FLIGHT = REGISTRY.gauge(
+    "aifit_generations_in_flight", "Генераций выполняется сейчас")
+JOBS_FINISHED = REGISTRY.counter(
+    "aifit_jobs_finished_total", "Завершённые задачи генерации", ("kind", "status"))
+ADMISSION_REJECTED = REGISTRY.counter(
+    "aifit_admission_rejected_total", "События, отклонённые ограничением частоты", ("role", "router"))
+GENERATION_SLOT_WAIT_SECONDS = REGISTRY.histogram(
+    "aifit_generation_slot_wait_seconds", "Ожидание слота генерации", buckets=LLM_LATENCY_BUCKETS)
+JOB_SECONDS = REGISTRY.histogram(
+    "aifit_job_seconds", "Время задачи от постановки до завершения", ("kind",), LLM_LATENCY_BUCKETS)
+
+
+def statement_of(query: str) -> str:
+    """Тип SQL-запроса для метки: select / insert / update / ..."""
+    words = query.lstrip(" \n\t(").split(None, 1)
+    return words[0].lower() if words else "unknown"
+
+
+def telegram_middleware() -> Any:
+    """Middleware сессии Bot: длительность каждого метода Bot API"""
+    from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+    class TelegramMetricsMiddleware(BaseRequestMiddleware):
+        async def __call__(self, make_request: Any, bot: Any, method: Any) -> Any:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                response = await make_request(bot, method)
+                outcome = "ok"
+                return response
+            finally:
+                TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                                 method=type(method).__name__, outcome=outcome)
+
+    return TelegramMetricsMiddleware()
+
+
+def handler_middleware(router: str) -> Any:
+    """Inner-middleware роутера: длительность обработчиков"""
+    from aiogram import BaseMiddleware
+
+    class HandlerMetricsMiddleware(BaseMiddleware):
+        async def __call__(self, handler: Any, event: Any, data: Dict[str, Any]) -> Any:
+            with HANDLER_SECONDS.time(router=router, event=type(event).__name__):
+                return await handler(event, data)
+
+    return HandlerMetricsMiddleware()
+
+
+def instrument_router(router: Any, name: str) -> None:
+    middleware = handler_middleware(name)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
+
+
+async def metrics_handler(request: Any) -> Any:
+    from aiohttp import web
+    await REGISTRY.collect()
+    return web.Response(body=REGISTRY.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Any:
+    """Отдельный HTTP-сервер /metrics (для режима polling)"""
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
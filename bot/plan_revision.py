@@ -0,0 +1,159 @@
+"""
+Точечная переработка плана по правке тренера: план делится на разделы «## »,
+переписываются только затронутые правкой, остальные остаются как были
+"""
+
+import re
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HEADING_RE = re.compile(r"^##\s+(?!#)", re.MULTILINE)
+_NUMBER_RE = re.compile(r"^\s*(\d+)[.)]?\s*")
+
+# Темы разделов и признаки темы (начала слов) в заголовке и в тексте правки
+TOPICS: Dict[str, Tuple[str, ...]] = {
+    "training": ("трениров", "программ", "расписан", "упражнен", "подход", "повтор", "присед",
+                 "отжим", "выпад", "тяг", "жим", "планк", "кардио", "бег", "ходьб", "плаван",
+                 "велосипед", "растяжк", "разминк", "заминк", "нагрузк", "интенсивн", "день", "дни",
+                 "раз в неделю", "вес снаряд", "гантел", "штанг", "тренаж"),
+    "progression": ("прогресс", "недел", "этап", "увеличива", "постепенн"),
+    "nutrition": ("питани", "рацион", "диет", "калори", "ккал", "белок", "белк", "углевод", "жир",
+                  "еда", "еды", "завтрак", "обед", "ужин", "перекус", "вод", "сахар", "продукт"),
+    "recovery": ("восстановл", "отдых", "сон", "сна", "массаж", "стресс"),
+    "safety": ("травм", "боль(?!ш)", "болит", "болез", "колен", "спин", "поясниц", "сустав", "плеч", "осторожн",
+               "противопоказ", "безопасн", "врач", "давлен"),
+    "goals": ("цел", "оценк", "результат", "ожидан"),
+}
+
+_TOPIC_RES = {topic: re.compile(rf"\b(?:{'|'.join(stems)})") for topic, stems in TOPICS.items()}
+
+_SECTION_REF_RE = re.compile(r"(?:раздел|пункт|секци)\w*\s*(?:№\s*)?(\d+)", re.IGNORECASE)
+
+
+@dataclass
+class Section:
+    title: str
+    body: str
+
+    @property
+    def text(self) -> str:
+        return f"## {self.title}\n{self.body}".rstrip() + "\n"
+
+
+@dataclass
+class Revision:
+    """Результат переработки: новый текст и номера переписанных разделов"""
+    text: str
+    revised: List[int]
+    total: int
+
+
+def split_sections(plan: str) -> Tuple[str, List[Section]]:
+    """Текст до первого «## » и разделы (заголовок без «## », тело)"""
+    starts = [m.start() for m in _HEADING_RE.finditer(plan)]
+    if not starts:
+        return plan, []
+    preamble = plan[:starts[0]]
+    sections = []
+    for start, end in zip(starts, starts[1:] + [len(plan)]):
+        chunk = plan[start:end]
+        heading, _, body = chunk.partition("\n")
+        sections.append(Section(_HEADING_RE.sub("", heading, count=1).strip(), body.strip("\n")))
+    return preamble, sections
+
+
+def join_sections(preamble: str, sections: List[Section]) -> str:
+    parts = [preamble.rstrip()] if preamble.strip() else []
+    parts += [section.text.rstrip() for section in sections]
+    return "\n\n".join(parts) + "\n"
+
+
+def _topics(text: str) -> Set[str]:
+    text = text.lower().replace("ё", "е")
+    return {topic for topic, pattern in _TOPIC_RES.items() if pattern.search(text)}
+
+
+def affected_sections(sections: List[Section], edit_text: str) -> List[int]:
+    """
+    Номера разделов, которые затрагивает правка: явные ссылки («раздел 2»,
+    «## 2.» в заголовке) и совпадение тем правки с темой заголовка.
+    Пустой список — правку не удалось привязать к разделам.
+    """
+    chosen: Set[int] = set()
+    for match in _SECTION_REF_RE.finditer(edit_text):
+        number = int(match.group(1))
+        for index, section in enumerate(sections):
+            numbered = _NUMBER_RE.match(section.title)
+            if numbered and int(numbered.group(1)) == number:
+                chosen.add(index)
+        if not chosen and 1 <= number <= len(sections):
+            chosen.add(number - 1)
+
+    edit_topics = _topics(edit_text)
+    for index, section in enumerate(sections):
+        if edit_topics & _topics(section.title):
+            chosen.add(index)
+    # Тему по заголовку не определить — смотрим на содержимое раздела
+    if not chosen and edit_topics:
+        for index, section in enumerate(sections):
+            if not _topics(section.title) and edit_topics & _topics(section.body):
+                chosen.add(index)
+    return sorted(chosen)
+
+
+SectionWriter = Callable[[Dict[str, Any], str, str, List[str]], Awaitable[Optional[str]]]
+
+
+def _clean_section(original: Section, rewritten: str) -> Optional[Section]:
+    """Ответ модели → раздел; заголовок оригинала сохраняется, лишние разделы отбрасываются"""
+    rewritten = rewritten.strip()
+    if not rewritten:
+        return None
+    preamble, parts = split_sections(rewritten)
+    if parts:
+        body = parts[0].body if not preamble.strip() else f"{preamble.strip()}\n\n{parts[0].body}"
+    else:
+        body = rewritten
+    return Section(original.title, body.strip("\n")) if body.strip() else None
+
+
+async def revise_plan(
+    data: Dict[str, Any],
+    plan_text: str,
+    edit_text: str,
+    write_section: SectionWriter,
+    max_share: float = 0.6,
+) -> Optional[Revision]:
+    """
+    Переписывает затронутые разделы параллельно и вклеивает их обратно.
+    None — точечная правка не подходит (нет разделов, правка не привязалась
+    или затрагивает больше max_share плана, раздел не удалось переписать);
+    тогда вызывающий код перегенерирует план целиком.
+    """
+    preamble, sections = split_sections(plan_text)
+    if len(sections) < 2:
+        return None
+    indices = affected_sections(sections, edit_text)
+    if not indices or len(indices) > max(1, int(len(sections) * max_share)):
+        logger.info(f"✏️ Правка затрагивает разделов: {len(indices)} из {len(sections)} — план целиком")
+        return None
+
+    titles = [section.title for section in sections]
+    results = await asyncio.gather(
+        *(write_section(data, sections[i].text, edit_text, titles) for i in indices),
+        return_exceptions=True,
+    )
+    revised = list(sections)
+    for index, result in zip(indices, results):
+        section = _clean_section(sections[index], result) if isinstance(result, str) else None
+        if section is None:
+            logger.warning(f"⚠️ Раздел «{sections[index].title}» не переписан — план целиком")
+            return None
+        revised[index] = section
+
+    logger.info(f"✏️ Переписаны разделы {[titles[i] for i in indices]} из {len(sections)}")
+    return Revision(join_sections(preamble, revised), indices, len(sections))
@@ -0,0 +1,225 @@
+"""
+Промпты для генерации планов: подсчёт токенов, сжатие до бюджета и выбор max_tokens
+"""
+
+import os
+import re
+import math
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Размер плана определяет бюджет ответа (max_tokens)
+PLAN_SIZE = os.getenv('PLAN_SIZE', 'standard')
+PLAN_SIZES = {
+    "short": 1200,
+    "standard": 2200,
+    "detailed": 3500,
+}
+# Бюджет пользовательской части промпта в токенах
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '400'))
+
+SYSTEM_PROMPT = (
+    "Ты фитнес-тренер с медицинским образованием. "
+    "Принципы: безопасность, индивидуальный подход, научная обоснованность."
+)
+
+# tiktoken необязателен: без него считаем приближённо
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encodings: Dict[str, Any] = {}
+
+_EMOJI_RE = re.compile(
+    "[\U0001F000-\U0001FAFF\U00002600-\U000027BF\U0000FE0F\U0000200D\U00002B00-\U00002BFF]"
+)
+_CYRILLIC_RE = re.compile(r"[а-яёА-ЯЁ]")
+_WORD_RE = re.compile(r"[A-Za-z0-9]")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def _encoding(model: str) -> Any:
+    name = "o200k_base" if any(m in model for m in ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3")) else "cl100k_base"
+    if name not in _encodings:
+        _encodings[name] = tiktoken.get_encoding(name)
+    return _encodings[name]
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """Число токенов: через tiktoken, если установлен, иначе оценка по классам символов"""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        try:
+            return len(_encoding(model).encode(text))
+        except Exception:
+            pass
+    # Кириллица ~2.5 символа на токен, латиница и цифры ~4, эмодзи ~2 токена
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    latin = len(_WORD_RE.findall(text))
+    emoji = len(_EMOJI_RE.findall(text))
+    punct = len(_PUNCT_RE.findall(text)) - emoji
+    return math.ceil(cyrillic / 2.5 + latin / 4 + max(punct, 0) * 0.7 + emoji * 2)
+
+
+def compact_text(text: str) -> str:
+    """Убирает эмодзи, декоративные символы и лишние пробелы"""
+    text = _EMOJI_RE.sub("", text)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    return re.sub(r"\n{2,}", "\n", text).strip()
+
+
+def truncate_to_tokens(text: str, budget: int, model: str = "") -> str:
+    """Обрезка текста до budget токенов (по словам)"""
+    if count_tokens(text, model) <= budget:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle]), model) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + "…"
+
+
+class BuiltPrompt(NamedTuple):
+    system: str
+    user: str
+    prompt_tokens: int
+    max_tokens: int
+
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user},
+        ]
+
+
+def max_tokens_for(size: Optional[str] = None) -> int:
+    return PLAN_SIZES.get(size or PLAN_SIZE, PLAN_SIZES["standard"])
+
+
+def _fit(parts: List[Tuple[str, int]], budget: int, model: str) -> str:
+    """
+    Сборка промпта из частей (текст, приоритет): пока не влезаем в бюджет,
+    выбрасываем части с наименьшим приоритетом; приоритет 0 не выбрасывается.
+    """
+    kept = [(compact_text(text), priority) for text, priority in parts if text]
+    while True:
+        prompt = "\n".join(text for text, _ in kept)
+        if count_tokens(prompt, model) <= budget:
+            return prompt
+        optional = [item for item in kept if item[1] > 0]
+        if not optional:
+            return prompt
+        kept.remove(max(optional, key=lambda item: item[1]))
+
+
+def _client_line(data: Dict[str, Any], full: bool = True) -> str:
+    fields = [
+        f"Имя: {data.get('name') or 'Клиент'}",
+    ]
+    if full:
+        fields += [
+            f"возраст {data.get('age') or '?'}",
+            f"рост {data.get('height') or '?'} см",
+            f"вес {data.get('weight') or '?'} кг",
+            f"уровень: {data.get('fitness_level') or 'начинающий'}",
+        ]
+    fields += [
+        f"цели: {data.get('goals') or 'общее укрепление здоровья'}",
+        f"травмы/ограничения: {data.get('injuries') or 'нет'}",
+    ]
+    return "Клиент. " + "; ".join(fields) + "."
+
+
+def _length_hint(max_tokens: int) -> str:
+    # Ответ должен закончиться до max_tokens: ~0.35 русского слова на токен
+    return f"Объём ответа: не более {int(max_tokens * 0.35)} слов."
+
+
+def build_plan_prompt(data: Dict[str, Any], size: Optional[str] = None, model: str = "",
+                      budget: int = PROMPT_TOKEN_BUDGET) -> BuiltPrompt:
+    """Промпт нового плана, сжатый до budget токенов"""
+    max_tokens = max_tokens_for(size)
+    user = _fit([
+        ("Составь персонализированный фитнес-план на 4 недели.", 0),
+        (_client_line(data), 0),
+        ("Нужно: прогрессия нагрузок по неделям; расписание тренировок; "
+         "упражнения с подходами и повторами; питание; восстановление; меры предосторожности.", 0),
+        ("Для каждого упражнения — одна строка о технике." if (size or PLAN_SIZE) == "detailed" else "", 0),
+        ("Каждый раздел начинай с заголовка «## ». Формат Markdown, тон мотивирующий.", 1),
+        (_length_hint(max_tokens), 2),
+    ], budget, model)
+    return BuiltPrompt(SYSTEM_PROMPT, user, count_tokens(SYSTEM_PROMPT + user, model), max_tokens)
+
+
+def build_edit_prompt(data: Dict[str, Any], edit_text: str, size: Optional[str] = None,
+                      model: str = "", budget: int = PROMPT_TOKEN_BUDGET) -> BuiltPrompt:
+    """Промпт плана с правками тренера; длинные правки обрезаются по бюджету"""
+    max_tokens = max_tokens_for(size)
+    head = [
+        ("Пересмотри фитнес-план с учётом правок тренера, сохранив безопасность.", 0),
+        (_client_line(data, full=False), 0),
+    ]
+    tail = [
+        ("Каждый раздел начинай с заголовка «## ». Кратко обоснуй изменения.", 1),
+        (_length_hint(max_tokens), 2),
+    ]
+    fixed = count_tokens("\n".join(compact_text(text) for text, _ in head + tail), model)
+    edit = truncate_to_tokens(compact_text(edit_text), max(50, budget - fixed - 10), model)
+    user = _fit(head + [(f"Правки тренера: {edit}", 0)] + tail, budget, model)
+    return BuiltPrompt(SYSTEM_PROMPT, user, count_tokens(SYSTEM_PROMPT + user, model), max_tokens)
+
+
+def build_section_prompt(data: Dict[str, Any], section_text: str, edit_text: str,
+                         titles: Optional[List[str]] = None, size: Optional[str] = None,
+                         model: str = "", budget: int = PROMPT_TOKEN_BUDGET) -> BuiltPrompt:
+    """
+    Промпт одного раздела плана с правкой тренера. Раздел передаётся целиком
+    (сверх budget), max_tokens — по размеру раздела, а не всего плана.
+    """
+    section_tokens = count_tokens(section_text, model)
+    max_tokens = min(max_tokens_for(size), int(section_tokens * 1.5) + 100)
+    head = [
+        ("Перепиши один раздел фитнес-плана с учётом правки тренера, сохранив безопасность.", 0),
+        (_client_line(data, full=False), 0),
+        (f"Другие разделы плана (не меняются): {'; '.join(titles)}." if titles else "", 2),
+    ]
+    tail = [
+        ("Верни только этот раздел с тем же заголовком «## », без пояснений и других разделов.", 0),
+        (_length_hint(max_tokens), 1),
+    ]
+    fixed = count_tokens("\n".join(compact_text(text) for text, _ in head + tail), model)
+    edit = truncate_to_tokens(compact_text(edit_text), max(50, budget - fixed - 10), model)
+    user = _fit(head + [(f"Правка тренера: {edit}", 0)] + tail, budget, model)
+    user = f"{user}\nРаздел:\n{section_text.strip()}"
+    return BuiltPrompt(SYSTEM_PROMPT, user, count_tokens(SYSTEM_PROMPT + user, model), max_tokens)
+
+
+# Метки метрик — латиницей
+_TOKEN_KINDS = {"план": "plan", "правки": "edit", "раздел": "revise"}
+
+
+def log_token_report(built: BuiltPrompt, usage: Any, kind: str = "план") -> None:
+    """Токены запроса: оценка до отправки и фактические из ответа"""
+    label = _TOKEN_KINDS.get(kind, kind)
+    if not usage:
+        LLM_TOKENS.observe(built.prompt_tokens, kind=label, direction="prompt")
+        logger.info(f"📊 Токены ({kind}): prompt ~{built.prompt_tokens}, max_tokens {built.max_tokens}")
+        return
+    LLM_TOKENS.observe(usage.prompt_tokens, kind=label, direction="prompt")
+    LLM_TOKENS.observe(usage.completion_tokens, kind=label, direction="completion")
+    logger.info(
+        f"📊 Токены ({kind}): prompt {usage.prompt_tokens} (оценка {built.prompt_tokens}), "
+        f"completion {usage.completion_tokens} из {built.max_tokens}"
+    )
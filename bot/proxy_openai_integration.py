@@ -4,201 +4,430 @@ OpenAI через ProxyAPI для генерации фитнес-планов
 """
 
 import os
+import time
+import asyncio
 import logging
-from typing import Optional, Dict, Any
-from openai import OpenAI
+import importlib.util
+from typing import Optional, Dict, Any, List, Iterator, AsyncIterator
+
+from usage_ledger import usage_ledger, estimate_cost
+from resolver import httpx_transport
+from prompts import (
+    BuiltPrompt, SYSTEM_PROMPT, build_plan_prompt, build_edit_prompt, build_section_prompt, log_token_report,
+)
 
 logger = logging.getLogger(__name__)
 
-class ProxyOpenAI:
-    def __init__(self):
+# openai и httpx импортируются при создании первого клиента (это ~0.4 с старта);
+# без SDK gigachat_integration и реестр провайдеров переключаются на шаблоны
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+
+# Сколько генераций может идти одновременно и сколько соединений держать открытыми
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_KEEPALIVE_CONNECTIONS', '10'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '90'))
+
+# Хедж-запросы: другая модель и/или другой эндпоинт (пусто — хеджирование выключено)
+PROXY_HEDGE_MODEL = os.getenv('PROXY_HEDGE_MODEL', '')
+PROXY_HEDGE_API_URL = os.getenv('PROXY_HEDGE_API_URL', '')
+
+# Версия промптов: входит в ключ кэша планов, менять при правке prompts.py
+PROMPT_VERSION = "2"
+
+
+class _ProxyOpenAIBase:
+    """Общие настройки и промпты синхронного и асинхронного клиентов"""
+
+    def _load_settings(self) -> None:
         self.api_key = os.getenv('PROXY_API_KEY')
         self.base_url = os.getenv('PROXY_API_URL', 'https://openai.api.proxyapi.ru/v1')
         self.model = os.getenv('PROXY_MODEL', 'openai/gpt-5-nano')
-        
+
         if not self.api_key:
             logger.error("❌ PROXY_API_KEY не установлен")
             raise ValueError("PROXY_API_KEY не установлен")
-        
+
+    def _build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Системное и пользовательское сообщения для запроса"""
+        return [
+            {
+                "role": "system",
+                "content": self._get_system_prompt()
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+    def _log_usage(self, plan: str, usage: Any, built: Optional[BuiltPrompt] = None) -> None:
+        """Логирование размера плана, токенов и стоимости"""
+        logger.info(f"✅ План сгенерирован ({len(plan)} символов)")
+        if built:
+            log_token_report(built, usage)
+        if usage:
+            cost = self._estimate_cost(usage.prompt_tokens, usage.completion_tokens)
+            if cost is not None:
+                logger.info(f"💰 Стоимость: {cost:.3f} ₽")
+
+    def _record_usage(self, kind: str, data: Dict[str, Any], usage: Any, started: float,
+                      cache: str = "miss") -> None:
+        """Строка в журнал использования (llm_usage)"""
+        usage_ledger.record(
+            kind, self.model, provider="proxyapi", user_id=data.get("user_id"),
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            latency=time.monotonic() - started, cache=cache,
+        )
+
+    def _plan_request(self, data: Dict[str, Any]) -> BuiltPrompt:
+        """Промпт плана в пределах бюджета токенов и max_tokens по размеру плана"""
+        return build_plan_prompt(data, model=self.model)
+
+    def _edit_request(self, data: Dict[str, Any], edit_text: str) -> BuiltPrompt:
+        return build_edit_prompt(data, edit_text, model=self.model)
+
+    def _build_prompt(self, data: Dict[str, Any]) -> str:
+        """Создание промпта для фитнес-плана"""
+        return self._plan_request(data).user
+
+    def _build_prompt_with_edit(self, data: Dict[str, Any], edit_text: str) -> str:
+        """Промпт для плана с правками"""
+        return self._edit_request(data, edit_text).user
+
+    def _get_system_prompt(self) -> str:
+        """Системный промпт"""
+        return SYSTEM_PROMPT
+
+    def _estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+        """Оценка стоимости в рублях по общей таблице тарифов (за 1 млн токенов)"""
+        return estimate_cost(self.model, prompt_tokens, completion_tokens)
+
+
+class ProxyOpenAI(_ProxyOpenAIBase):
+    def __init__(self):
+        self._load_settings()
+        from openai import OpenAI
+
         self.client = OpenAI(
             api_key=self.api_key,
             base_url=self.base_url,
             timeout=60.0
         )
-        
+
         logger.info(f"✅ OpenAI через ProxyAPI: {self.model}")
         logger.info(f"💰 Стоимость: ~0.15 ₽ за фитнес-план")
-    
+
     def generate_plan(self, data: Dict[str, Any]) -> Optional[str]:
         """Генерация фитнес-плана"""
         try:
-            prompt = self._build_prompt(data)
-            
+            built = self._plan_request(data)
+
             logger.info(f"Генерация плана для {data.get('name', 'пользователя')}...")
-            
+
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self._get_system_prompt()
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
+                messages=built.messages,
                 temperature=0.7,
-                max_tokens=3000
+                max_tokens=built.max_tokens
             )
-            
+
             plan = response.choices[0].message.content
-            
+
             if plan:
-                # Логируем использование
-                usage = response.usage
-                if usage:
-                    prompt_tokens = usage.prompt_tokens
-                    completion_tokens = usage.completion_tokens
-                    cost = self._estimate_cost(prompt_tokens, completion_tokens)
-                    
-                    logger.info(f"✅ План сгенерирован ({len(plan)} символов)")
-                    logger.info(f"📊 Токены: {prompt_tokens} prompt, {completion_tokens} completion")
-                    logger.info(f"💰 Стоимость: {cost:.3f} ₽")
-                else:
-                    logger.info(f"✅ План сгенерирован ({len(plan)} символов)")
-                
+                self._log_usage(plan, response.usage, built)
                 return plan
             else:
                 logger.error("❌ Пустой ответ от API")
                 return None
-                
+
         except Exception as e:
             logger.error(f"❌ Ошибка генерации плана: {e}")
             return None
-    
+
     def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str) -> Optional[str]:
         """Генерация плана с правками тренера"""
         try:
-            prompt = self._build_prompt_with_edit(data, edit_text)
-            
+            built = self._edit_request(data, edit_text)
+
             logger.info(f"Генерация плана с правками...")
-            
+
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self._get_system_prompt()
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                messages=built.messages,
                 temperature=0.7,
-                max_tokens=3000
+                max_tokens=built.max_tokens
             )
-            
+
             plan = response.choices[0].message.content
-            
+
             if plan:
                 logger.info(f"✅ План с правками сгенерирован ({len(plan)} символов)")
+                log_token_report(built, response.usage, "правки")
                 return plan
             else:
                 logger.error("❌ Пустой ответ от API")
                 return None
-                
+
         except Exception as e:
             logger.error(f"❌ Ошибка генерации плана с правками: {e}")
             return None
-    
-    def _build_prompt(self, data: Dict[str, Any]) -> str:
-        """Создание промпта для фитнес-плана"""
-        return f"""Создай подробный персонализированный фитнес-план на 4 недели.
-
-👤 ДАННЫЕ КЛИЕНТА:
-• Имя: {data.get('name', 'Клиент')}
-• Возраст: {data.get('age', 'Не указан')}
-• Рост: {data.get('height', 'Не указан')} см
-• Вес: {data.get('weight', 'Не указан')} кг
-• Уровень подготовки: {data.get('fitness_level', 'Начинающий')}
-• Цели: {data.get('goals', 'Общее укрепление здоровья')}
-• Ограничения/травмы: {data.get('injuries', 'Нет')}
-
-🎯 ТРЕБОВАНИЯ К ПЛАНУ:
-1. 4 недели с прогрессией нагрузок
-2. Подробное расписание тренировок
-3. Конкретные упражнения с техникой
-4. Рекомендации по питанию
-5. Советы по восстановлению
-6. Меры предосторожности
-
-📝 ФОРМАТ: Используй Markdown, будь структурированным и мотивирующим."""
-    
-    def _build_prompt_with_edit(self, data: Dict[str, Any], edit_text: str) -> str:
-        """Промпт для плана с правками"""
-        return f"""Пересмотри фитнес-план с учетом правок тренера.
 
-👤 ДАННЫЕ КЛИЕНТА:
-• Имя: {data.get('name', 'Клиент')}
-• Цели: {data.get('goals', 'Общее укрепление')}
-• Ограничения: {data.get('injuries', 'Нет')}
+    def stream_plan(self, data: Dict[str, Any]) -> Iterator[str]:
+        """Потоковая генерация плана: отдаёт фрагменты текста по мере готовности"""
+        built = self._plan_request(data)
 
-✏️ ПРАВКИ ТРЕНЕРА:
-{edit_text}
+        logger.info(f"Потоковая генерация плана для {data.get('name', 'пользователя')}...")
 
-🎯 ЗАДАЧА:
-1. Учти все правки тренера
-2. Создай обновленный план
-3. Сохрани безопасность и эффективность
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=built.messages,
+            temperature=0.7,
+            max_tokens=built.max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
-📝 ФОРМАТ: Markdown, с обоснованием изменений."""
-    
-    def _get_system_prompt(self) -> str:
-        """Системный промпт"""
-        return """Ты профессиональный фитнес-тренер с медицинским образованием.
-Твои принципы: безопасность, индивидуальный подход, научная обоснованность.
-Создавай персонализированные, мотивирующие и эффективные планы тренировок."""
-    
-    def _estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
-        """Оценка стоимости в рублях"""
-        model_name = self.model.split('/')[-1] if '/' in self.model else self.model
-        
-        # Цены за 1 МИЛЛИОН токенов
-        prices = {
-            'gpt-5-nano': {'input': 12.24, 'output': 97.92},
-            'gpt-5-mini': {'input': 61.20, 'output': 489.60},
-            'gpt-4.1-nano': {'input': 24.48, 'output': 97.92},
-        }
-        
-        if model_name in prices:
-            price = prices[model_name]
-            cost = (prompt_tokens / 1_000_000 * price['input']) + \
-                   (completion_tokens / 1_000_000 * price['output'])
-            return round(cost, 4)
-        
-        return 0.15  # Примерная стоимость
-    
     def test_connection(self) -> bool:
         """Тест подключения"""
         try:
-            response = self.client.chat.completions.create(
+            # Доступность — сам успешный ответ API: рассуждающая модель (gpt-5-nano)
+            # на коротком лимите может вернуть пустой текст
+            self.client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": "Ответь 'OK'"}],
                 max_tokens=5,
                 timeout=10
             )
-            return bool(response.choices[0].message.content)
+            return True
         except:
             return False
 
-# Глобальный экземпляр для использования в других модулях
-proxy_api = ProxyOpenAI()
+
+class AsyncProxyOpenAI(_ProxyOpenAIBase):
+    """Асинхронный клиент: пул keep-alive соединений и ограничение одновременных генераций"""
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_KEEPALIVE_CONNECTIONS,
+        model: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ):
+        self._load_settings()
+        self.model = model or self.model
+        self.base_url = base_url or self.base_url
+        import httpx
+        from openai import AsyncOpenAI
+
+        # Один httpx-клиент на процесс: TLS-соединения к прокси переиспользуются
+        # Лимиты задаются транспорту: при явном transport httpx игнорирует limits клиента
+        self.http_client = httpx.AsyncClient(
+            transport=httpx_transport(limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            )),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=self.http_client,
+            timeout=60.0
+        )
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        logger.info(f"✅ AsyncOpenAI через ProxyAPI: {self.model} (до {max_concurrency} генераций параллельно)")
+
+    async def _complete(self, built: BuiltPrompt) -> Any:
+        async with self._semaphore:
+            return await self.client.chat.completions.create(
+                model=self.model,
+                messages=built.messages,
+                temperature=0.7,
+                max_tokens=built.max_tokens
+            )
+
+    async def generate_plan(self, data: Dict[str, Any]) -> Optional[str]:
+        """Генерация фитнес-плана"""
+        try:
+            built = self._plan_request(data)
+
+            logger.info(f"Генерация плана для {data.get('name', 'пользователя')}...")
+
+            started = time.monotonic()
+            response = await self._complete(built)
+            plan = response.choices[0].message.content
+
+            if plan:
+                self._log_usage(plan, response.usage, built)
+                self._record_usage("plan", data, response.usage, started)
+                return plan
+            else:
+                logger.error("❌ Пустой ответ от API")
+                return None
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации плана: {e}")
+            return None
+
+    async def generate_plan_with_edit(self, data: Dict[str, Any], edit_text: str) -> Optional[str]:
+        """Генерация плана с правками тренера"""
+        try:
+            built = self._edit_request(data, edit_text)
+
+            logger.info(f"Генерация плана с правками...")
+
+            started = time.monotonic()
+            response = await self._complete(built)
+            plan = response.choices[0].message.content
+
+            if plan:
+                logger.info(f"✅ План с правками сгенерирован ({len(plan)} символов)")
+                log_token_report(built, response.usage, "правки")
+                self._record_usage("edit", data, response.usage, started, cache="bypass")
+                return plan
+            else:
+                logger.error("❌ Пустой ответ от API")
+                return None
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации плана с правками: {e}")
+            return None
+
+    async def revise_section(self, data: Dict[str, Any], section: str, edit_text: str,
+                             titles: Optional[List[str]] = None) -> Optional[str]:
+        """Один раздел плана с правкой тренера"""
+        try:
+            built = build_section_prompt(data, section, edit_text, titles, model=self.model)
+            started = time.monotonic()
+            response = await self._complete(built)
+            text = response.choices[0].message.content
+            if not text:
+                logger.error("❌ Пустой ответ от API")
+                return None
+            log_token_report(built, response.usage, "раздел")
+            self._record_usage("revise", data, response.usage, started, cache="bypass")
+            return text
+        except Exception as e:
+            logger.error(f"❌ Ошибка переработки раздела: {e}")
+            return None
+
+    async def stream_plan(self, data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Потоковая генерация плана: отдаёт фрагменты текста по мере готовности"""
+        built = self._plan_request(data)
+
+        logger.info(f"Потоковая генерация плана для {data.get('name', 'пользователя')}...")
+
+        async with self._semaphore:
+            started = time.monotonic()
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=built.messages,
+                temperature=0.7,
+                max_tokens=built.max_tokens,
+                stream=True,
+                # Последний фрагмент несёт usage — те же отчёты по токенам, что и без потока
+                stream_options={"include_usage": True}
+            )
+            usage = None
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            log_token_report(built, usage)
+            self._record_usage("stream", data, usage, started)
+
+    async def test_connection(self) -> bool:
+        """Тест подключения"""
+        try:
+            # Как и в синхронном клиенте: здоров, если API ответил без ошибки
+            await self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": "Ответь 'OK'"}],
+                max_tokens=5,
+                timeout=10
+            )
+            return True
+        except Exception:
+            return False
+
+    async def aclose(self) -> None:
+        """Закрытие пула HTTP-соединений"""
+        await self.http_client.aclose()
+
+
+# Синхронный клиент создаётся при первом обращении: импорт модуля не требует ключа
+_proxy_api: Optional[ProxyOpenAI] = None
+
+def get_proxy_api() -> ProxyOpenAI:
+    global _proxy_api
+    if _proxy_api is None:
+        _proxy_api = ProxyOpenAI()
+    return _proxy_api
+
+def __getattr__(name: str) -> Any:
+    # Совместимость: from proxy_openai_integration import proxy_api
+    if name == "proxy_api":
+        return get_proxy_api()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Асинхронный клиент создаётся при первом обращении (внутри event loop)
+_async_proxy_api: Optional[AsyncProxyOpenAI] = None
+
+def get_async_proxy_api() -> AsyncProxyOpenAI:
+    global _async_proxy_api
+    if _async_proxy_api is None:
+        _async_proxy_api = AsyncProxyOpenAI()
+    return _async_proxy_api
+
+# Второй клиент для хедж-запросов: свой пул соединений и свой лимит параллельности
+_hedge_proxy_api: Optional[AsyncProxyOpenAI] = None
+
+def get_hedge_proxy_api() -> Optional[AsyncProxyOpenAI]:
+    global _hedge_proxy_api
+    if not (PROXY_HEDGE_MODEL or PROXY_HEDGE_API_URL):
+        return None
+    if _hedge_proxy_api is None:
+        _hedge_proxy_api = AsyncProxyOpenAI(model=PROXY_HEDGE_MODEL or None,
+                                            base_url=PROXY_HEDGE_API_URL or None)
+    return _hedge_proxy_api
+
+async def close_async_proxy_api() -> None:
+    global _async_proxy_api, _hedge_proxy_api
+    if _async_proxy_api is not None:
+        await _async_proxy_api.aclose()
+        _async_proxy_api = None
+    if _hedge_proxy_api is not None:
+        await _hedge_proxy_api.aclose()
+        _hedge_proxy_api = None
 
 # Функции для экспорта (для совместимости)
 def generate_plan(data: Dict[str, Any]) -> Optional[str]:
-    return proxy_api.generate_plan(data)
+    return get_proxy_api().generate_plan(data)
 
 def generate_plan_with_edit(data: Dict[str, Any], edit_text: str) -> Optional[str]:
-    return proxy_api.generate_plan_with_edit(data, edit_text)
\ No newline at end of file
+    return get_proxy_api().generate_plan_with_edit(data, edit_text)
+
+async def async_generate_plan(data: Dict[str, Any]) -> Optional[str]:
+    return await get_async_proxy_api().generate_plan(data)
+
+async def async_generate_plan_with_edit(data: Dict[str, Any], edit_text: str) -> Optional[str]:
+    return await get_async_proxy_api().generate_plan_with_edit(data, edit_text)
+
+def hedge_enabled() -> bool:
+    return bool(PROXY_HEDGE_MODEL or PROXY_HEDGE_API_URL)
+
+async def async_hedge_generate_plan(data: Dict[str, Any]) -> Optional[str]:
+    api = get_hedge_proxy_api()
+    return await api.generate_plan(data) if api else None
+
+def async_stream_plan(data: Dict[str, Any]) -> AsyncIterator[str]:
+    return get_async_proxy_api().stream_plan(data)
@@ -0,0 +1,373 @@
+"""
+Общий резолвер DNS для aiohttp (Bot API, GigaChat) и httpx (OpenAI SDK):
+статические адреса хостов, кэш ответов с TTL в процессе и happy eyeballs
+(RFC 8305) — параллельные попытки соединения по адресам хоста с задержкой
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import inspect
+import logging
+import ipaddress
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from aiohttp.abc import AbstractResolver
+
+from metrics import DNS_LOOKUPS, DNS_RESOLVE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DNS_RESOLVER_ENABLED = os.getenv('DNS_RESOLVER', '1') == '1'
+DNS_CACHE_TTL = float(os.getenv('DNS_CACHE_TTL', '300'))
+# Неудачный ответ DNS кэшируется коротко, чтобы не долбить резолвер на каждом запросе
+DNS_NEGATIVE_TTL = float(os.getenv('DNS_NEGATIVE_TTL', '5'))
+# Пауза перед попыткой следующего адреса; 0 — адреса по очереди, без гонки
+HAPPY_EYEBALLS_DELAY = float(os.getenv('HAPPY_EYEBALLS_DELAY', '0.25'))
+DNS_PROBE_TIMEOUT = float(os.getenv('DNS_PROBE_TIMEOUT', '5'))
+
+# Хосты, чей публичный DNS у нас ненадёжен. DNS_OVERRIDES дополняет таблицу:
+# '{"host": "1.2.3.4"}', '{"host": ["1.2.3.4", "5.6.7.8"]}' или 'host=1.2.3.4,host2=5.6.7.8';
+# пустое значение снимает закрепление
+DEFAULT_OVERRIDES: Dict[str, List[str]] = {
+    "ngw.devices.sberbank.ru": ["185.157.96.168"],
+    "gigachat.devices.sberbank.ru": ["185.157.96.168"],
+}
+
+Address = Tuple[int, str]
+
+
+def parse_overrides(value: str) -> Dict[str, List[str]]:
+    value = value.strip()
+    if not value:
+        return {}
+    if value.startswith("{"):
+        raw = json.loads(value)
+    else:
+        raw = dict(item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {
+        host.strip().lower(): [ip.strip() for ip in ([ips] if isinstance(ips, str) else ips) if ip.strip()]
+        for host, ips in raw.items()
+    }
+
+
+def _family_of(ip: str) -> int:
+    return socket.AF_INET6 if ipaddress.ip_address(ip).version == 6 else socket.AF_INET
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def interleave(addresses: List[Address]) -> List[Address]:
+    """Чередование семейств адресов, начиная с первого (RFC 8305, 4)"""
+    if not addresses:
+        return []
+    first = addresses[0][0]
+    primary = [a for a in addresses if a[0] == first]
+    secondary = [a for a in addresses if a[0] != first]
+    result: List[Address] = []
+    for i in range(max(len(primary), len(secondary))):
+        result += primary[i:i + 1] + secondary[i:i + 1]
+    return result
+
+
+async def race(attempts: List[Callable[[], Awaitable[T]]], delay: float,
+               close: Optional[Callable[[T], Any]] = None) -> Tuple[int, T]:
+    """
+    Happy eyeballs: попытка i+1 стартует через delay после попытки i или сразу
+    после её неудачи; первая удачная побеждает, остальные отменяются.
+    Возвращает (номер попытки, результат); если все неудачны — последняя ошибка.
+    """
+    pending: Dict["asyncio.Task[T]", int] = {}
+    queue = iter(enumerate(attempts))
+    errors: List[BaseException] = []
+    extra: List[T] = []
+
+    def start_next() -> bool:
+        item = next(queue, None)
+        if item is None:
+            return False
+        pending[asyncio.ensure_future(item[1]())] = item[0]
+        return True
+
+    start_next()
+    exhausted = False
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=None if exhausted else delay,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                exhausted = not start_next()
+                continue
+            winner: Optional[Tuple[int, T]] = None
+            for task in done:
+                index = pending.pop(task)
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif winner is None:
+                    winner = (index, task.result())
+                else:
+                    extra.append(task.result())
+            if winner is not None:
+                return winner
+            exhausted = not start_next()
+        raise errors[-1] if errors else OSError("Нет адресов для соединения")
+    finally:
+        for task in pending:
+            task.cancel()
+        if close is not None:
+            for result in extra:
+                closing = close(result)
+                if inspect.isawaitable(closing):
+                    await closing
+
+
+@dataclass
+class _Entry:
+    addresses: List[Address]
+    expires_at: float
+    error: Optional[OSError] = None
+    # Адрес, выигравший последнюю гонку соединений: отдаётся первым
+    preferred: Optional[str] = None
+
+
+class Resolver:
+    """Резолвер процесса: закрепления → кэш → системный DNS (в пуле потоков, один запрос на имя)"""
+
+    def __init__(
+        self,
+        overrides: Optional[Dict[str, List[str]]] = None,
+        ttl: float = DNS_CACHE_TTL,
+        negative_ttl: float = DNS_NEGATIVE_TTL,
+        happy_eyeballs_delay: float = HAPPY_EYEBALLS_DELAY,
+    ) -> None:
+        self.overrides = {host: ips for host, ips in (overrides or {}).items() if ips}
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self._cache: Dict[Tuple[str, int], _Entry] = {}
+        self._inflight: Dict[Tuple[str, int], "asyncio.Future[_Entry]"] = {}
+
+    async def lookup(self, host: str, family: int = socket.AF_UNSPEC) -> List[Address]:
+        """Адреса хоста (семейство, IP) в порядке попыток соединения"""
+        host = host.lower().rstrip(".")
+        if _is_ip(host):
+            return [(_family_of(host), host)]
+        pinned = self.overrides.get(host)
+        if pinned:
+            DNS_LOOKUPS.inc(result="override")
+            return [(f, ip) for f, ip in ((_family_of(ip), ip) for ip in pinned)
+                    if family in (socket.AF_UNSPEC, f)]
+
+        key = (host, family)
+        entry = self._cache.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            DNS_LOOKUPS.inc(result="hit" if entry.error is None else "negative_hit")
+        else:
+            entry = await self._refresh(key, stale=entry)
+        if entry.error is not None:
+            raise entry.error
+        return self._ordered(entry)
+
+    async def _refresh(self, key: Tuple[str, int], stale: Optional[_Entry]) -> _Entry:
+        # Одновременные промахи по одному имени ждут один запрос
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._query(*key))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        entry = await asyncio.shield(future)
+        if entry.error is not None and stale is not None and stale.error is None:
+            # DNS недоступен — лучше старые адреса, чем отказ
+            DNS_LOOKUPS.inc(result="stale")
+            logger.warning(f"⚠️ DNS {key[0]}: {entry.error}, используем адреса из кэша")
+            stale.expires_at = time.monotonic() + self.negative_ttl
+            self._cache[key] = stale
+            return stale
+        return entry
+
+    async def _query(self, host: str, family: int) -> _Entry:
+        started = time.perf_counter()
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, family=family, type=socket.SOCK_STREAM)
+            addresses = interleave(list(dict.fromkeys((info[0], info[4][0]) for info in infos)))
+            entry = _Entry(addresses, time.monotonic() + self.ttl)
+            DNS_LOOKUPS.inc(result="miss")
+            DNS_RESOLVE_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+        except OSError as e:
+            entry = _Entry([], time.monotonic() + self.negative_ttl, error=e)
+            DNS_LOOKUPS.inc(result="error")
+            DNS_RESOLVE_SECONDS.observe(time.perf_counter() - started, outcome="error")
+        previous = self._cache.get((host, family))
+        if previous is not None and previous.preferred in [ip for _, ip in entry.addresses]:
+            entry.preferred = previous.preferred
+        self._cache[(host, family)] = entry
+        return entry
+
+    @staticmethod
+    def _ordered(entry: _Entry) -> List[Address]:
+        if entry.preferred is None:
+            return list(entry.addresses)
+        return sorted(entry.addresses, key=lambda address: address[1] != entry.preferred)
+
+    def _remember(self, host: str, ip: str) -> None:
+        host = host.lower().rstrip(".")
+        for (name, _), entry in self._cache.items():
+            if name == host:
+                entry.preferred = ip
+
+    async def connect(self, host: str, addresses: List[Address], connect: Callable[[str], Awaitable[T]],
+                      close: Optional[Callable[[T], Any]] = None) -> T:
+        """Соединение с первым ответившим адресом; победитель запоминается для следующих lookup"""
+        if len(addresses) == 1 or self.happy_eyeballs_delay <= 0:
+            error: Optional[BaseException] = None
+            for _, ip in addresses:
+                try:
+                    return await connect(ip)
+                except Exception as e:
+                    error = e
+            raise error or OSError(f"Нет адресов для {host}")
+        index, result = await race([lambda ip=ip: connect(ip) for _, ip in addresses],
+                                   self.happy_eyeballs_delay, close)
+        if index:
+            logger.info(f"🌐 {host}: быстрее ответил {addresses[index][1]}")
+        self._remember(host, addresses[index][1])
+        return result
+
+    async def probe(self, host: str, port: int, family: int = socket.AF_UNSPEC) -> List[Address]:
+        """
+        Адреса для клиентов, которые соединяются сами (aiohttp 3.8 перебирает
+        адреса по очереди): при нескольких адресах и новом ответе DNS — пробная
+        гонка TCP-соединений, победитель ставится первым
+        """
+        addresses = await self.lookup(host, family)
+        entry = self._cache.get((host.lower().rstrip("."), family))
+        if len(addresses) < 2 or self.happy_eyeballs_delay <= 0 or entry is None or entry.preferred:
+            return addresses
+        loop = asyncio.get_running_loop()
+        try:
+            transport, _ = await asyncio.wait_for(self.connect(
+                host, addresses,
+                lambda ip: loop.create_connection(asyncio.Protocol, ip, port),
+                close=lambda pair: pair[0].close(),
+            ), DNS_PROBE_TIMEOUT)
+            transport.close()
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ {host}:{port} не ответил ни по одному адресу: {e}")
+            return addresses
+        return self._ordered(entry)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "overrides": len(self.overrides),
+            "cached": sum(1 for entry in self._cache.values() if entry.expires_at > now),
+            "failed": sum(1 for entry in self._cache.values() if entry.error is not None),
+        }
+
+
+class AiohttpResolver(AbstractResolver):
+    """Резолвер для aiohttp.TCPConnector(resolver=..., use_dns_cache=False)"""
+
+    def __init__(self, resolver: Optional[Resolver] = None) -> None:
+        self._resolver = resolver or get_resolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        addresses = await self._resolver.probe(host, port, family)
+        return [
+            {"hostname": host, "host": ip, "port": port, "family": address_family,
+             "proto": 0, "flags": socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}
+            for address_family, ip in addresses
+        ]
+
+    async def close(self) -> None:
+        # Кэш общий для процесса и переживает закрытие отдельных сессий
+        return None
+
+
+class _HttpcoreBackend:
+    """Сетевой бэкенд httpcore: адреса из общего резолвера и гонка соединений по ним"""
+
+    def __init__(self, inner: Any, resolver: Resolver) -> None:
+        self._inner = inner
+        self._resolver = resolver
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None, socket_options: Any = None) -> Any:
+        addresses = await self._resolver.lookup(host)
+        # SNI и Host берутся из URL запроса, соединение — по IP
+        return await self._resolver.connect(
+            host, addresses,
+            lambda ip: self._inner.connect_tcp(ip, port, timeout=timeout, local_address=local_address,
+                                               socket_options=socket_options),
+            close=lambda stream: stream.aclose(),
+        )
+
+    async def connect_unix_socket(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._inner.connect_unix_socket(*args, **kwargs)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._inner.sleep(seconds)
+
+
+_resolver: Optional[Resolver] = None
+
+
+def get_resolver() -> Resolver:
+    global _resolver
+    if _resolver is None:
+        overrides = dict(DEFAULT_OVERRIDES)
+        try:
+            overrides.update(parse_overrides(os.getenv('DNS_OVERRIDES', '')))
+        except ValueError:
+            logger.error("❌ DNS_OVERRIDES: ожидается JSON {\"хост\": \"IP\"} или host=IP,host=IP")
+        _resolver = Resolver(overrides)
+    return _resolver
+
+
+def aiohttp_connector_kwargs() -> Dict[str, Any]:
+    """Параметры TCPConnector: общий резолвер вместо встроенного кэша aiohttp"""
+    if not DNS_RESOLVER_ENABLED:
+        return {}
+    return {"resolver": AiohttpResolver(), "use_dns_cache": False}
+
+
+# Пул httpcore подменяется через внутренние поля httpx: версии закреплены в
+# requirements.txt, на других подмена не делается молча, а падает с ошибкой
+_HTTPX_SUPPORTED = ("0.24.",)
+_HTTPCORE_SUPPORTED = ("0.17.",)
+
+
+def httpx_transport(**kwargs: Any) -> Any:
+    """httpx.AsyncHTTPTransport с общим резолвером (kwargs — как у транспорта: limits, retries...)"""
+    import httpx
+    import httpcore
+    transport = httpx.AsyncHTTPTransport(**kwargs)
+    if not DNS_RESOLVER_ENABLED:
+        return transport
+    pool = getattr(transport, "_pool", None)
+    if (not httpx.__version__.startswith(_HTTPX_SUPPORTED)
+            or not httpcore.__version__.startswith(_HTTPCORE_SUPPORTED)
+            or not hasattr(pool, "_network_backend")):
+        raise RuntimeError(
+            f"resolver: httpx {httpx.__version__} / httpcore {httpcore.__version__} не поддерживаются "
+            f"(нужны {_HTTPX_SUPPORTED[0]}x / {_HTTPCORE_SUPPORTED[0]}x из requirements.txt); "
+            "обновите _HttpcoreBackend или отключите DNS_RESOLVER=0"
+        )
+    # httpx 0.24 не принимает network_backend, подменяем бэкенд пула httpcore
+    pool._network_backend = _HttpcoreBackend(pool._network_backend, get_resolver())
+    return transport
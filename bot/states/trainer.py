@@ -0,0 +1,4 @@
+from aiogram.fsm.state import StatesGroup, State
+
+class TrainerStates(StatesGroup):
+    awaiting_edit = State()
@@ -0,0 +1,17 @@
+"""
+Тесты запускаются из корня репозитория или из bot/: модули бота
+импортируются как в main.py — от каталога bot
+"""
+
+import os
+import sys
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Корень репозитория содержит одноимённые старые модули — bot должен идти первым
+if BOT_DIR in sys.path:
+    sys.path.remove(BOT_DIR)
+sys.path.insert(0, BOT_DIR)
+
+# Пакет utils при импорте собирает провайдеров LLM: им нужны хоть какие-то ключи
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("PROXY_API_KEY", "test")
@@ -0,0 +1,113 @@
+"""
+Склейка одинаковых генераций: отмена ведущего не должна превращаться
+в CancelledError у ждущих (иначе гибнет воркер очереди)
+"""
+
+import asyncio
+
+import pytest
+
+from utils.coalesce import SingleFlight
+
+
+def test_follower_gets_error_when_flight_cancelled():
+    async def scenario():
+        flights = SingleFlight("plan")
+        flight = flights.begin("k")
+        follower = asyncio.create_task(flights.join(flights.get("k")))
+        await asyncio.sleep(0)
+        flight.cancel()
+        with pytest.raises(RuntimeError):
+            await follower
+        assert not follower.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_follower_gets_stream_abort_error():
+    async def scenario():
+        flights = SingleFlight("plan")
+        flight = flights.begin("k")
+        follower = asyncio.create_task(flights.join(flights.get("k")))
+        await asyncio.sleep(0)
+        flight.set_exception(RuntimeError("stream aborted"))
+        with pytest.raises(RuntimeError, match="stream aborted"):
+            await follower
+        assert flights.get("k") is None
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_follower_keeps_generation():
+    async def scenario():
+        flights = SingleFlight("plan")
+        release = asyncio.Event()
+
+        async def call():
+            await release.wait()
+            return "plan"
+
+        leader = asyncio.create_task(flights.do("k", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", call))
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        release.set()
+        assert await leader == "plan"
+        assert flights.stats_dict()["leaders"] == 1
+        assert flights.stats_dict()["shared"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_does_not_stop_shared_call():
+    async def scenario():
+        flights = SingleFlight("plan")
+        release = asyncio.Event()
+
+        async def call():
+            await release.wait()
+            return "plan"
+
+        leader = asyncio.create_task(flights.do("k", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == "plan"
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_stream_closed_early_fails_joined_generation(monkeypatch):
+    import utils.utils as bot_utils
+
+    async def sdk_stream(user_data):
+        yield "## Неделя 1\n"
+        await asyncio.sleep(10)
+        yield "Присед"
+
+    async def no_cache(user_data):
+        return None
+
+    monkeypatch.setattr(bot_utils, "_sdk_stream_plan", sdk_stream)
+    monkeypatch.setattr(bot_utils, "_offline_plan", lambda user_data: None)
+    monkeypatch.setattr(bot_utils.plan_cache, "get", no_cache)
+
+    async def scenario():
+        user_data = {"user_id": 1, "age": 30, "goal": "похудение"}
+        stream = bot_utils.stream_plan(user_data)
+        assert await stream.__anext__() == "## Неделя 1\n"
+        shared = bot_utils.plan_flights.get(bot_utils._plan_key(user_data))
+        follower = asyncio.create_task(bot_utils.plan_flights.join(shared))
+        await asyncio.sleep(0)
+        await stream.aclose()
+        with pytest.raises(RuntimeError, match="stream aborted"):
+            await follower
+
+    asyncio.run(scenario())
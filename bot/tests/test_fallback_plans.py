@@ -0,0 +1,29 @@
+"""
+Шаблонные планы: все профили собраны при импорте, травмы вне каталога
+помечаются в плане и уводят анкету из «стандартных»
+"""
+
+import fallback_plans
+from fallback_plans import build_plan, profile_from_anketa
+
+ANKETA = {"name": "Иван", "goals": "похудение", "fitness_level": "", "height": 180, "weight": 80}
+
+
+def test_all_profiles_prebuilt():
+    expected = len(fallback_plans.GOALS) * len(fallback_plans.LEVELS) * 32 * len(fallback_plans.BMI_BANDS)
+    assert len(fallback_plans._PLAN_BODIES) == expected
+
+
+def test_known_injuries_are_standard():
+    profile = profile_from_anketa({**ANKETA, "injuries": "спина и давление"})
+    assert profile.standard and not profile.unknown_injuries
+    assert profile.injury_mask == fallback_plans._TAG_BITS["back"] | fallback_plans._TAG_BITS["heart"]
+
+
+def test_unknown_injury_is_flagged():
+    data = {**ANKETA, "injuries": "больное колено, астма"}
+    profile = profile_from_anketa(data)
+    assert profile.unknown_injuries == ("астма",)
+    assert profile.injury_mask == fallback_plans._TAG_BITS["knees"]
+    assert not profile.standard
+    assert "Не учтены ограничения: астма" in build_plan(data)[:800]
@@ -0,0 +1,184 @@
+"""
+Хранилища FSM, общие для процессов: сквозная запись в Postgres и
+RedisStorage против локальной заглушки с протоколом Redis
+"""
+
+import asyncio
+import contextlib
+import time
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import utils.db
+from utils.fsm_storage import PostgresStorage, create_redis_storage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+class FakeTable:
+    """fsm_state одной БД, к которой ходят несколько процессов"""
+
+    def __init__(self):
+        self.rows = {}
+        self.fail = False
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def executemany(self, query, rows):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError("БД недоступна")
+        for key, state, data, set_state, set_data in rows:
+            row = self.rows.setdefault(key, {"state": None, "data": "{}"})
+            if set_state:
+                row["state"] = state
+            if set_data:
+                row["data"] = data
+
+    async def fetchrow(self, query, key, ttl):
+        await asyncio.sleep(0)
+        return self.rows.get(key)
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(utils.db, "acquire", table.acquire)
+    return table
+
+
+def test_write_through_is_visible_to_other_process(table):
+    async def scenario():
+        first, second = PostgresStorage(), PostgresStorage()
+        await first.start()
+        await second.start()
+        await first.set_state(KEY, "Anketa:age")
+        await first.set_data(KEY, {"name": "Иван"})
+        assert await second.get_state(KEY) == "Anketa:age"
+        assert await second.get_data(KEY) == {"name": "Иван"}
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_write_through_surfaces_db_errors(table):
+    async def scenario():
+        storage = PostgresStorage()
+        table.fail = True
+        with pytest.raises(ConnectionError):
+            await storage.set_state(KEY, "Anketa:age")
+
+    asyncio.run(scenario())
+
+
+def test_buffered_mode_is_opt_in(table):
+    async def scenario():
+        first, second = PostgresStorage(flush_interval=60), PostgresStorage()
+        await first.start()
+        await first.set_state(KEY, "Anketa:age")
+        # Свои записи видны сразу, чужому процессу — только после сброса буфера
+        assert await first.get_state(KEY) == "Anketa:age"
+        assert await second.get_state(KEY) is None
+        assert await first.flush() == 1
+        assert await second.get_state(KEY) == "Anketa:age"
+        await first.close()
+
+    asyncio.run(scenario())
+
+
+class RedisStandIn:
+    """Минимальный сервер протокола Redis: GET, SET [EX|PX], DEL и рукопожатие клиента"""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                writer.write(self._execute(command))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        header = await reader.readline()
+        if not header:
+            return None
+        parts = []
+        for _ in range(int(header[1:])):
+            length = int((await reader.readline())[1:])
+            parts.append((await reader.readexactly(length + 2))[:-2])
+        return parts
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+    def _execute(self, command):
+        name = command[0].upper()
+        if name == b"GET":
+            if not self._alive(command[1]):
+                return b"$-1\r\n"
+            value = self.values[command[1]]
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            key, value, options = command[1], command[2], [part.upper() for part in command[3:]]
+            self.values[key] = value
+            self.expires.pop(key, None)
+            if b"EX" in options:
+                self.expires[key] = time.monotonic() + int(command[3 + options.index(b"EX") + 1])
+            if b"PX" in options:
+                self.expires[key] = time.monotonic() + int(command[3 + options.index(b"PX") + 1]) / 1000
+            return b"+OK\r\n"
+        if name == b"DEL":
+            removed = sum(1 for key in command[1:] if self._alive(key) and self.values.pop(key))
+            return b":%d\r\n" % removed
+        if name in (b"PING",):
+            return b"+PONG\r\n"
+        if name in (b"CLIENT", b"SELECT"):
+            return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+def test_redis_storage_shared_between_processes():
+    async def scenario():
+        server = RedisStandIn()
+        port = await server.start()
+        url = f"redis://127.0.0.1:{port}/0"
+        first, second = create_redis_storage(url, ttl=60), create_redis_storage(url, ttl=60)
+        try:
+            await first.set_state(KEY, "Anketa:age")
+            await first.set_data(KEY, {"name": "Иван"})
+            assert await second.get_state(KEY) == "Anketa:age"
+            assert await second.get_data(KEY) == {"name": "Иван"}
+            # Состояние и данные живут не дольше FSM_TTL
+            assert len(server.expires) == 2
+            await second.set_state(KEY, None)
+            assert await first.get_state(KEY) is None
+        finally:
+            await first.close()
+            await second.close()
+            await server.stop()
+
+    asyncio.run(scenario())
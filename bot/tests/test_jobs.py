@@ -0,0 +1,130 @@
+"""
+Очередь генераций: повторы, отказ, остановка с дренажом и живучесть
+воркеров при сбоях бэкенда и посторонней отмене
+"""
+
+import asyncio
+
+from utils.jobs import InMemoryJobBackend, JobQueue, JobStatus
+
+
+def _queue(executor, workers=1, **kwargs):
+    done, failed = [], []
+
+    async def on_complete(job):
+        done.append(job)
+
+    async def on_failure(job):
+        failed.append(job)
+
+    queue = JobQueue(InMemoryJobBackend(), executor, on_complete=on_complete, on_failure=on_failure,
+                     workers=workers, backoff_base=0.01, backoff_max=0.01, **kwargs)
+    return queue, done, failed
+
+
+async def _until(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "не дождались"
+        await asyncio.sleep(0.01)
+
+
+def test_retry_then_success():
+    async def scenario():
+        async def executor(job):
+            if job.attempts == 1:
+                raise RuntimeError("503")
+            return "plan"
+
+        queue, done, failed = _queue(executor)
+        await queue.start()
+        job = await queue.enqueue("plan", {"user_id": 1})
+        await _until(lambda: done)
+        await queue.stop()
+        assert job.status == JobStatus.DONE and job.attempts == 2 and not failed
+
+    asyncio.run(scenario())
+
+
+def test_fail_after_max_attempts():
+    async def scenario():
+        async def executor(job):
+            raise RuntimeError("500")
+
+        queue, done, failed = _queue(executor, max_attempts=2)
+        await queue.start()
+        job = await queue.enqueue("plan", {"user_id": 1})
+        await _until(lambda: failed)
+        await queue.stop()
+        assert job.status == JobStatus.FAILED and job.attempts == 2 and not done
+
+    asyncio.run(scenario())
+
+
+def test_stray_cancellation_fails_job_and_keeps_worker():
+    async def scenario():
+        async def executor(job):
+            if job.payload["user_id"] == 1:
+                # Например, отменённая общая генерация, к которой задача присоединилась
+                future = asyncio.get_running_loop().create_future()
+                future.cancel()
+                await future
+            return "plan"
+
+        queue, done, failed = _queue(executor, max_attempts=1)
+        await queue.start()
+        await queue.enqueue("plan", {"user_id": 1})
+        await queue.enqueue("plan", {"user_id": 2})
+        await _until(lambda: failed and done)
+        assert not any(task.done() for task in queue._tasks)
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_backend_error_keeps_worker():
+    async def scenario():
+        queue, done, failed = _queue(lambda job: asyncio.sleep(0, "plan"))
+        complete = queue.backend.complete
+        calls = []
+
+        async def flaky_complete(job):
+            calls.append(job)
+            if len(calls) == 1:
+                raise ConnectionError("БД недоступна")
+            await complete(job)
+
+        queue.backend.complete = flaky_complete
+        await queue.start()
+        await queue.enqueue("plan", {"user_id": 1})
+        await queue.enqueue("plan", {"user_id": 2})
+        await _until(lambda: len(calls) == 2 and done)
+        assert not queue._tasks[0].done()
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_drains_current_jobs_without_taking_new():
+    async def scenario():
+        started = []
+
+        async def executor(job):
+            started.append(job)
+            await asyncio.sleep(0.1)
+            return "plan"
+
+        queue, done, failed = _queue(executor, workers=2)
+        await queue.start()
+        for user_id in range(10):
+            await queue.enqueue("plan", {"user_id": user_id})
+        await _until(lambda: len(started) == 2)
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        await queue.stop(timeout=5)
+        # Текущие две генерации доделаны, новые не взяты, ждать таймаут не пришлось
+        assert len(done) == 2 and len(started) == 2
+        assert loop.time() - began < 1
+        assert await queue.backend.size() == 8
+
+    asyncio.run(scenario())
@@ -0,0 +1,134 @@
+"""
+Circuit breaker провайдеров и маршрутизация реестра: неудачная проба
+понижает провайдера в очереди, но не отключает его
+"""
+
+import asyncio
+
+from llm_providers import LLMProvider, ProviderRegistry, ProviderState
+
+
+class FakeProvider(LLMProvider):
+    def __init__(self, name, answers=None, probe_ok=True):
+        self.name = name
+        self.answers = list(answers or [])
+        self.probe_ok = probe_ok
+        self.calls = 0
+
+    async def generate_plan(self, data):
+        self.calls += 1
+        answer = self.answers.pop(0) if self.answers else "plan"
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def test_connection(self):
+        return self.probe_ok
+
+
+def _state(failure_threshold=2, cooldown=60.0):
+    return ProviderState(window=10, failure_threshold=failure_threshold, cooldown=cooldown)
+
+
+def test_breaker_opens_after_threshold():
+    state = _state()
+    assert state.allow()
+    state.record(0.1, False)
+    assert state.state == ProviderState.CLOSED
+    state.record(0.1, False)
+    assert state.state == ProviderState.OPEN
+    assert not state.allow()
+
+
+def test_half_open_lets_one_trial_through():
+    state = _state(cooldown=0.0)
+    state.record(0.1, False)
+    state.record(0.1, False)
+    assert state.allow()
+    assert state.state == ProviderState.HALF_OPEN
+    assert not state.allow()
+    state.record(0.2, True)
+    assert state.state == ProviderState.CLOSED
+    assert state.allow()
+
+
+def test_failed_trial_reopens():
+    state = _state(cooldown=0.0)
+    state.record(0.1, False)
+    state.record(0.1, False)
+    assert state.allow()
+    state.record(0.1, False)
+    assert state.state == ProviderState.OPEN
+    assert not state.trial_in_flight
+
+
+def test_unhealthy_is_not_blocked():
+    state = _state()
+    state.healthy = False
+    assert state.allow()
+
+
+def test_registry_uses_only_provider_after_failed_probe():
+    async def scenario():
+        registry = ProviderRegistry(window=10, failure_threshold=2, cooldown=60, probe_interval=0)
+        provider = FakeProvider("only", probe_ok=False)
+        registry.register(provider)
+        await registry.probe()
+        assert not registry.states["only"].healthy
+        assert await registry.generate_plan({}) == "plan"
+        assert registry.states["only"].healthy
+
+    asyncio.run(scenario())
+
+
+def test_registry_prefers_healthy_provider():
+    async def scenario():
+        registry = ProviderRegistry(window=10, failure_threshold=2, cooldown=60, probe_interval=0)
+        sick = FakeProvider("sick", probe_ok=False)
+        well = FakeProvider("well")
+        registry.register(sick)
+        registry.register(well)
+        await registry.probe()
+        assert registry.ranked() == ["well", "sick"]
+        assert await registry.generate_plan({}) == "plan"
+        assert (sick.calls, well.calls) == (0, 1)
+
+    asyncio.run(scenario())
+
+
+def test_registry_falls_over_and_opens_breaker():
+    async def scenario():
+        registry = ProviderRegistry(window=10, failure_threshold=1, cooldown=60, probe_interval=0)
+        broken = FakeProvider("broken", answers=[RuntimeError("500")] * 3)
+        spare = FakeProvider("spare")
+        registry.register(broken)
+        registry.register(spare)
+        assert await registry.generate_plan({}) == "plan"
+        assert registry.states["broken"].state == ProviderState.OPEN
+        assert await registry.generate_plan({}) == "plan"
+        assert broken.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_stream_closed_before_first_chunk_releases_trial():
+    class SlowStream(FakeProvider):
+        async def stream_plan(self, data):
+            await asyncio.sleep(10)
+            yield "never"
+
+    async def scenario():
+        registry = ProviderRegistry(window=10, failure_threshold=1, cooldown=0.0, probe_interval=0)
+        registry.register(SlowStream("slow"))
+        state = registry.states["slow"]
+        state.record(0.1, False)
+        stream = registry.stream_plan({})
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        assert state.trial_in_flight
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        await stream.aclose()
+        assert not state.trial_in_flight
+
+    asyncio.run(scenario())
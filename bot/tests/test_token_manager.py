@@ -0,0 +1,71 @@
+"""
+Менеджер токена: один запрос за токеном на всех и сброс после 401
+без возврата отозванного токена из общего кэша
+"""
+
+import asyncio
+import time
+
+from token_manager import TokenManager
+
+
+def _fetcher(tokens):
+    issued = iter(tokens)
+
+    async def fetch():
+        await asyncio.sleep(0)
+        return next(issued), time.time() + 1800
+    return fetch
+
+
+def test_concurrent_readers_share_one_fetch(tmp_path):
+    async def scenario():
+        manager = TokenManager(_fetcher(["tok1", "tok2"]), cache_path=str(tmp_path / "token.json"))
+        tokens = await asyncio.gather(*(manager.get_token() for _ in range(20)))
+        assert set(tokens) == {"tok1"}
+        assert manager.fetches == 1
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_does_not_readopt_cached_token(tmp_path):
+    async def scenario():
+        manager = TokenManager(_fetcher(["tok1", "tok2"]), cache_path=str(tmp_path / "token.json"))
+        assert await manager.get_token() == "tok1"
+        manager.invalidate("tok1")
+        assert await manager.get_token() == "tok2"
+        assert manager.fetches == 2
+
+    asyncio.run(scenario())
+
+
+def test_other_process_skips_revoked_token(tmp_path):
+    cache = str(tmp_path / "token.json")
+
+    async def scenario():
+        first = TokenManager(_fetcher(["tok1"]), cache_path=cache)
+        assert await first.get_token() == "tok1"
+        # Второй процесс получил 401 на токен из общего кэша
+        second = TokenManager(_fetcher(["tok2"]), cache_path=cache)
+        assert await second.get_token() == "tok1"
+        second.invalidate("tok1")
+        assert await second.get_token() == "tok2"
+        # Первый процесс после своего 401 берёт уже новый токен из кэша
+        first.invalidate("tok1")
+        assert await first.get_token() == "tok2"
+        assert first.fetches == 1
+
+    asyncio.run(scenario())
+
+
+def test_stale_401_keeps_current_token(tmp_path):
+    async def scenario():
+        manager = TokenManager(_fetcher(["tok1", "tok2"]), cache_path=str(tmp_path / "token.json"))
+        assert await manager.get_token() == "tok1"
+        manager.invalidate("tok1")
+        assert await manager.get_token() == "tok2"
+        # Запоздалый 401 на старый токен новый не сбрасывает
+        manager.invalidate("tok1")
+        assert manager.peek() == "tok2"
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+"""
+Webhook: сверх max_backlog принятых апдейтов реплика отвечает 429,
+а не копит фоновые задачи
+"""
+
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+
+from webhook import create_app
+
+
+def _update(update_id):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "привет",
+    }}
+
+
+def test_backlog_limit_returns_429():
+    async def scenario():
+        dp, bot = Dispatcher(), Bot("1:test")
+        release = asyncio.Event()
+
+        @dp.message()
+        async def slow(message):
+            await release.wait()
+
+        app = create_app(dp, bot, "/webhook", concurrency=2, max_backlog=4)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            statuses = [(await client.post("/webhook", json=_update(i))).status for i in range(6)]
+            assert statuses == [200] * 4 + [429] * 2
+            health = await (await client.get("/healthz")).json()
+            assert (health["in_flight"], health["rejected"]) == (4, 2)
+            release.set()
+            await asyncio.sleep(0.05)
+            assert (await client.post("/webhook", json=_update(7))).status == 200
+        finally:
+            await client.close()
+            await bot.session.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,102 @@
+"""
+Буфер записи: плохая строка не топит пачку, временный сбой повторяется,
+остановка дописывает остаток
+"""
+
+import asyncio
+import contextlib
+
+import asyncpg
+import pytest
+
+import utils.db
+from utils.write_buffer import WriteBuffer
+
+
+class FakeTable:
+    def __init__(self, bad_ids=(), outages=0):
+        self.rows = []
+        self.bad_ids = set(bad_ids)
+        self.outages = outages
+        self.calls = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def copy_records_to_table(self, table, records, columns):
+        # Как за прокси пула без COPY: буфер пишет через executemany
+        raise RuntimeError("COPY недоступен")
+
+    async def executemany(self, query, records):
+        await asyncio.sleep(0)
+        self.calls += 1
+        if self.outages:
+            self.outages -= 1
+            raise ConnectionError("БД недоступна")
+        if any(record[0] in self.bad_ids for record in records):
+            raise asyncpg.UniqueViolationError("duplicate key value violates unique constraint")
+        self.rows.extend(records)
+
+
+def _buffer(table, monkeypatch, **kwargs):
+    monkeypatch.setattr(utils.db, "acquire", table.acquire)
+    return WriteBuffer("plans", ("id", "plan_text"), retry_delay=0, **kwargs)
+
+
+def test_bad_row_is_isolated(monkeypatch):
+    table = FakeTable(bad_ids={3})
+
+    async def scenario():
+        buffer = _buffer(table, monkeypatch, flush_interval=60)
+        await buffer.start()
+        writes = [asyncio.create_task(buffer.add((i, f"план {i}"), durable=True)) for i in range(1, 6)]
+        await asyncio.sleep(0)
+        assert await buffer.flush() == 4
+        results = await asyncio.gather(*writes, return_exceptions=True)
+        await buffer.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[2], asyncpg.UniqueViolationError)
+    assert [r for i, r in enumerate(results) if i != 2] == [None] * 4
+    assert sorted(row[0] for row in table.rows) == [1, 2, 4, 5]
+
+
+def test_constraint_error_is_not_retried(monkeypatch):
+    table = FakeTable(bad_ids={1})
+
+    async def scenario():
+        buffer = _buffer(table, monkeypatch)
+        with pytest.raises(asyncpg.UniqueViolationError):
+            await buffer.add((1, "план"), durable=True)
+        assert buffer.failed_rows == 1
+
+    asyncio.run(scenario())
+    assert table.calls == 1
+
+
+def test_transient_error_is_retried(monkeypatch):
+    table = FakeTable(outages=2)
+
+    async def scenario():
+        buffer = _buffer(table, monkeypatch, retries=3)
+        await buffer.add((1, "план"), durable=True)
+
+    asyncio.run(scenario())
+    assert table.calls == 3 and len(table.rows) == 1
+
+
+def test_stop_flushes_everything(monkeypatch):
+    table = FakeTable()
+
+    async def scenario():
+        buffer = _buffer(table, monkeypatch, max_batch=10, flush_interval=60)
+        await buffer.start()
+        for i in range(25):
+            await buffer.add((i, "план"))
+        await buffer.stop()
+        assert buffer.flushed_rows == 25
+
+    asyncio.run(scenario())
+    assert len(table.rows) == 25
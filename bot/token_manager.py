@@ -0,0 +1,219 @@
+"""
+Менеджер OAuth-токена: обновление заранее по expires_at, single-flight
+и общий для процессов кэш в файле
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import tempfile
+from typing import Awaitable, Callable, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, только атомарная запись
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Возвращает (токен, expires_at в секундах unix-времени)
+TokenFetcher = Callable[[], Awaitable[Tuple[str, float]]]
+
+
+class TokenManager:
+    """
+    Токен читается без блокировок, пока он действителен.
+
+    За refresh_ahead секунд до expires_at фоновая задача (или первый
+    читатель) запускает одно обновление на процесс; остальные читатели
+    получают текущий токен. Между процессами токен делится через файл
+    cache_path: запись атомарная (os.replace), обновление под flock,
+    так что сервер авторизации видит один запрос на все воркеры.
+    """
+
+    def __init__(
+        self,
+        fetch: TokenFetcher,
+        cache_path: Optional[str] = None,
+        refresh_ahead: float = 300,
+        min_ttl: float = 30,
+        name: str = "token",
+    ) -> None:
+        self._fetch = fetch
+        self.cache_path = cache_path
+        self.refresh_ahead = refresh_ahead
+        self.min_ttl = min_ttl
+        self.name = name
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._refresh: Optional["asyncio.Task[str]"] = None
+        self._refresher: Optional["asyncio.Task[None]"] = None
+        # Токены, на которые сервер ответил 401: из общего кэша их больше не берём
+        self._revoked: Set[str] = set()
+        self.fetches = 0
+        self.failures = 0
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def peek(self) -> Optional[str]:
+        """Текущий токен, если он ещё действителен; без ожидания"""
+        if self._token and time.time() < self._expires_at - self.min_ttl:
+            return self._token
+        return None
+
+    async def get_token(self) -> str:
+        token = self.peek()
+        if token is not None:
+            if time.time() >= self._refresh_at:
+                # Скоро истечёт: обновляем в фоне, отвечаем старым
+                self._start_refresh()
+            return token
+        return await asyncio.shield(self._start_refresh())
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """
+        Сброс после 401: следующий get_token получит новый токен. Отозванный
+        токен запоминается, иначе обновление взяло бы его обратно из общего
+        кэша, куда его положил этот или другой процесс.
+        """
+        token = token or self._token
+        if token:
+            self._revoked.add(token)
+        if token and token != self._token:
+            # 401 на старый токен, а уже действует новый — его не трогаем
+            return
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+
+    def _start_refresh(self) -> "asyncio.Task[str]":
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._do_refresh(), name=f"{self.name}-refresh")
+        return self._refresh
+
+    async def _do_refresh(self) -> str:
+        # Другой процесс мог уже обновить токен
+        if self._adopt(await asyncio.to_thread(self._read_cache)):
+            return self._token  # type: ignore[return-value]
+        lock_fd = await asyncio.to_thread(self._lock_cache)
+        try:
+            if self._adopt(await asyncio.to_thread(self._read_cache)):
+                return self._token  # type: ignore[return-value]
+            try:
+                token, expires_at = await self._fetch()
+            except Exception:
+                self.failures += 1
+                raise
+            self.fetches += 1
+            # Новый токен есть — старые отозванные в кэш уже не вернутся
+            self._revoked.clear()
+            self._set(token, expires_at)
+            await asyncio.to_thread(self._write_cache, token, expires_at)
+            logger.info(f"🔑 {self.name}: токен обновлён, действует ещё {expires_at - time.time():.0f} с")
+            return token
+        finally:
+            await asyncio.to_thread(self._unlock_cache, lock_fd)
+
+    def _adopt(self, cached: Optional[Tuple[str, float]]) -> bool:
+        """Берём токен из кэша, если он новее нашего и не требует обновления"""
+        if not cached:
+            return False
+        token, expires_at = cached
+        if token in self._revoked:
+            return False
+        if expires_at <= self._expires_at or time.time() >= expires_at - self.min_ttl * 2:
+            return False
+        self._set(token, expires_at)
+        logger.info(f"🔑 {self.name}: токен взят из общего кэша")
+        return True
+
+    def _set(self, token: str, expires_at: float) -> None:
+        # Короткоживущим токенам окно обновления — половина оставшегося срока
+        remaining = max(expires_at - time.time(), 0.0)
+        self._token, self._expires_at = token, expires_at
+        self._refresh_at = expires_at - min(self.refresh_ahead, remaining / 2)
+
+    # --- Общий файл ---
+    def _read_cache(self) -> Optional[Tuple[str, float]]:
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                payload = json.load(f)
+            return payload["access_token"], float(payload["expires_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_cache(self, token: str, expires_at: float) -> None:
+        if not self.cache_path:
+            return
+        directory = os.path.dirname(self.cache_path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"access_token": token, "expires_at": expires_at}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"⚠️ {self.name}: не удалось записать кэш токена ({e})")
+
+    def _lock_cache(self) -> Optional[int]:
+        if not self.cache_path or fcntl is None:
+            return None
+        try:
+            fd = os.open(f"{self.cache_path}.lock", os.O_CREAT | os.O_RDWR, 0o600)
+        except OSError:
+            return None
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _unlock_cache(self, fd: Optional[int]) -> None:
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    # --- Фоновое обновление ---
+    async def _refresh_loop(self) -> None:
+        delay = 1.0
+        while True:
+            # С разбросом, чтобы воркеры не шли за токеном разом
+            wait = self._refresh_at - time.time() - random.uniform(0, min(10, self.refresh_ahead / 10))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await self._start_refresh()
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ {self.name}: ошибка обновления токена: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def start(self) -> None:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop(), name=f"{self.name}-refresher")
+
+    async def stop(self) -> None:
+        for task in (self._refresher, self._refresh):
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._refresher = None
+        self._refresh = None
+
+    def stats_dict(self) -> dict:
+        return {
+            "valid": self.peek() is not None,
+            "expires_in": max(0, round(self._expires_at - time.time())),
+            "fetches": self.fetches,
+            "failures": self.failures,
+        }
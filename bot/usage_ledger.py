@@ -0,0 +1,161 @@
+"""
+Журнал использования LLM: модель, токены, задержка, стоимость и попадание в кэш
+по каждой генерации; запись пачками в таблицу llm_usage и сводки по дням/моделям/пользователям
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Пачка журнала сбрасывается реже буфера анкет: записи не ждёт никто
+USAGE_LEDGER_ENABLED = os.getenv('USAGE_LEDGER', '1') == '1'
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '5'))
+USAGE_BATCH = int(os.getenv('USAGE_BATCH', '500'))
+
+# Единые единицы: рубли за 1 млн токенов (вход / выход).
+# LLM_PRICES='{"gpt-5-nano": {"input": 12.24, "output": 97.92}}' дополняет и переопределяет таблицу
+PRICES_RUB_PER_MILLION: Dict[str, Dict[str, float]] = {
+    'gpt-5-nano': {'input': 12.24, 'output': 97.92},
+    'gpt-5-mini': {'input': 61.20, 'output': 489.60},
+    'gpt-4.1-nano': {'input': 24.48, 'output': 97.92},
+    'gpt-4.1-mini': {'input': 97.92, 'output': 391.68},
+}
+try:
+    PRICES_RUB_PER_MILLION.update(json.loads(os.getenv('LLM_PRICES', '') or '{}'))
+except ValueError:
+    logger.error("❌ LLM_PRICES: ожидается JSON вида {\"модель\": {\"input\": ..., \"output\": ...}}")
+
+COLUMNS = [
+    "created_at", "kind", "provider", "model", "user_id", "prompt_tokens",
+    "completion_tokens", "latency_ms", "cost_rub", "cache", "source",
+]
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Стоимость в рублях; None, если тарифа модели нет в таблице"""
+    price = PRICES_RUB_PER_MILLION.get(model.split('/')[-1])
+    if price is None:
+        return None
+    return round((prompt_tokens * price['input'] + completion_tokens * price['output']) / 1_000_000, 6)
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class UsageLedger:
+    """
+    Запись через WriteBuffer без ожидания: record() не блокирует генерацию,
+    при переполнении запись теряется (учёт в failed_rows). До start()
+    записи не копятся — скрипты и бенчмарки работают без БД.
+    """
+
+    def __init__(self, flush_interval: float = USAGE_FLUSH_INTERVAL, batch: int = USAGE_BATCH) -> None:
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self._buffer: Any = None
+
+    @property
+    def started(self) -> bool:
+        return self._buffer is not None
+
+    async def start(self) -> None:
+        if self._buffer is not None or not USAGE_LEDGER_ENABLED:
+            return
+        from utils.write_buffer import WriteBuffer
+        self._buffer = WriteBuffer("llm_usage", COLUMNS, max_batch=self.batch,
+                                   flush_interval=self.flush_interval, max_pending=self.batch * 20)
+        await self._buffer.start()
+
+    async def stop(self) -> None:
+        if self._buffer is not None:
+            buffer, self._buffer = self._buffer, None
+            await buffer.stop()
+
+    def record(
+        self,
+        kind: str,
+        model: str,
+        provider: str = "",
+        user_id: Any = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        cache: str = "miss",
+        source: str = "",
+        cost: Optional[float] = None,
+    ) -> None:
+        """Одна генерация: kind = plan | edit | stream, cache = hit | miss | bypass"""
+        if self._buffer is None:
+            return
+        if cost is None:
+            cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        self._buffer.add_nowait((
+            datetime.now(timezone.utc), kind, provider, model, _as_int(user_id),
+            int(prompt_tokens or 0), int(completion_tokens or 0), round(latency * 1000, 1),
+            cost, cache, source,
+        ))
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return self._buffer.stats_dict() if self._buffer is not None else {"started": False}
+
+
+usage_ledger = UsageLedger()
+
+
+# --- Сводки ---
+_AGGREGATES = """
+    COUNT(*) AS generations,
+    COUNT(*) FILTER (WHERE cache = 'hit') AS cache_hits,
+    SUM(prompt_tokens) AS prompt_tokens,
+    SUM(completion_tokens) AS completion_tokens,
+    ROUND(SUM(cost_rub)::numeric, 4) AS cost_rub,
+    ROUND(AVG(latency_ms) FILTER (WHERE cache <> 'hit')::numeric, 1) AS avg_latency_ms,
+    ROUND((PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms)
+           FILTER (WHERE cache <> 'hit'))::numeric, 1) AS p95_latency_ms
+"""
+
+
+async def _fetch(query: str, *args: Any) -> List[Dict[str, Any]]:
+    from utils.db import acquire
+    async with acquire() as conn:
+        rows = await conn.fetch(query, *args)
+    return [dict(row) for row in rows]
+
+
+async def usage_by_day(days: int = 30) -> List[Dict[str, Any]]:
+    """По дням (UTC) за последние days дней"""
+    return await _fetch(f"""
+        SELECT (created_at AT TIME ZONE 'UTC')::date AS day, {_AGGREGATES}
+        FROM llm_usage
+        WHERE created_at > NOW() - make_interval(days => $1)
+        GROUP BY day ORDER BY day DESC;
+    """, days)
+
+
+async def usage_by_model(days: int = 30) -> List[Dict[str, Any]]:
+    """По провайдеру и модели"""
+    return await _fetch(f"""
+        SELECT provider, model, {_AGGREGATES}
+        FROM llm_usage
+        WHERE created_at > NOW() - make_interval(days => $1)
+        GROUP BY provider, model ORDER BY cost_rub DESC NULLS LAST;
+    """, days)
+
+
+async def usage_by_user(days: int = 30, limit: int = 50) -> List[Dict[str, Any]]:
+    """Самые затратные пользователи"""
+    return await _fetch(f"""
+        SELECT user_id, {_AGGREGATES}
+        FROM llm_usage
+        WHERE created_at > NOW() - make_interval(days => $1) AND user_id IS NOT NULL
+        GROUP BY user_id ORDER BY cost_rub DESC NULLS LAST
+        LIMIT $2;
+    """, days, limit)
@@ -2,32 +2,52 @@ from .utils import (
     save_anketa,
     send_to_trainer,
     generate_plan,
+    generate_plan_slo,
     generate_plan_with_edit,
+    stream_plan,
     get_last_anketa,
+    get_anketa,
+    get_plan_history,
+    get_last_plan_text,
+    get_plan_text,
     save_plan,
-    token_refresher_task
+    approve_plan,
+    revert_plan_approval,
+    token_refresher_task,
+    get_bot,
+    set_bot,
+    create_bot,
+    close_bot,
+    start_write_buffers,
+    stop_write_buffers
 )
+from .db import init_pool, close_pool, get_pool, pool_stats
+from .utils import plan_cache, coalesce_stats
 
-# Также экспортируем GigaChatAuth если нужен
-try:
-    from .utils import GigaChatAuth
-    __all__ = [
-        'save_anketa',
-        'send_to_trainer',
-        'generate_plan',
-        'generate_plan_with_edit',
-        'get_last_anketa',
-        'save_plan',
-        'token_refresher_task',
-        'GigaChatAuth'
-    ]
-except ImportError:
-    __all__ = [
-        'save_anketa',
-        'send_to_trainer',
-        'generate_plan',
-        'generate_plan_with_edit',
-        'get_last_anketa',
-        'save_plan',
-        'token_refresher_task'
-    ]
+__all__ = [
+    'save_anketa',
+    'send_to_trainer',
+    'generate_plan',
+    'generate_plan_slo',
+    'generate_plan_with_edit',
+    'stream_plan',
+    'get_last_anketa',
+    'get_anketa',
+    'get_plan_history',
+    'get_last_plan_text',
+    'get_plan_text',
+    'save_plan',
+    'approve_plan',
+    'revert_plan_approval',
+    'token_refresher_task',
+    'get_bot',
+    'set_bot',
+    'create_bot',
+    'close_bot',
+    'start_write_buffers',
+    'stop_write_buffers',
+    'init_pool',
+    'close_pool',
+    'get_pool',
+    'pool_stats'
+]
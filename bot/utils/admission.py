@@ -0,0 +1,230 @@
+"""
+Контроль допуска: token bucket на пользователя и тренера (middleware роутеров),
+общий лимит одновременных генераций и справедливая очередь задач между заказчиками
+"""
+
+import json
+import math
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from config import (
+    TRAINER_CHAT_ID, JOB_FAIR_WEIGHTS, ADMISSION_ENABLED,
+    ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_TRAINER_RATE, ADMISSION_TRAINER_BURST,
+    GENERATION_MAX_IN_FLIGHT,
+)
+from metrics import ADMISSION_REJECTED, GENERATION_SLOT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """0 — токен взят, иначе через сколько секунд он появится"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class RateLimiter:
+    """Корзины по ключу (id пользователя); давно не активные вытесняются"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.rejected = 0
+
+    def check(self, key: Hashable, cost: float = 1.0) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        wait = bucket.take(cost)
+        if wait:
+            self.rejected += 1
+        return wait
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets), "rejected": self.rejected}
+
+
+class GenerationSlots:
+    """Не больше limit генераций одновременно на процесс (очередь и прямые вызовы)"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @property
+    def free(self) -> int:
+        return max(0, self.limit - self.in_flight)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        GENERATION_SLOT_WAIT_SECONDS.observe(time.monotonic() - started)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting}
+
+
+class FairQueue(Generic[T]):
+    """
+    Взвешенная справедливая очередь (self-clocked WFQ): у каждого заказчика
+    своё виртуальное время, задача получает метку finish = max(V, последняя
+    метка заказчика) + cost / weight, выдаётся задача с наименьшей меткой.
+    Заказчик с сотней задач не задерживает того, у кого одна.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, default_weight: float = 1.0) -> None:
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._heap: List[Tuple[float, int, Hashable, T]] = []
+        self._last_finish: Dict[Hashable, float] = {}
+        self._queued: Dict[Hashable, int] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def weight(self, tenant: Hashable) -> float:
+        return self.weights.get(str(tenant), self.default_weight)
+
+    def push(self, item: T, tenant: Hashable, cost: float = 1.0) -> None:
+        start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+        finish = start + cost / self.weight(tenant)
+        self._last_finish[tenant] = finish
+        self._queued[tenant] = self._queued.get(tenant, 0) + 1
+        heapq.heappush(self._heap, (finish, next(self._seq), tenant, item))
+
+    def pop(self) -> T:
+        finish, _, tenant, item = heapq.heappop(self._heap)
+        self._virtual_time = finish
+        self._queued[tenant] -= 1
+        if not self._queued[tenant]:
+            # Заказчик без задач в очереди начнёт с текущего виртуального времени
+            del self._queued[tenant]
+            self._last_finish.pop(tenant, None)
+        return item
+
+    def position(self, match: Callable[[T], bool]) -> Optional[int]:
+        """Номер элемента в порядке выдачи (1 — следующий) или None"""
+        for index, entry in enumerate(sorted(self._heap)):
+            if match(entry[3]):
+                return index + 1
+        return None
+
+    def tenants(self) -> Dict[str, int]:
+        return {str(tenant): count for tenant, count in self._queued.items()}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    if not value.strip():
+        return {}
+    try:
+        return {str(key): float(weight) for key, weight in json.loads(value).items() if float(weight) > 0}
+    except (ValueError, AttributeError):
+        logger.error("❌ JOB_FAIR_WEIGHTS: ожидается JSON вида {\"<telegram id>\": вес}")
+        return {}
+
+
+user_limiter = RateLimiter(ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+trainer_limiter = RateLimiter(ADMISSION_TRAINER_RATE, ADMISSION_TRAINER_BURST)
+generation_slots = GenerationSlots(GENERATION_MAX_IN_FLIGHT)
+fair_weights = parse_weights(JOB_FAIR_WEIGHTS)
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Inner-middleware роутера: событие сверх лимита частоты не доходит до
+    обработчика, а сразу получает короткий ответ (не чаще раза за окно ожидания)
+    """
+
+    def __init__(self, router: str) -> None:
+        self.router = router
+        self._notified: Dict[int, float] = {}
+
+    async def __call__(self, handler: Any, event: Any, data: Dict[str, Any]) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+        trainer = user.id == TRAINER_CHAT_ID
+        wait = (trainer_limiter if trainer else user_limiter).check(user.id)
+        if not wait:
+            return await handler(event, data)
+
+        ADMISSION_REJECTED.inc(role="trainer" if trainer else "user", router=self.router)
+        now = time.monotonic()
+        if self._notified.get(user.id, 0.0) > now:
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+        self._notified[user.id] = now + wait
+        if len(self._notified) > 10000:
+            self._notified = {key: until for key, until in self._notified.items() if until > now}
+        text = f"⏳ Слишком много запросов, повторите через {math.ceil(wait)} с."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, Message):
+            await event.answer(text)
+        return None
+
+
+def install_admission(router: Any, name: str) -> None:
+    """Ограничение частоты на сообщения и кнопки роутера"""
+    if not ADMISSION_ENABLED:
+        return
+    middleware = AdmissionMiddleware(name)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
+
+
+def admission_stats() -> Dict[str, Any]:
+    return {
+        "users": user_limiter.stats_dict(),
+        "trainers": trainer_limiter.stats_dict(),
+        "generations": generation_slots.stats_dict(),
+    }
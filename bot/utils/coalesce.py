@@ -0,0 +1,110 @@
+"""
+Склейка одинаковых одновременных генераций (single-flight): первый запрос
+выполняется, остальные с тем же ключом ждут его результат
+"""
+
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from metrics import PLAN_COALESCED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def flight_key(*parts: Any) -> str:
+    """Ключ из частей (id анкеты, хэш промпта, текст правки): sha256 от их строк"""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SingleFlight(Generic[T]):
+    """
+    Общий future на ключ. Пока генерация идёт и ещё window секунд после
+    успешного завершения, запросы с тем же ключом получают её результат.
+    Ошибка не запоминается: следующий запрос начнёт заново.
+    """
+
+    def __init__(self, kind: str, window: float = 0.0) -> None:
+        self.kind = kind
+        self.window = window
+        # ключ → (future, до какого момента годится готовый результат)
+        self._flights: Dict[str, Tuple["asyncio.Future[T]", float]] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def get(self, key: str) -> Optional["asyncio.Future[T]"]:
+        """Идущая генерация или недавний успешный результат по ключу"""
+        entry = self._flights.get(key)
+        if entry is None:
+            return None
+        future, expires_at = entry
+        if future.done() and expires_at < time.monotonic():
+            del self._flights[key]
+            return None
+        return future
+
+    async def join(self, future: "asyncio.Future[T]") -> T:
+        """
+        Ожидание чужой генерации; отмена ждущего не отменяет саму генерацию.
+        Отменённая генерация для ждущего — обычная ошибка: CancelledError
+        пробрасывается, только если отменяют его собственную задачу.
+        """
+        self.shared += 1
+        PLAN_COALESCED.inc(kind=self.kind, role="shared")
+        logger.info(f"🔗 Генерация {self.kind}: взят результат такого же запроса")
+        return await self._wait(future)
+
+    async def _wait(self, future: "asyncio.Future[T]") -> T:
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            task = asyncio.current_task()
+            if task is not None and task.cancelling():
+                raise
+            raise RuntimeError(f"Генерация {self.kind} прервана") from None
+
+    def begin(self, key: str, future: Optional["asyncio.Future[T]"] = None) -> "asyncio.Future[T]":
+        """Регистрация генерации по ключу; без future — результат задаётся через set_result"""
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        PLAN_COALESCED.inc(kind=self.kind, role="leader")
+        self._flights[key] = (future, float("inf"))
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def _finished(self, key: str, future: "asyncio.Future[T]") -> None:
+        entry = self._flights.get(key)
+        if entry is None or entry[0] is not future:
+            return
+        failed = future.cancelled() or future.exception() is not None
+        if failed or not self.window or future.result() is None:
+            del self._flights[key]
+        else:
+            self._flights[key] = (future, time.monotonic() + self.window)
+        # Прочие завершённые записи тоже не копим
+        now = time.monotonic()
+        for stale in [k for k, (f, until) in self._flights.items() if f.done() and until < now]:
+            del self._flights[stale]
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Результат call() — своего или совпавшего по ключу запроса. Генерация
+        идёт отдельной задачей и доживает до конца, даже если первый из
+        ожидающих отменён: её результат нужен остальным.
+        """
+        future = self.get(key)
+        if future is not None:
+            return await self.join(future)
+        task = asyncio.ensure_future(call())
+        self.begin(key, task)
+        return await self._wait(task)
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {"in_flight": sum(1 for f, _ in self._flights.values() if not f.done()),
+                "leaders": self.leaders, "shared": self.shared}
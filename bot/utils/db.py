@@ -0,0 +1,169 @@
+"""
+Общий пул соединений asyncpg для всех функций работы с БД
+"""
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Any, Optional
+
+import asyncpg
+
+from metrics import REGISTRY, DB_QUERY_SECONDS, DB_POOL_WAIT_SECONDS, DB_POOL_CONNECTIONS, statement_of
+
+logger = logging.getLogger(__name__)
+
+# Пул создаётся один раз: при старте (миграции) или при первом запросе к БД
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+
+@dataclass
+class PoolMetrics:
+    """Счётчики использования пула"""
+    acquisitions: int = 0
+    in_use: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+    timeouts: int = 0
+
+    def record_wait(self, seconds: float) -> None:
+        self.acquisitions += 1
+        self.wait_time_total += seconds
+        if seconds > self.wait_time_max:
+            self.wait_time_max = seconds
+
+
+metrics = PoolMetrics()
+
+
+def _log_query(query: "asyncpg.connection.LoggedQuery") -> None:
+    DB_QUERY_SECONDS.observe(query.elapsed, statement=statement_of(query.query),
+                             outcome="error" if query.exception else "ok")
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # Время каждого запроса попадает в гистограмму aifit_db_query_seconds
+    conn.add_query_logger(_log_query)
+
+
+async def _collect_pool() -> None:
+    if _pool is None:
+        return
+    DB_POOL_CONNECTIONS.set(metrics.in_use, state="acquired")
+    DB_POOL_CONNECTIONS.set(_pool.get_idle_size(), state="idle")
+    DB_POOL_CONNECTIONS.set(_pool.get_size(), state="open")
+
+
+REGISTRY.add_collector(_collect_pool)
+
+
+async def init_pool(
+    dsn: Optional[str] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    statement_cache_size: Optional[int] = None,
+) -> asyncpg.Pool:
+    """Создание пула соединений; одновременные вызовы получают один и тот же пул"""
+    global _pool
+    if _pool is not None:
+        return _pool
+
+    from config import (
+        DB_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+        DB_STATEMENT_CACHE_SIZE, DB_COMMAND_TIMEOUT
+    )
+
+    async with _pool_lock:
+        if _pool is not None:
+            return _pool
+        return await _create_pool(
+            dsn or DB_URL,
+            min_size if min_size is not None else DB_POOL_MIN_SIZE,
+            max_size if max_size is not None else DB_POOL_MAX_SIZE,
+            statement_cache_size if statement_cache_size is not None else DB_STATEMENT_CACHE_SIZE,
+            DB_COMMAND_TIMEOUT,
+        )
+
+
+async def _create_pool(dsn: str, min_size: int, max_size: int, statement_cache_size: int,
+                       command_timeout: float) -> asyncpg.Pool:
+    global _pool
+    _pool = await asyncpg.create_pool(
+        dsn,
+        min_size=min_size,
+        max_size=max_size,
+        statement_cache_size=statement_cache_size,
+        command_timeout=command_timeout,
+        init=_init_connection,
+    )
+    logger.info(
+        f"✅ Пул БД создан (min={_pool.get_min_size()}, max={_pool.get_max_size()})"
+    )
+    return _pool
+
+
+def get_pool() -> asyncpg.Pool:
+    """Текущий пул соединений"""
+    if _pool is None:
+        raise RuntimeError("Пул БД не инициализирован: вызовите init_pool() при старте")
+    return _pool
+
+
+async def close_pool(timeout: float = 10.0) -> None:
+    """Корректное закрытие пула при остановке бота"""
+    global _pool
+    if _pool is None:
+        return
+    pool, _pool = _pool, None
+    try:
+        await asyncio.wait_for(pool.close(), timeout)
+        logger.info("✅ Пул БД закрыт")
+    except Exception as e:
+        logger.error(f"❌ Пул БД не закрылся за {timeout} с, принудительное завершение: {e}")
+        pool.terminate()
+
+
+@asynccontextmanager
+async def acquire(timeout: Optional[float] = None) -> AsyncIterator[asyncpg.Connection]:
+    """Получение соединения из пула с учётом времени ожидания; пул создаётся при первом обращении"""
+    pool = _pool or await init_pool()
+    started = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=timeout)
+    except asyncio.TimeoutError:
+        metrics.timeouts += 1
+        raise
+    waited = time.perf_counter() - started
+    metrics.record_wait(waited)
+    DB_POOL_WAIT_SECONDS.observe(waited)
+    metrics.in_use += 1
+    try:
+        yield conn
+    finally:
+        metrics.in_use -= 1
+        await pool.release(conn)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Снимок метрик пула"""
+    stats: Dict[str, Any] = {
+        "acquired": metrics.in_use,
+        "acquisitions": metrics.acquisitions,
+        "timeouts": metrics.timeouts,
+        "wait_time_total": round(metrics.wait_time_total, 6),
+        "wait_time_max": round(metrics.wait_time_max, 6),
+        "wait_time_avg": round(
+            metrics.wait_time_total / metrics.acquisitions, 6
+        ) if metrics.acquisitions else 0.0,
+    }
+    if _pool is not None:
+        stats.update({
+            "size": _pool.get_size(),
+            "idle": _pool.get_idle_size(),
+            "min_size": _pool.get_min_size(),
+            "max_size": _pool.get_max_size(),
+        })
+    return stats
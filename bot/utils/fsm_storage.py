@@ -0,0 +1,257 @@
+"""
+Хранилища FSM, общие для нескольких процессов бота: Postgres и Redis
+"""
+
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# Отсутствующее значение в буфере записи (None — валидное «состояние сброшено»)
+_UNSET = object()
+
+
+def _storage_key(key: StorageKey) -> str:
+    return ":".join(str(part) for part in (
+        key.bot_id, key.chat_id, key.thread_id or "", key.user_id, key.destiny
+    ))
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM в таблице fsm_state (см. миграции в schema.py).
+
+    По умолчанию запись сквозная: set_state/set_data возвращаются, когда
+    строка уже в БД, так что следующий апдейт пользователя в любом
+    процессе видит новое состояние, а ошибка записи доходит до обработчика.
+
+    flush_interval > 0 включает буфер: изменения одного ключа схлопываются
+    и раз в flush_interval уходят в БД одним executemany. Чтение сначала
+    смотрит в буфер, поэтому процесс видит свои записи, но другие процессы
+    в это окно читают старое состояние, а при падении буфер теряется —
+    годится для одного процесса.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 24 * 3600,
+        flush_interval: float = 0.0,
+        batch_size: int = 100,
+        cleanup_interval: float = 600,
+    ) -> None:
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cleanup_interval = cleanup_interval
+        # ключ -> [state, data]; _UNSET — поле не менялось
+        self._pending: Dict[str, list] = {}
+        # пакет, который сейчас пишется в БД: читаем и из него
+        self._flushing: Dict[str, list] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._cleaner: Optional["asyncio.Task[None]"] = None
+        self._closed = False
+
+    async def start(self) -> None:
+        """Запуск фоновых задач записи и очистки (после init_pool)"""
+        if self._flusher is None and self.flush_interval > 0:
+            self._flusher = asyncio.create_task(self._flush_loop(), name="fsm-flush")
+        if self._cleaner is None and self.ttl > 0:
+            self._cleaner = asyncio.create_task(self._cleanup_loop(), name="fsm-cleanup")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(_storage_key(key), state=_state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(_storage_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(_storage_key(key), data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(_storage_key(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        # Dispatcher закрывает хранилище до on_shutdown, пока пул ещё открыт
+        if self._closed:
+            return
+        self._closed = True
+        for task in (self._flusher, self._cleaner):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _write(self, key: str, state: Any = _UNSET, data: Any = _UNSET) -> None:
+        if self.flush_interval <= 0:
+            # Сквозная запись одного ключа, без общего буфера и его блокировки
+            await self._upsert(self._rows({key: [state, data]}))
+            return
+        entry = self._pending.setdefault(key, [_UNSET, _UNSET])
+        if state is not _UNSET:
+            entry[0] = state
+        if data is not _UNSET:
+            entry[1] = data
+        if self._flusher is None or self._closed:
+            # Фоновая запись не запущена — пишем сразу
+            await self.flush()
+        elif len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _buffered(self, key: str) -> list:
+        entry = [_UNSET, _UNSET]
+        for source in (self._flushing, self._pending):
+            values = source.get(key)
+            if values is None:
+                continue
+            for i, value in enumerate(values):
+                if value is not _UNSET:
+                    entry[i] = value
+        return entry
+
+    async def _read(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        state, data = self._buffered(key)
+        if state is not _UNSET and data is not _UNSET:
+            return state, data
+
+        from .db import acquire
+        async with acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT state, data FROM fsm_state
+                WHERE key = $1 AND updated_at > NOW() - make_interval(secs => $2);
+            """, key, float(self.ttl) if self.ttl > 0 else 1e10)
+
+        # Запись, сделанная пока шёл запрос, новее прочитанного
+        state, data = self._buffered(key)
+        if state is _UNSET:
+            state = row["state"] if row else None
+        if data is _UNSET:
+            data = json.loads(row["data"]) if row else {}
+        return state, data
+
+    async def flush(self) -> int:
+        """Запись накопленных изменений одним пакетом, возвращает число ключей"""
+        async with self._flush_lock:
+            return await self._flush_batch()
+
+    async def _flush_batch(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        self._flushing = batch
+        rows = self._rows(batch)
+        try:
+            await self._upsert(rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи FSM ({len(rows)} ключей): {e}")
+            # Возвращаем в буфер всё, что не перезаписано за время запроса
+            for key, (state, data) in batch.items():
+                entry = self._pending.setdefault(key, [_UNSET, _UNSET])
+                if entry[0] is _UNSET:
+                    entry[0] = state
+                if entry[1] is _UNSET:
+                    entry[1] = data
+            return 0
+        finally:
+            self._flushing = {}
+        return len(rows)
+
+    @staticmethod
+    def _rows(batch: Dict[str, list]) -> List[tuple]:
+        return [
+            (
+                key,
+                None if state is _UNSET else state,
+                "{}" if data is _UNSET else json.dumps(data, ensure_ascii=False, default=str),
+                state is not _UNSET,
+                data is not _UNSET,
+            )
+            for key, (state, data) in batch.items()
+        ]
+
+    async def _upsert(self, rows: List[tuple]) -> None:
+        from .db import acquire
+        async with acquire() as conn:
+            await conn.executemany("""
+                INSERT INTO fsm_state (key, state, data, updated_at)
+                VALUES ($1, $2, $3::jsonb, NOW())
+                ON CONFLICT (key) DO UPDATE SET
+                    state = CASE WHEN $4 THEN EXCLUDED.state ELSE fsm_state.state END,
+                    data = CASE WHEN $5 THEN EXCLUDED.data ELSE fsm_state.data END,
+                    updated_at = NOW();
+            """, rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def cleanup(self) -> int:
+        """Удаление брошенных анкет и сброшенных состояний"""
+        from .db import acquire
+        async with acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM fsm_state
+                WHERE updated_at < NOW() - make_interval(secs => $1)
+                   OR (state IS NULL AND data = '{}'::jsonb
+                       AND updated_at < NOW() - interval '1 minute');
+            """, float(self.ttl))
+        return int(result.split()[-1])
+
+    async def _cleanup_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                started = time.monotonic()
+                removed = await self.cleanup()
+                if removed:
+                    logger.info(f"🧹 FSM: удалено {removed} устаревших состояний "
+                                f"за {time.monotonic() - started:.2f} с")
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки FSM: {e}")
+
+
+def create_redis_storage(url: str, ttl: float) -> BaseStorage:
+    """
+    RedisStorage из aiogram с TTL на состояние и данные.
+
+    Подходит любой сервер с протоколом Redis (KeyDB, Dragonfly и т. п.),
+    поэтому локально можно поднять совместимую заглушку.
+    """
+    try:
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError as e:
+        raise RuntimeError("Для FSM_STORAGE=redis нужен пакет redis") from e
+
+    ttl_seconds = int(ttl) if ttl > 0 else None
+    return RedisStorage.from_url(url, state_ttl=ttl_seconds, data_ttl=ttl_seconds)
+
+
+def create_fsm_storage(name: str) -> BaseStorage:
+    """Хранилище FSM по имени из конфигурации: memory | postgres | redis"""
+    from config import FSM_TTL, FSM_FLUSH_INTERVAL, FSM_BATCH_SIZE, REDIS_URL
+
+    if name == "postgres":
+        return PostgresStorage(ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL,
+                               batch_size=FSM_BATCH_SIZE)
+    if name == "redis":
+        return create_redis_storage(REDIS_URL, FSM_TTL)
+    return MemoryStorage()
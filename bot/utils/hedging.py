@@ -0,0 +1,129 @@
+"""
+Генерация с бюджетом задержки: хедж-запрос ко второй модели и шаблон после дедлайна
+"""
+
+import time
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from metrics import PLAN_SERVED
+
+logger = logging.getLogger(__name__)
+
+Generator = Callable[[], Awaitable[Optional[str]]]
+
+
+@dataclass
+class GenerationResult:
+    """Результат генерации и путь, которым он получен"""
+    text: str
+    # cache | primary | hedge | fallback
+    source: str
+    provisional: bool = False
+    latency: float = 0.0
+
+
+# Сколько запросов обслужено каждым путём (для логов и метрик)
+served_paths: Counter = Counter()
+
+# Запросы, продолжающиеся после дедлайна: их результат ещё пригодится кэшу
+_late_tasks: Set["asyncio.Task[Any]"] = set()
+
+
+def record_served(result: GenerationResult) -> GenerationResult:
+    served_paths[result.source] += 1
+    PLAN_SERVED.inc(source=result.source)
+    logger.info(f"⏱ План: {result.source} за {result.latency:.2f} с"
+                + (" (предварительный)" if result.provisional else ""))
+    return result
+
+
+async def generate_with_slo(
+    primary: Generator,
+    fallback: Callable[[], str],
+    deadline: float,
+    hedge: Optional[Generator] = None,
+    hedge_after: Optional[float] = None,
+    on_late_result: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> GenerationResult:
+    """
+    Ответ не позже deadline секунд.
+
+    Через hedge_after секунд без ответа параллельно запускается hedge;
+    берётся первый непустой результат. Если к дедлайну ответа нет,
+    возвращается шаблон fallback с пометкой provisional, а запросы
+    дорабатывают в фоне и отдают результат в on_late_result.
+    """
+    started = time.monotonic()
+    tasks: Dict["asyncio.Task[Optional[str]]", str] = {
+        asyncio.ensure_future(primary()): "primary"
+    }
+    hedge_at = started + (hedge_after if hedge_after is not None else deadline / 2)
+    deadline_at = started + deadline
+
+    while tasks:
+        now = time.monotonic()
+        hedge_pending = hedge is not None and "hedge" not in tasks.values()
+        wake_at = min(hedge_at, deadline_at) if hedge_pending else deadline_at
+        if now >= deadline_at:
+            break
+
+        done, _ = await asyncio.wait(tasks, timeout=max(0.0, wake_at - now),
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            source = tasks.pop(task)
+            text = None if task.cancelled() or task.exception() else task.result()
+            if text:
+                for other in tasks:
+                    other.cancel()
+                return record_served(GenerationResult(text, source, latency=time.monotonic() - started))
+            logger.warning(f"⚠️ Путь {source} не вернул план")
+
+        if hedge_pending and time.monotonic() >= hedge_at:
+            logger.info("🔀 Основная модель не успевает, запускаем хедж-запрос")
+            tasks[asyncio.ensure_future(hedge())] = "hedge"
+            hedge = None
+        elif not tasks and hedge is not None:
+            # Основной путь уже упал — хедж не ждёт своего времени
+            tasks[asyncio.ensure_future(hedge())] = "hedge"
+            hedge = None
+
+    for task in tasks:
+        _finish_late(task, on_late_result)
+    return record_served(GenerationResult(fallback(), "fallback", provisional=True,
+                                          latency=time.monotonic() - started))
+
+
+def finish_in_background(coro: Awaitable[Any]) -> None:
+    """Доработка опоздавшего запроса в фоне (его результат пригодится кэшу)"""
+    async def _wait() -> None:
+        try:
+            await coro
+        except Exception as e:
+            logger.warning(f"⚠️ Опоздавший запрос не завершился: {e}")
+
+    late = asyncio.create_task(_wait())
+    _late_tasks.add(late)
+    late.add_done_callback(_late_tasks.discard)
+
+
+def _finish_late(task: "asyncio.Task[Optional[str]]",
+                 on_late_result: Optional[Callable[[str], Awaitable[None]]]) -> None:
+    if on_late_result is None:
+        task.cancel()
+        return
+
+    async def _wait() -> None:
+        try:
+            text = await task
+        except Exception:
+            return
+        if text:
+            await on_late_result(text)
+
+    late = asyncio.create_task(_wait())
+    _late_tasks.add(late)
+    late.add_done_callback(_late_tasks.discard)
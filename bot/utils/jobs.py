@@ -0,0 +1,453 @@
+"""
+Очередь фоновых задач генерации планов и пул воркеров
+"""
+
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from metrics import REGISTRY, JOB_QUEUE_DEPTH, GENERATIONS_IN_FLIGHT, JOBS_FINISHED, JOB_SECONDS
+from .admission import FairQueue
+
+logger = logging.getLogger(__name__)
+
+
+def _cancelling() -> bool:
+    """Отменяют ли текущую задачу (а не пришёл ли CancelledError из чужого future)"""
+    task = asyncio.current_task()
+    return task is not None and task.cancelling() > 0
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    RETRYING = "retrying"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class GenerationJob:
+    """Задача генерации: kind = "plan" (новый план) или "edit" (план с правками)"""
+    kind: str
+    payload: Dict[str, Any]
+    requested_by: Optional[int] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    attempts: int = 0
+    max_attempts: int = 3
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+
+JobHandler = Callable[[GenerationJob], Awaitable[Any]]
+
+
+def job_tenant(job: GenerationJob) -> Any:
+    """Заказчик задачи для справедливой очереди: кто поставил, иначе клиент"""
+    if job.requested_by is not None:
+        return job.requested_by
+    return job.payload.get("user_id") or (job.payload.get("user_data") or {}).get("user_id")
+
+
+class InMemoryJobBackend:
+    """Очередь в памяти процесса: справедливая (WFQ) между заказчиками"""
+
+    def __init__(self, keep_finished: int = 1000, weights: Optional[Dict[str, float]] = None) -> None:
+        self._queue: FairQueue[GenerationJob] = FairQueue(weights)
+        self._ready = asyncio.Semaphore(0)
+        self._jobs: Dict[str, GenerationJob] = {}
+        self._finished: "deque[str]" = deque()
+        self._keep_finished = keep_finished
+        self._delayed: "set[asyncio.Task[None]]" = set()
+
+    def _forget_old(self, job: GenerationJob) -> None:
+        # Статусы завершённых задач храним ограниченно
+        self._finished.append(job.id)
+        while len(self._finished) > self._keep_finished:
+            self._jobs.pop(self._finished.popleft(), None)
+
+    async def setup(self) -> None:
+        return None
+
+    def _push(self, job: GenerationJob) -> None:
+        self._queue.push(job, job_tenant(job))
+        self._ready.release()
+
+    async def put(self, job: GenerationJob) -> None:
+        self._jobs[job.id] = job
+        self._push(job)
+
+    async def get(self) -> GenerationJob:
+        await self._ready.acquire()
+        job = self._queue.pop()
+        job.status = JobStatus.RUNNING
+        job.attempts += 1
+        return job
+
+    async def complete(self, job: GenerationJob) -> None:
+        self._forget_old(job)
+
+    async def retry(self, job: GenerationJob, delay: float) -> None:
+        async def _requeue() -> None:
+            await asyncio.sleep(delay)
+            self._push(job)
+
+        task = asyncio.create_task(_requeue())
+        self._delayed.add(task)
+        task.add_done_callback(self._delayed.discard)
+
+    async def fail(self, job: GenerationJob) -> None:
+        self._forget_old(job)
+
+    async def touch(self, job: GenerationJob) -> None:
+        return None
+
+    async def status(self, job_id: str) -> Optional[JobStatus]:
+        job = self._jobs.get(job_id)
+        return job.status if job else None
+
+    async def position(self, job_id: str) -> Optional[int]:
+        return self._queue.position(lambda job: job.id == job_id)
+
+    async def size(self) -> int:
+        return len(self._queue)
+
+    async def close(self) -> None:
+        for task in self._delayed:
+            task.cancel()
+
+
+# Порядок выдачи: по очереди между заказчиками (n-я задача заказчика — в n-й круг,
+# с весом w — в n/w-й), внутри круга — по времени готовности. Задача в running
+# без продления аренды дольше $2 секунд (воркер упал) снова считается готовой
+_FAIR_READY = """
+    SELECT id, run_at, requested_by,
+           ROW_NUMBER() OVER (PARTITION BY requested_by ORDER BY run_at)
+               / COALESCE(($1::jsonb ->> requested_by::text)::float8, 1) AS turn
+    FROM plan_jobs
+    WHERE (status IN ('queued', 'retrying')
+           OR (status = 'running' AND updated_at < NOW() - make_interval(secs => $2)))
+"""
+
+
+class PostgresJobBackend:
+    """
+    Очередь в таблице plan_jobs: воркеры забирают задачи через FOR UPDATE SKIP LOCKED.
+    Взятая задача арендуется на lease секунд и продлевается touch(); задачу
+    упавшего воркера (аренда истекла) забирает другой.
+    """
+
+    def __init__(self, poll_interval: float = 1.0, weights: Optional[Dict[str, float]] = None,
+                 lease: float = 120.0) -> None:
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._weights = json.dumps(weights or {})
+
+    async def setup(self) -> None:
+        from .db import acquire
+        async with acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS plan_jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload JSONB NOT NULL,
+                    requested_by BIGINT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INT NOT NULL DEFAULT 0,
+                    max_attempts INT NOT NULL DEFAULT 3,
+                    result TEXT,
+                    last_error TEXT,
+                    run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                CREATE INDEX IF NOT EXISTS plan_jobs_ready_idx
+                    ON plan_jobs (run_at) WHERE status IN ('queued', 'retrying');
+                CREATE INDEX IF NOT EXISTS plan_jobs_running_idx
+                    ON plan_jobs (updated_at) WHERE status = 'running';
+            """)
+
+    async def put(self, job: GenerationJob) -> None:
+        from .db import acquire
+        async with acquire() as conn:
+            await conn.execute("""
+                INSERT INTO plan_jobs (id, kind, payload, requested_by, max_attempts)
+                VALUES ($1, $2, $3::jsonb, $4, $5);
+            """, job.id, job.kind, json.dumps(job.payload, ensure_ascii=False, default=str),
+                job.requested_by, job.max_attempts)
+
+    async def get(self) -> GenerationJob:
+        from .db import acquire
+        while True:
+            async with acquire() as conn:
+                row = await conn.fetchrow(f"""
+                    UPDATE plan_jobs
+                    SET status = 'running', attempts = attempts + 1, updated_at = NOW()
+                    WHERE id = (
+                        SELECT job.id FROM plan_jobs job
+                        JOIN ({_FAIR_READY} AND run_at <= NOW()) ready USING (id)
+                        ORDER BY ready.turn, job.run_at
+                        LIMIT 1
+                        FOR UPDATE OF job SKIP LOCKED
+                    )
+                    RETURNING id, kind, payload, requested_by, attempts, max_attempts;
+                """, self._weights, float(self.lease))
+            if row:
+                return GenerationJob(
+                    id=row["id"],
+                    kind=row["kind"],
+                    payload=json.loads(row["payload"]),
+                    requested_by=row["requested_by"],
+                    status=JobStatus.RUNNING,
+                    attempts=row["attempts"],
+                    max_attempts=row["max_attempts"],
+                )
+            await asyncio.sleep(self.poll_interval)
+
+    async def touch(self, job: GenerationJob) -> None:
+        """Продление аренды выполняющейся задачи"""
+        await self._update(job, "UPDATE plan_jobs SET updated_at = NOW() WHERE id = $1 AND status = 'running';")
+
+    async def complete(self, job: GenerationJob) -> None:
+        await self._update(job, "UPDATE plan_jobs SET status = 'done', result = $2, updated_at = NOW() WHERE id = $1;",
+                           job.result)
+
+    async def retry(self, job: GenerationJob, delay: float) -> None:
+        # payload сохраняется: попытка могла записать в него состояние (id черновика у тренера)
+        await self._update(job, """
+            UPDATE plan_jobs
+            SET status = 'retrying', last_error = $2, payload = $4::jsonb,
+                run_at = NOW() + make_interval(secs => $3), updated_at = NOW()
+            WHERE id = $1;
+        """, job.error, float(delay), json.dumps(job.payload, ensure_ascii=False, default=str))
+
+    async def fail(self, job: GenerationJob) -> None:
+        await self._update(job, "UPDATE plan_jobs SET status = 'failed', last_error = $2, updated_at = NOW() WHERE id = $1;",
+                           job.error)
+
+    async def status(self, job_id: str) -> Optional[JobStatus]:
+        from .db import acquire
+        async with acquire() as conn:
+            value = await conn.fetchval("SELECT status FROM plan_jobs WHERE id = $1;", job_id)
+        return JobStatus(value) if value else None
+
+    async def position(self, job_id: str) -> Optional[int]:
+        from .db import acquire
+        async with acquire() as conn:
+            return await conn.fetchval(f"""
+                SELECT position FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY turn, run_at) AS position
+                    FROM ({_FAIR_READY}) ready
+                ) ordered
+                WHERE id = $3;
+            """, self._weights, float(self.lease), job_id)
+
+    async def size(self) -> int:
+        from .db import acquire
+        async with acquire() as conn:
+            return await conn.fetchval(
+                "SELECT count(*) FROM plan_jobs WHERE status IN ('queued', 'retrying');"
+            )
+
+    async def close(self) -> None:
+        return None
+
+    async def _update(self, job: GenerationJob, query: str, *args: Any) -> None:
+        from .db import acquire
+        async with acquire() as conn:
+            await conn.execute(query, job.id, *args)
+
+
+class JobQueue:
+    """Пул асинхронных воркеров, разбирающих очередь генераций"""
+
+    def __init__(
+        self,
+        backend: Any,
+        executor: JobHandler,
+        on_complete: Optional[JobHandler] = None,
+        on_failure: Optional[JobHandler] = None,
+        workers: int = 4,
+        max_attempts: int = 3,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+    ) -> None:
+        self.backend = backend
+        self.executor = executor
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.in_flight = 0
+        self._tasks: List["asyncio.Task[None]"] = []
+        # Номера воркеров, выполняющих задачу; остальные ждут в backend.get()
+        self._busy: Set[int] = set()
+        self._stopping = False
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        await self.backend.setup()
+        self._stopping = False
+        REGISTRY.add_collector(self._collect_metrics)
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"plan-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"✅ Очередь генераций запущена ({self.workers} воркеров)")
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """
+        Остановка: новые задачи больше не берутся, свободные воркеры
+        снимаются сразу, текущие генерации доделываются не дольше timeout
+        """
+        if not self._tasks:
+            return
+        self._stopping = True
+        for index, task in enumerate(self._tasks):
+            if index not in self._busy:
+                task.cancel()
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.backend.close()
+        logger.info("✅ Очередь генераций остановлена")
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], requested_by: Optional[int] = None) -> GenerationJob:
+        job = GenerationJob(kind=kind, payload=payload, requested_by=requested_by,
+                            max_attempts=self.max_attempts)
+        await self.backend.put(job)
+        logger.info(f"📥 Задача {job.kind} {job.id[:8]} в очереди")
+        return job
+
+    async def status(self, job_id: str) -> Optional[JobStatus]:
+        return await self.backend.status(job_id)
+
+    async def position(self, job_id: str) -> Optional[int]:
+        """Место задачи в очереди (1 — следующая), None — уже выполняется или завершена"""
+        return await self.backend.position(job_id)
+
+    async def size(self) -> int:
+        return await self.backend.size()
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _worker(self, index: int) -> None:
+        while not self._stopping:
+            try:
+                job = await self.backend.get()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Воркер {index}: ошибка чтения очереди: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            self._busy.add(index)
+            self.in_flight += 1
+            GENERATIONS_IN_FLIGHT.inc()
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                # Отменили сам воркер (остановка) — выходим; чужая отмена изнутри
+                # задачи не должна тихо уменьшать пул
+                if self._stopping or _cancelling():
+                    raise
+                logger.error(f"❌ Воркер {index}: задача {job.id[:8]} прервана отменой")
+            except Exception as e:
+                # Например, БД недоступна в backend.retry/complete/fail: задачу
+                # вернёт истёкшая аренда, воркер продолжает работу
+                logger.error(f"❌ Воркер {index}: задача {job.id[:8]} не завершена ({e})")
+            finally:
+                heartbeat.cancel()
+                self._busy.discard(index)
+                self.in_flight -= 1
+                GENERATIONS_IN_FLIGHT.dec()
+
+    async def _heartbeat(self, job: GenerationJob) -> None:
+        """Продление аренды, пока задача выполняется (у бэкендов с lease)"""
+        lease = getattr(self.backend, "lease", 0)
+        if not lease:
+            return
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                await self.backend.touch(job)
+            except Exception as e:
+                logger.warning(f"⚠️ Задача {job.id[:8]}: аренда не продлена ({e})")
+
+    async def _run(self, job: GenerationJob) -> None:
+        try:
+            job.result = await self.executor(job)
+        except asyncio.CancelledError:
+            if _cancelling():
+                raise
+            # CancelledError из генерации, а воркер никто не отменял, — обычный сбой
+            await self._failed_attempt(job, RuntimeError("генерация прервана"))
+            return
+        except Exception as e:
+            await self._failed_attempt(job, e)
+            return
+
+        job.status = JobStatus.DONE
+        job.finished_at = time.time()
+        self._record_finished(job)
+        await self.backend.complete(job)
+        await self._callback(self.on_complete, job)
+
+    async def _failed_attempt(self, job: GenerationJob, e: Exception) -> None:
+        job.error = str(e)[:500]
+        if job.attempts < job.max_attempts:
+            delay = self._backoff(job.attempts)
+            job.status = JobStatus.RETRYING
+            logger.warning(f"🔁 Задача {job.id[:8]}: попытка {job.attempts} не удалась ({e}), повтор через {delay:.1f} с")
+            await self.backend.retry(job, delay)
+            return
+        job.status = JobStatus.FAILED
+        job.finished_at = time.time()
+        self._record_finished(job)
+        logger.error(f"❌ Задача {job.id[:8]} не выполнена: {e}")
+        await self.backend.fail(job)
+        await self._callback(self.on_failure, job)
+
+    def _record_finished(self, job: GenerationJob) -> None:
+        JOBS_FINISHED.inc(kind=job.kind, status=job.status.value)
+        JOB_SECONDS.observe((job.finished_at or time.time()) - job.created_at, kind=job.kind)
+
+    async def _collect_metrics(self) -> None:
+        JOB_QUEUE_DEPTH.set(await self.size())
+
+    async def _callback(self, callback: Optional[JobHandler], job: GenerationJob) -> None:
+        if callback is None:
+            return
+        try:
+            await callback(job)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработчика завершения задачи {job.id[:8]}: {e}")
+
+
+def create_job_backend(name: str, weights: Optional[Dict[str, float]] = None, lease: float = 120.0) -> Any:
+    """
+    Бэкенд очереди по имени из конфигурации: memory | postgres; weights — веса
+    заказчиков, lease — аренда задачи в postgres
+    """
+    if name == "postgres":
+        return PostgresJobBackend(weights=weights, lease=lease)
+    return InMemoryJobBackend(weights=weights)
@@ -1,23 +1,30 @@
-import os
-import requests, json, datetime
+"""
+Ручное обновление общего кэша токена GigaChat (GIGACHAT_TOKEN_FILE).
+Боту это не нужно — TokenManager обновляет токен сам; скрипт для cron и отладки.
+"""
+
+import asyncio
+import datetime
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
-CLIENT_ID = os.getenv("GIGA_CLIENT_ID")  # добавь в .env
-JWT_FILE = "/opt/ai-fit/.jwt"
-
-def refresh_jwt():
-    resp = requests.post(
-        "https://gigachat.api.sberbank.ru/v1/token",
-        headers={"Authorization": f"Bearer {CLIENT_ID}"},
-        data={"scope": "GIGACHAT_API_PERS"}
-    )
-    resp.raise_for_status()
-    jwt = resp.json()["access_token"]
-    with open(JWT_FILE, "w") as f:
-        f.write(jwt)
-    print("JWT обновлён:", datetime.datetime.now())
+
+async def refresh_jwt() -> None:
+    from llm_providers import GigaChatProvider, GIGACHAT_API_KEY
+
+    if not GIGACHAT_API_KEY:
+        print("GIGACHAT_API_KEY не установлен")
+        return
+    provider = GigaChatProvider()
+    try:
+        await provider.tokens.get_token()
+        expires_at = datetime.datetime.fromtimestamp(provider.tokens.expires_at)
+        print(f"JWT в {provider.tokens.cache_path} действует до {expires_at:%H:%M:%S}")
+    finally:
+        await provider.aclose()
+
 
 if __name__ == "__main__":
-    refresh_jwt()
\ No newline at end of file
+    asyncio.run(refresh_jwt())
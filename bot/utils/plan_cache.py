@@ -0,0 +1,226 @@
+"""
+Кэш сгенерированных планов по нормализованным данным анкеты
+"""
+
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+from metrics import PLAN_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Имя клиента попадает в промпт, поэтому в кэше оно заменяется плейсхолдером
+NAME_PLACEHOLDER = "{{name}}"
+
+_NO_INJURIES = {"", "нет", "нету", "no", "none", "-", "—", "не", "отсутствуют", "нет травм"}
+
+
+def _normalize_text(value: Any) -> str:
+    text = str(value or "").lower().replace("ё", "е")
+    return re.sub(r"\s+", " ", text).strip(" .!")
+
+
+def _normalize_number(value: Any) -> Optional[int]:
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+
+def _normalize_list(value: Any) -> str:
+    # "похудение, выносливость" и "выносливость и похудение" дают один ключ
+    parts = re.split(r"[,;/+]|\sи\s", _normalize_text(value))
+    return ",".join(sorted({p.strip() for p in parts if p.strip()}))
+
+
+def normalize_anketa(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля анкеты, влияющие на промпт (кроме имени), в каноническом виде"""
+    injuries = _normalize_text(data.get("injuries"))
+    return {
+        "age": _normalize_number(data.get("age")),
+        "height": _normalize_number(data.get("height")),
+        "weight": _normalize_number(data.get("weight")),
+        "fitness_level": _normalize_text(data.get("fitness_level")),
+        "goals": _normalize_list(data.get("goals")),
+        "injuries": "нет" if injuries in _NO_INJURIES else _normalize_list(injuries),
+    }
+
+
+def cache_key(data: Dict[str, Any], model: str, prompt_version: str) -> str:
+    """Хэш нормализованной анкеты, модели и версии промпта"""
+    payload = json.dumps(
+        {"anketa": normalize_anketa(data), "model": model, "prompt": prompt_version},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _name_pattern(name: str) -> Optional["re.Pattern[str]"]:
+    name = (name or "").strip()
+    if len(name) < 2:
+        return None
+    return re.compile(rf"\b{re.escape(name)}\b")
+
+
+def _name_stem_pattern(name: str) -> Optional["re.Pattern[str]"]:
+    """
+    Основа имени в любом падеже («Ирин» — Ирине, Ириной): слово, начинающееся
+    с имени без двух последних букв (не короче двух), с заглавной, как пишет модель
+    """
+    name = (name or "").strip()
+    if len(name) < 2:
+        return None
+    stem = name[:max(2, len(name) - 2)]
+    return re.compile(rf"\b{re.escape(stem[0].upper() + stem[1:].lower())}\w*")
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    db_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    # не закэшировано: в тексте осталось имя клиента в другой форме
+    name_skips: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return hits / total if total else 0.0
+
+
+class PlanCache:
+    """Двухуровневый кэш: LRU в памяти + (опционально) таблица plans в Postgres"""
+
+    def __init__(
+        self,
+        model: str,
+        prompt_version: str,
+        max_entries: int = 512,
+        ttl: float = 7 * 24 * 3600,
+        use_db: bool = False,
+    ):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_db = use_db
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def key_for(self, data: Dict[str, Any]) -> str:
+        return cache_key(data, self.model, self.prompt_version)
+
+    async def get(self, data: Dict[str, Any]) -> Optional[str]:
+        """План из кэша с подставленным именем клиента или None"""
+        key = self.key_for(data)
+
+        template = self._get_memory(key)
+        if template is not None:
+            self.stats.memory_hits += 1
+            PLAN_CACHE_REQUESTS.inc(result="memory_hit")
+        elif self.use_db:
+            template = await self._get_db(key)
+            if template is not None:
+                self.stats.db_hits += 1
+                PLAN_CACHE_REQUESTS.inc(result="db_hit")
+                self._put_memory(key, template)
+
+        if template is None:
+            self.stats.misses += 1
+            PLAN_CACHE_REQUESTS.inc(result="miss")
+            return None
+
+        logger.info(f"⚡ План из кэша ({key[:12]})")
+        return template.replace(NAME_PLACEHOLDER, str(data.get("name") or "Клиент"))
+
+    def peek(self, data: Dict[str, Any]) -> Optional[str]:
+        """План из памяти без учёта в статистике (основа для точечных правок)"""
+        template = self._get_memory(self.key_for(data))
+        if template is None:
+            return None
+        return template.replace(NAME_PLACEHOLDER, str(data.get("name") or "Клиент"))
+
+    async def put(self, data: Dict[str, Any], plan_text: str) -> None:
+        """Сохранение плана (имя клиента заменяется плейсхолдером)"""
+        key = self.key_for(data)
+        name = str(data.get("name") or "")
+        pattern = _name_pattern(name)
+        template = pattern.sub(NAME_PLACEHOLDER, plan_text) if pattern else plan_text
+        # Склонённое имя («Ирине») плейсхолдером не заменить — такой план другому клиенту не отдаём
+        stem = _name_stem_pattern(name)
+        if stem and stem.search(template):
+            self.stats.name_skips += 1
+            logger.info(f"⚠️ План не закэширован: в тексте имя клиента ({key[:12]})")
+            return
+
+        self._put_memory(key, template)
+        self.stats.stores += 1
+        if self.use_db:
+            await self._put_db(key, template, data.get("user_id"))
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, template = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return template
+
+    def _put_memory(self, key: str, template: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, template)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def _get_db(self, key: str) -> Optional[str]:
+        from .db import acquire
+        try:
+            async with acquire() as conn:
+                return await conn.fetchval("""
+                    SELECT plan_text FROM plans
+                    WHERE cache_key = $1 AND status = 'cached'
+                      AND created_at > NOW() - make_interval(secs => $2)
+                    ORDER BY created_at DESC LIMIT 1;
+                """, key, float(self.ttl))
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша планов: {e}")
+            return None
+
+    async def _put_db(self, key: str, template: str, user_id: Any) -> None:
+        from .db import acquire
+        try:
+            async with acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO plans (user_id, plan_text, status, trainer_feedback, cache_key, created_at)
+                    VALUES ($1, $2, 'cached', '', $3, NOW());
+                """, user_id, template, key)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи кэша планов: {e}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.stats.memory_hits,
+            "db_hits": self.stats.db_hits,
+            "misses": self.stats.misses,
+            "stores": self.stats.stores,
+            "evictions": self.stats.evictions,
+            "name_skips": self.stats.name_skips,
+            "hit_ratio": round(self.stats.hit_ratio, 4),
+        }
+
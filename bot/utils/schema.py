@@ -0,0 +1,145 @@
+"""
+Схема БД и миграции: таблицы анкет и планов, индексы под запросы по пользователю
+"""
+
+import logging
+from typing import List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-lock, чтобы несколько реплик не применяли миграции одновременно
+_MIGRATIONS_LOCK_KEY = 727_001
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    transactional: bool = True
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base_tables", """
+        CREATE TABLE IF NOT EXISTS anketa (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            name TEXT,
+            age INT,
+            height INT,
+            weight INT,
+            goals TEXT,
+            injuries TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS plans (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            plan_text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'generated',
+            trainer_feedback TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        -- Таблицы, созданные вручную до миграций, могли быть без id
+        ALTER TABLE anketa ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+        ALTER TABLE plans ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+        ALTER TABLE plans ADD COLUMN IF NOT EXISTS cache_key TEXT;
+    """),
+    Migration(2, "anketa_user_created_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS anketa_user_created_idx
+            ON anketa (user_id, created_at DESC);
+    """, transactional=False),
+    Migration(3, "anketa_id_idx", """
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS anketa_id_idx ON anketa (id);
+    """, transactional=False),
+    # INCLUDE делает выборку истории планов index-only
+    Migration(4, "plans_user_created_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS plans_user_created_idx
+            ON plans (user_id, created_at DESC) INCLUDE (id, status);
+    """, transactional=False),
+    Migration(5, "plans_cache_key_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS plans_cache_key_idx
+            ON plans (cache_key, created_at DESC) WHERE cache_key IS NOT NULL;
+    """, transactional=False),
+    # Состояния FSM, общие для всех процессов бота (FSM_STORAGE=postgres)
+    Migration(6, "fsm_state", """
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS fsm_state_updated_idx ON fsm_state (updated_at);
+    """),
+    # Журнал использования LLM (usage_ledger.py): токены, задержка и стоимость каждой генерации
+    Migration(7, "llm_usage", """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            kind TEXT NOT NULL,
+            provider TEXT NOT NULL DEFAULT '',
+            model TEXT NOT NULL,
+            user_id BIGINT,
+            prompt_tokens INT NOT NULL DEFAULT 0,
+            completion_tokens INT NOT NULL DEFAULT 0,
+            latency_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+            cost_rub DOUBLE PRECISION,
+            cache TEXT NOT NULL DEFAULT 'miss',
+            source TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS llm_usage_created_idx ON llm_usage (created_at);
+        CREATE INDEX IF NOT EXISTS llm_usage_user_created_idx ON llm_usage (user_id, created_at);
+    """),
+    # Черновики утверждаются по id плана из кнопки; у таблиц, созданных до миграций,
+    # id мог остаться без индекса
+    Migration(8, "plans_id_idx", """
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS plans_id_idx ON plans (id);
+    """, transactional=False),
+]
+
+
+async def apply_migrations() -> int:
+    """Применение недостающих миграций, возвращает число применённых"""
+    from .db import acquire
+
+    applied_now = 0
+    async with acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1);", _MIGRATIONS_LOCK_KEY)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+            """)
+            applied = {
+                row["version"]
+                for row in await conn.fetch("SELECT version FROM schema_migrations;")
+            }
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                logger.info(f"🛠 Миграция {migration.version}: {migration.name}")
+                if migration.transactional:
+                    async with conn.transaction():
+                        await conn.execute(migration.sql)
+                        await _mark_applied(conn, migration)
+                else:
+                    await conn.execute(migration.sql)
+                    await _mark_applied(conn, migration)
+                applied_now += 1
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1);", _MIGRATIONS_LOCK_KEY)
+
+    if applied_now:
+        logger.info(f"✅ Применено миграций: {applied_now}")
+    return applied_now
+
+
+async def _mark_applied(conn, migration: Migration) -> None:
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2);",
+        migration.version, migration.name
+    )
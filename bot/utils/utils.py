@@ -1,54 +1,187 @@
-import asyncpg
 from aiogram import Bot
-from typing import Dict, Any, Optional
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.client.session.aiohttp import AiohttpSession
+from typing import Dict, Any, List, Optional, AsyncIterator
+import ssl
 import aiohttp
+import aiogram
+import certifi
+from aiohttp.http import SERVER_SOFTWARE
+import time
 import asyncio
-from datetime import datetime, timedelta
+import contextlib
+from datetime import datetime, timedelta, timezone
 import os
 from dotenv import load_dotenv
 import logging
 
+from .db import acquire
+from callbacks import PlanAction
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 # ---------- переадресация в SDK ----------
-from gigachat_integration import generate_plan as _sdk_generate_plan
-from gigachat_integration import generate_plan_with_edit as _sdk_generate_plan_with_edit
+from gigachat_integration import generate_plan_async as _sdk_generate_plan
+from gigachat_integration import generate_plan_with_edit_async as _sdk_generate_plan_with_edit
+from gigachat_integration import revise_section_async as _sdk_revise_section
+from gigachat_integration import stream_plan_async as _sdk_stream_plan
+from gigachat_integration import hedge_generate_plan_async as _sdk_hedge_generate_plan
+from gigachat_integration import hedge_enabled
+from gigachat_integration import PROMPT_VERSION
+from fallback_plans import build_fallback_plan, build_plan, profile_from_anketa
+from metrics import telegram_middleware
+from usage_ledger import usage_ledger
+from resolver import aiohttp_connector_kwargs
+from plan_revision import revise_plan
+
+from config import PROXY_MODEL, PLAN_CACHE_SIZE, PLAN_CACHE_TTL, PLAN_CACHE_DB, PLAN_COALESCE_WINDOW
+from .plan_cache import PlanCache
+from .coalesce import SingleFlight, flight_key
+from .write_buffer import WriteBuffer, IdAllocator
+from .hedging import GenerationResult, generate_with_slo, record_served
+from config import (
+    WRITE_BUFFER_BATCH, WRITE_BUFFER_INTERVAL, WRITE_BUFFER_MAX_PENDING,
+    ANKETA_DURABLE_WRITES, PLAN_DURABLE_WRITES,
+    PLAN_SLO_SECONDS, PLAN_HEDGE_AFTER, PLAN_OFFLINE_MODE,
+    PLAN_REVISION, PLAN_REVISION_MAX_SHARE
+)
+
+# Кэш планов перед обращением к LLM
+plan_cache = PlanCache(
+    model=PROXY_MODEL,
+    prompt_version=PROMPT_VERSION,
+    max_entries=PLAN_CACHE_SIZE,
+    ttl=PLAN_CACHE_TTL,
+    use_db=PLAN_CACHE_DB,
+)
+
+# Одинаковые одновременные генерации: двойной «+» тренера, «Устроил» во время генерации
+plan_flights: SingleFlight[Optional[str]] = SingleFlight("plan", PLAN_COALESCE_WINDOW)
+slo_flights: SingleFlight[GenerationResult] = SingleFlight("slo", PLAN_COALESCE_WINDOW)
+edit_flights: SingleFlight[str] = SingleFlight("edit", PLAN_COALESCE_WINDOW)
+
+def _plan_key(user_data: Dict[str, Any], *extra: Any) -> str:
+    """id анкеты + хэш входа промпта (нормализованная анкета, модель, версия промпта, имя)"""
+    return flight_key(user_data.get("id"), user_data.get("name"), plan_cache.key_for(user_data), *extra)
+
+def coalesce_stats() -> Dict[str, Any]:
+    return {flights.kind: flights.stats_dict() for flights in (plan_flights, slo_flights, edit_flights)}
+
+# Отложенная запись анкет и планов пачками; id выдаются заранее блоками из sequence
+anketa_ids = IdAllocator("anketa")
+plan_ids = IdAllocator("plans")
+anketa_buffer = WriteBuffer(
+    "anketa",
+    ["id", "user_id", "username", "name", "age", "height", "weight", "goals", "injuries", "created_at"],
+    max_batch=WRITE_BUFFER_BATCH,
+    flush_interval=WRITE_BUFFER_INTERVAL,
+    max_pending=WRITE_BUFFER_MAX_PENDING,
+)
+plans_buffer = WriteBuffer(
+    "plans",
+    ["id", "user_id", "plan_text", "status", "trainer_feedback", "created_at"],
+    max_batch=WRITE_BUFFER_BATCH,
+    flush_interval=WRITE_BUFFER_INTERVAL,
+    max_pending=WRITE_BUFFER_MAX_PENDING,
+)
+
+async def start_write_buffers() -> None:
+    await anketa_buffer.start()
+    await plans_buffer.start()
 
-# Telegram бот
+async def stop_write_buffers() -> None:
+    """Сброс всего накопленного; вызывается до закрытия пула"""
+    await anketa_buffer.stop()
+    await plans_buffer.stop()
+
+# Telegram бот: один экземпляр и одна HTTP-сессия на процесс
 bot_instance: Optional[Bot] = None
 
+class TelegramSession(AiohttpSession):
+    """
+    HTTP-сессия Bot API с нашим пулом соединений: TCPConnector создаётся здесь
+    из публичных параметров aiohttp, а не через внутренние поля AiohttpSession
+    """
+
+    def __init__(self, **connector_options: Any) -> None:
+        super().__init__()
+        self.connector_options = connector_options
+        self._client: Optional[aiohttp.ClientSession] = None
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        if self._client is None or self._client.closed:
+            self._client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    ssl=ssl.create_default_context(cafile=certifi.where()),
+                    **self.connector_options,
+                ),
+                headers={"User-Agent": f"{SERVER_SOFTWARE} aiogram/{aiogram.__version__}"},
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+
+def create_bot() -> Bot:
+    """Бот с пулом keep-alive соединений к api.telegram.org"""
+    from config import BOT_TOKEN, TELEGRAM_CONNECTION_LIMIT, TELEGRAM_KEEPALIVE_TIMEOUT
+    session = TelegramSession(
+        limit=TELEGRAM_CONNECTION_LIMIT,
+        keepalive_timeout=TELEGRAM_KEEPALIVE_TIMEOUT,
+        # DNS api.telegram.org — из общего кэша резолвера
+        **aiohttp_connector_kwargs(),
+    )
+    # Длительность каждого вызова Bot API — в aifit_telegram_request_seconds
+    session.middleware(telegram_middleware())
+    return Bot(token=BOT_TOKEN, session=session)
+
+def set_bot(bot: Bot) -> None:
+    """Регистрация общего бота (вызывается из main.py при старте)"""
+    global bot_instance
+    bot_instance = bot
+
 def get_bot() -> Optional[Bot]:
     global bot_instance
     if bot_instance is None:
         from config import BOT_TOKEN
         if not BOT_TOKEN:
             return None
-        bot_instance = Bot(token=BOT_TOKEN)
+        bot_instance = create_bot()
     return bot_instance
 
+async def close_bot() -> None:
+    """Закрытие HTTP-сессии общего бота при остановке"""
+    if bot_instance is not None:
+        await bot_instance.session.close()
+
 # ---------- БАЗОВЫЕ ФУНКЦИИ (без изменений) ----------
-async def save_anketa(data: Dict[str, Any]) -> None:
-    """Сохранение анкеты в БД"""
-    from config import DB_URL
+async def save_anketa(data: Dict[str, Any], durable: Optional[bool] = None) -> Optional[int]:
+    """Сохранение анкеты в БД, возвращает id анкеты.
+
+    Строка уходит в буфер и пишется пачкой; при durable (по умолчанию
+    ANKETA_DURABLE_WRITES) ждём коммита пачки, прежде чем отвечать пользователю.
+    """
     try:
-        conn = await asyncpg.connect(DB_URL)
-        await conn.execute("""
-            INSERT INTO anketa (user_id, username, name, age, height, weight, goals, injuries, created_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, NOW())
-        """,
-        data.get("user_id"),
-        data.get("username", ""),
-        data.get("name", ""),
-        int(data.get("age", 0)),
-        int(data.get("height", 0)),
-        int(data.get("weight", 0)),
-        data.get("goals", ""),
-        data.get("injuries", ""))
-        await conn.close()
-        logger.info(f"✅ Анкета сохранена: {data.get('name')}")
+        anketa_id = await anketa_ids.next_id()
+        await anketa_buffer.add((
+            anketa_id,
+            data.get("user_id"),
+            data.get("username", ""),
+            data.get("name", ""),
+            int(data.get("age", 0)),
+            int(data.get("height", 0)),
+            int(data.get("weight", 0)),
+            data.get("goals", ""),
+            data.get("injuries", ""),
+            datetime.now(timezone.utc),
+        ), durable=ANKETA_DURABLE_WRITES if durable is None else durable)
+        logger.info(f"✅ Анкета сохранена: {data.get('name')} (#{anketa_id})")
+        return anketa_id
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения анкеты: {e}")
+        return None
 
 async def send_to_trainer(data: Dict[str, Any]) -> None:
     """Отправка анкеты тренеру"""
@@ -59,8 +192,9 @@ async def send_to_trainer(data: Dict[str, Any]) -> None:
 
     from config import TRAINER_CHAT_ID
 
+    anketa_id = data.get("id")
     text = f"""
-📋 Новая анкета от @{data.get('username', 'не_указан')} (ID: {data.get('user_id', 'N/A')})
+📋 Новая анкета #{anketa_id} от @{data.get('username', 'не_указан')} (ID: {data.get('user_id', 'N/A')})
 
 Имя: {data.get('name', 'Не указано')}
 Возраст: {data.get('age', 'Не указан')}
@@ -69,66 +203,288 @@ async def send_to_trainer(data: Dict[str, Any]) -> None:
 Цели: {data.get('goals', 'Не указаны')}
 Травмы: {data.get('injuries', 'Нет')}
 
-Отправьте '+' чтобы сгенерировать план.
+Нажмите кнопку или ответьте '+' на это сообщение, чтобы сгенерировать план.
 """
+    kb = None
+    if anketa_id:
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text="🧠 Сгенерировать план",
+                callback_data=PlanAction(action="generate", anketa_id=anketa_id).pack()
+            )
+        ]])
     try:
-        await bot.send_message(TRAINER_CHAT_ID, text)
+        await bot.send_message(TRAINER_CHAT_ID, text, reply_markup=kb)
         logger.info("✅ Анкета отправлена тренеру")
     except Exception as e:
         logger.error(f"❌ Ошибка отправки тренеру: {e}")
 
+async def get_anketa(anketa_id: int) -> Optional[Dict[str, Any]]:
+    """Анкета по id (поиск по первичному ключу)"""
+    try:
+        async with acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM anketa WHERE id = $1;", anketa_id)
+        if row:
+            return dict(row)
+    except Exception as e:
+        logger.error(f"❌ Ошибка БД: {e}")
+    return None
+
 async def get_last_anketa(user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
-    """Получение последней анкеты"""
-    from config import DB_URL
+    """Получение последней анкеты пользователя (индекс anketa_user_created_idx)"""
     try:
-        conn = await asyncpg.connect(DB_URL)
-        if user_id:
-            row = await conn.fetchrow(
-                "SELECT * FROM anketa WHERE user_id = $1 ORDER BY created_at DESC LIMIT 1;",
-                user_id
-            )
-        else:
-            row = await conn.fetchrow(
-                "SELECT * FROM anketa ORDER BY created_at DESC LIMIT 1;"
-            )
-        await conn.close()
+        async with acquire() as conn:
+            if user_id:
+                row = await conn.fetchrow(
+                    "SELECT * FROM anketa WHERE user_id = $1 ORDER BY created_at DESC LIMIT 1;",
+                    user_id
+                )
+            else:
+                # Глобальный поиск оставлен для совместимости, handlers его не используют
+                row = await conn.fetchrow(
+                    "SELECT * FROM anketa ORDER BY created_at DESC LIMIT 1;"
+                )
         if row:
             return dict(row)
     except Exception as e:
         logger.error(f"❌ Ошибка БД: {e}")
     return None
 
-async def save_plan(data: Dict[str, Any]) -> None:
-    """Сохранение плана в БД"""
-    from config import DB_URL
+async def get_plan_history(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    """История планов пользователя без текста (index-only по plans_user_created_idx)"""
+    try:
+        async with acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT id, status, created_at FROM plans
+                WHERE user_id = $1 AND status <> 'cached'
+                ORDER BY created_at DESC
+                LIMIT $2;
+            """, user_id, limit)
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"❌ Ошибка БД: {e}")
+    return []
+
+async def get_last_plan_text(user_id: int) -> Optional[str]:
+    """Текст последнего сохранённого плана пользователя (основа для следующей правки)"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchval("""
+                SELECT plan_text FROM plans
+                WHERE user_id = $1 AND status <> 'cached'
+                ORDER BY created_at DESC
+                LIMIT 1;
+            """, user_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка БД: {e}")
+    return None
+
+async def get_plan_text(plan_id: int) -> Optional[str]:
+    """Текст плана по id (поиск по первичному ключу)"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchval("SELECT plan_text FROM plans WHERE id = $1;", plan_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка БД: {e}")
+    return None
+
+async def approve_plan(plan_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Утверждение черновика одним UPDATE по первичному ключу: user_id, текст плана
+    и прежний статус (для revert_plan_approval) или None, если черновика нет
+    или он уже утверждён
+    """
+    async with acquire() as conn:
+        row = await conn.fetchrow("""
+            UPDATE plans AS p SET status = 'approved'
+            FROM (SELECT id, status FROM plans WHERE id = $1 FOR UPDATE) AS old
+            WHERE p.id = old.id AND old.status IN ('draft', 'edited')
+            RETURNING p.user_id, p.plan_text, old.status AS previous_status;
+        """, plan_id)
+    return dict(row) if row else None
+
+async def revert_plan_approval(plan_id: int, status: str) -> bool:
+    """Возврат черновику прежнего статуса, если утверждённый план не доставлен"""
     try:
-        conn = await asyncpg.connect(DB_URL)
-        await conn.execute("""
-            INSERT INTO plans (user_id, plan_text, status, trainer_feedback, created_at)
-            VALUES ($1, $2, $3, $4, NOW());
-        """,
-        data.get("user_id"),
-        data.get("plan_text", ""),
-        data.get("status", "generated"),
-        data.get("trainer_feedback", ""))
-        await conn.close()
+        async with acquire() as conn:
+            result = await conn.execute(
+                "UPDATE plans SET status = $2 WHERE id = $1 AND status = 'approved';", plan_id, status
+            )
+        return result.endswith(" 1")
+    except Exception as e:
+        logger.error(f"❌ Ошибка БД: {e}")
+    return False
+
+async def save_plan(data: Dict[str, Any], durable: Optional[bool] = None) -> Optional[int]:
+    """Сохранение плана в БД (через буфер), возвращает id плана"""
+    try:
+        plan_id = await plan_ids.next_id()
+        await plans_buffer.add((
+            plan_id,
+            data.get("user_id"),
+            data.get("plan_text", ""),
+            data.get("status", "generated"),
+            data.get("trainer_feedback", ""),
+            datetime.now(timezone.utc),
+        ), durable=PLAN_DURABLE_WRITES if durable is None else durable)
         logger.info("✅ План сохранён")
+        return plan_id
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения плана: {e}")
+        return None
 
 # ---------- GIGACHAT (переадресация в SDK) ----------
+def _offline_plan(user_data: Dict[str, Any]) -> Optional[str]:
+    """План из локального каталога, если режим PLAN_OFFLINE_MODE это разрешает"""
+    if PLAN_OFFLINE_MODE == "off":
+        return None
+    profile = profile_from_anketa(user_data)
+    if PLAN_OFFLINE_MODE == "standard" and not profile.standard:
+        return None
+    return build_plan(user_data, profile)
+
+def _record_local(kind: str, user_data: Dict[str, Any], source: str, started: float) -> None:
+    """План без обращения к LLM (кэш или шаблон) — тоже строка журнала, с нулевой стоимостью"""
+    usage_ledger.record(
+        kind,
+        PROXY_MODEL if source == "cache" else "fallback_plans",
+        provider="cache" if source == "cache" else "local",
+        user_id=user_data.get("user_id"),
+        latency=time.monotonic() - started,
+        cache="hit" if source == "cache" else "bypass",
+        source=source,
+        cost=0.0,
+    )
+
 async def generate_plan(user_data: Dict[str, Any]) -> str:
-    """Генерация плана через официальный SDK GigaChat"""
-    return await asyncio.to_thread(_sdk_generate_plan, user_data)
+    """Генерация плана через асинхронный клиент (без пула потоков)"""
+    started = time.monotonic()
+    offline = _offline_plan(user_data)
+    if offline:
+        _record_local("plan", user_data, "offline", started)
+        return offline
+    
+    cached = await plan_cache.get(user_data)
+    if cached:
+        _record_local("plan", user_data, "cache", started)
+        return cached
+    
+    async def _generate() -> Optional[str]:
+        plan = await _sdk_generate_plan(user_data)
+        if plan:
+            await plan_cache.put(user_data, plan)
+        return plan
+    
+    return await plan_flights.do(_plan_key(user_data), _generate)
+
+
+async def generate_plan_slo(user_data: Dict[str, Any], deadline: Optional[float] = None) -> GenerationResult:
+    """Генерация с бюджетом задержки: кэш → LLM (+ хедж) → шаблон после дедлайна"""
+    return await slo_flights.do(_plan_key(user_data, deadline), lambda: _generate_plan_slo(user_data, deadline))
+
+async def _generate_plan_slo(user_data: Dict[str, Any], deadline: Optional[float]) -> GenerationResult:
+    started = time.monotonic()
+    offline = _offline_plan(user_data)
+    if offline:
+        _record_local("plan", user_data, "offline", started)
+        return record_served(GenerationResult(offline, "offline", latency=time.monotonic() - started))
+    
+    cached = await plan_cache.get(user_data)
+    if cached:
+        _record_local("plan", user_data, "cache", started)
+        return record_served(GenerationResult(cached, "cache", latency=time.monotonic() - started))
+
+    async def _cache_late(plan: str) -> None:
+        # Опоздавший ответ LLM не выбрасываем: следующая такая же анкета возьмёт его из кэша
+        await plan_cache.put(user_data, plan)
 
+    result = await generate_with_slo(
+        # Основной запрос общий с generate_plan и stream_plan по той же анкете
+        primary=lambda: plan_flights.do(_plan_key(user_data), lambda: _sdk_generate_plan(user_data)),
+        hedge=(lambda: _sdk_hedge_generate_plan(user_data)) if hedge_enabled() else None,
+        fallback=lambda: build_fallback_plan(user_data),
+        deadline=deadline or PLAN_SLO_SECONDS,
+        hedge_after=PLAN_HEDGE_AFTER,
+        on_late_result=_cache_late,
+    )
+    if not result.provisional:
+        await plan_cache.put(user_data, result.text)
+    else:
+        _record_local("plan", user_data, "fallback", started)
+    return result
 
-async def generate_plan_with_edit(user_data: Dict[str, Any], edit_text: str) -> str:
-    """Генерация плана с учётом правок тренера"""
-    return await asyncio.to_thread(_sdk_generate_plan_with_edit, user_data, edit_text)
+async def generate_plan_with_edit(user_data: Dict[str, Any], edit_text: str,
+                                  base_plan: Optional[str] = None) -> str:
+    """
+    Генерация плана с учётом правок тренера: если известен текущий план, переписываются
+    только затронутые правкой разделы, иначе план генерируется заново
+    """
+    key = _plan_key(user_data, edit_text, base_plan or "")
+    return await edit_flights.do(key, lambda: _generate_plan_with_edit(user_data, edit_text, base_plan))
+
+async def _generate_plan_with_edit(user_data: Dict[str, Any], edit_text: str,
+                                   base_plan: Optional[str]) -> str:
+    if PLAN_REVISION:
+        if not base_plan and user_data.get("user_id"):
+            base_plan = await get_last_plan_text(user_data["user_id"])
+        base_plan = base_plan or plan_cache.peek(user_data)
+        if base_plan:
+            revision = await revise_plan(user_data, base_plan, edit_text, _sdk_revise_section,
+                                         max_share=PLAN_REVISION_MAX_SHARE)
+            if revision:
+                return revision.text
+    return await _sdk_generate_plan_with_edit(user_data, edit_text)
+
+
+async def stream_plan(user_data: Dict[str, Any]) -> AsyncIterator[str]:
+    """Потоковая генерация плана (фрагменты текста по мере готовности)"""
+    started = time.monotonic()
+    offline = _offline_plan(user_data)
+    if offline:
+        _record_local("stream", user_data, "offline", started)
+        yield offline
+        return
+    
+    cached = await plan_cache.get(user_data)
+    if cached:
+        _record_local("stream", user_data, "cache", started)
+        yield cached
+        return
+    
+    # Такая же генерация уже идёт — ждём её целиком, а не запускаем вторую
+    key = _plan_key(user_data)
+    shared = plan_flights.get(key)
+    if shared is not None:
+        plan = await plan_flights.join(shared)
+        if plan:
+            yield plan
+        return
+    
+    flight = plan_flights.begin(key)
+    chunks = []
+    try:
+        async with contextlib.aclosing(_sdk_stream_plan(user_data)) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+    except BaseException as e:
+        # Ошибка, отмена или брошенный генератор: ждущие получают обычную ошибку,
+        # а не CancelledError — их собственные задачи никто не отменял
+        if not flight.done():
+            flight.set_exception(e if isinstance(e, Exception) else RuntimeError("stream aborted"))
+        raise
+    plan = "".join(chunks)
+    flight.set_result(plan or None)
+    if chunks:
+        await plan_cache.put(user_data, plan)
 
 
 async def token_refresher_task():
-    """Фоновая задача обновления токена (не используется, но оставим для совместимости)"""
-    while True:
-        await asyncio.sleep(20 * 60)
-        logger.info("🔁 Фоновое обновление токена (заглушка)")
+    """
+    Совместимость: токены обновляют провайдеры реестра (TokenManager)
+    заранее по expires_at, здесь только запуск их фоновых задач
+    """
+    from gigachat_integration import get_registry
+    registry = get_registry()
+    if registry is not None:
+        await registry.start()
@@ -0,0 +1,214 @@
+"""
+Буфер отложенной записи: строки копятся в памяти и уходят в БД пачками через COPY
+"""
+
+import asyncio
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+class IdAllocator:
+    """Выдача id из sequence блоками: один запрос к БД на id_block строк"""
+
+    def __init__(self, table: str, column: str = "id", block: int = 100) -> None:
+        self.table = table
+        self.column = column
+        self.block = block
+        self._ids: List[int] = []
+        self._lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        if not self._ids:
+            async with self._lock:
+                if not self._ids:
+                    self._ids = await self._fetch_block()
+        return self._ids.pop(0)
+
+    async def _fetch_block(self) -> List[int]:
+        from .db import acquire
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT nextval(pg_get_serial_sequence($1, $2)) AS id FROM generate_series(1, $3);",
+                self.table, self.column, self.block
+            )
+        return [row["id"] for row in rows]
+
+
+class WriteBuffer:
+    """
+    Пакетная вставка в одну таблицу.
+
+    Сброс — по max_batch строк или раз в flush_interval секунд. Очередь
+    ограничена max_pending строками: при переполнении add ждёт сброса.
+    add(..., durable=True) возвращается только после коммита пачки.
+    Неудачная пачка повторяется retries раз с паузой; если БД отвергла
+    её данные, строки пишутся по одной, чтобы плохая не топила остальные.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        columns: Sequence[str],
+        max_batch: int = 200,
+        flush_interval: float = 0.2,
+        max_pending: int = 5000,
+        retries: int = 3,
+        retry_delay: float = 0.5,
+    ) -> None:
+        self.table = table
+        self.columns = list(columns)
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._stopping = False
+        self._queue: "asyncio.Queue[Tuple[tuple, Optional[asyncio.Future]]]" = asyncio.Queue(max_pending)
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_rows = 0
+
+    async def start(self) -> None:
+        if self._flusher is None:
+            self._stopping = False
+            self._flusher = asyncio.create_task(self._flush_loop(), name=f"write-buffer-{self.table}")
+
+    async def stop(self) -> None:
+        """Остановка с обязательным сбросом остатка (до закрытия пула)"""
+        if self._flusher is not None:
+            # Не отменяем: отмена посреди flush потеряла бы уже снятую с очереди пачку
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        while not self._queue.empty():
+            await self.flush()
+
+    async def add(self, row: Sequence[Any], durable: bool = False) -> None:
+        """Постановка строки в буфер; durable — дождаться записи в БД"""
+        waiter = asyncio.get_running_loop().create_future() if durable else None
+        await self._queue.put((tuple(row), waiter))
+        if self._flusher is None:
+            # Буфер не запущен (скрипты, тесты) — пишем сразу
+            await self.flush()
+        elif self._queue.qsize() >= self.max_batch:
+            self._wakeup.set()
+        if waiter is not None:
+            await waiter
+
+    def add_nowait(self, row: Sequence[Any]) -> bool:
+        """Постановка без ожидания (для некритичных записей); False — буфер переполнен"""
+        try:
+            self._queue.put_nowait((tuple(row), None))
+        except asyncio.QueueFull:
+            self.failed_rows += 1
+            return False
+        if self._queue.qsize() >= self.max_batch:
+            self._wakeup.set()
+        return True
+
+    async def flush(self) -> int:
+        """Запись накопленного одной пачкой, возвращает число строк"""
+        async with self._flush_lock:
+            batch = []
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if not batch:
+                return 0
+            error = await self._write_with_retries([row for row, _ in batch])
+            if error is None:
+                self.flushed_batches += 1
+                self._settle(batch, None)
+                return len(batch)
+            if len(batch) == 1 or not isinstance(error, asyncpg.PostgresError):
+                self._settle([], error, lost=batch)
+                return 0
+
+            # БД отвергла данные пачки — ищем виноватые строки, остальные пишем
+            written, lost = [], []
+            for entry in batch:
+                try:
+                    await self._write([entry[0]])
+                    written.append(entry)
+                except Exception as e:
+                    error = e
+                    lost.append(entry)
+            if written:
+                self.flushed_batches += 1
+            self._settle(written, error, lost=lost)
+            return len(written)
+
+    async def _write_with_retries(self, records: List[tuple]) -> Optional[Exception]:
+        """None — записано, иначе последняя ошибка после всех попыток"""
+        for attempt in range(self.retries + 1):
+            try:
+                await self._write(records)
+                return None
+            except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as e:
+                # Повтор не поможет: данные не пройдут и со второго раза
+                return e
+            except Exception as e:
+                if attempt == self.retries:
+                    return e
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"⚠️ Запись в {self.table} не удалась ({e}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+        return None
+
+    def _settle(self, written: List[tuple], error: Optional[Exception], lost: Sequence[tuple] = ()) -> None:
+        """Учёт и ответ ждущим durable-записям"""
+        self.flushed_rows += len(written)
+        for _, waiter in written:
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+        if not lost:
+            return
+        self.failed_rows += len(lost)
+        # id выданы вызывающим заранее — называем их, чтобы потерю можно было найти
+        ids = [row[self.columns.index("id")] for row, _ in lost] if "id" in self.columns else []
+        logger.error(f"❌ Не записано строк в {self.table}: {len(lost)} ({error})"
+                     + (f", id: {ids}" if ids else ""))
+        for _, waiter in lost:
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(error or RuntimeError("строка не записана"))
+
+    async def _write(self, records: List[tuple]) -> None:
+        from .db import acquire
+        async with acquire() as conn:
+            try:
+                await conn.copy_records_to_table(self.table, records=records, columns=self.columns)
+            except Exception as e:
+                # COPY может быть недоступен (прокси пула, права) — повторяем обычной вставкой
+                logger.warning(f"⚠️ COPY в {self.table} не удался ({e}), пишем через executemany")
+                placeholders = ", ".join(f"${i}" for i in range(1, len(self.columns) + 1))
+                await conn.executemany(
+                    f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({placeholders});",
+                    records
+                )
+
+    async def _flush_loop(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.flush() == self.max_batch:
+                    pass
+            except Exception as e:
+                logger.error(f"❌ Ошибка сброса буфера {self.table}: {e}")
+
+    def stats_dict(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "flushed_rows": self.flushed_rows,
+            "flushed_batches": self.flushed_batches,
+            "failed_rows": self.failed_rows,
+        }
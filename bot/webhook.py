@@ -0,0 +1,162 @@
+"""
+Режим webhook: aiohttp-приложение вместо long polling
+"""
+
+import time
+import asyncio
+import signal
+import logging
+from typing import Any, Dict, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from metrics import metrics_handler
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook: Telegram получает ответ сразу, апдейт обрабатывается
+    в фоне, одновременно не больше concurrency задач. Принятых, но ещё не
+    обработанных апдейтов не больше max_backlog: сверх этого отвечаем 429,
+    и Telegram доставит апдейт повторно, когда реплика разгрузится.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int = 64,
+                 max_backlog: int = 256, **kwargs: Any) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.concurrency = concurrency
+        self.max_backlog = max(max_backlog, concurrency)
+        self.draining = False
+        self.processed = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # Во время остановки не принимаем апдейты: Telegram повторит их на другую реплику
+        if self.draining:
+            return web.Response(status=503, text="Draining")
+        return await super().handle(request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if len(self._tasks) >= self.max_backlog:
+            # Очередь задач не растёт без предела: апдейт остаётся у Telegram
+            self.rejected += 1
+            return web.Response(status=429, text="Too Many Requests", headers={"Retry-After": "1"})
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self._limited_feed_update(bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _limited_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            try:
+                result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(bot=bot, result=result)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки апдейта {update.get('update_id')}: {e}")
+            finally:
+                self.processed += 1
+
+    async def drain(self, timeout: float) -> None:
+        """Перестаём принимать апдейты и ждём уже принятые не дольше timeout"""
+        self.draining = True
+        if not self._tasks:
+            return
+        logger.info(f"⏳ Дожидаемся {len(self._tasks)} апдейтов...")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"⚠️ Прервано апдейтов при остановке: {len(pending)}")
+
+    async def close(self) -> None:
+        # Сессию бота закрывает on_shutdown (close_bot), здесь только дожидаемся задач
+        await self.drain(timeout=0)
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str = "",
+               concurrency: int = 64, max_backlog: int = 256) -> web.Application:
+    """aiohttp-приложение с маршрутом webhook, /healthz и /metrics"""
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        concurrency=concurrency,
+        max_backlog=max_backlog,
+        secret_token=secret_token or None,
+    )
+    handler.register(app, path=path)
+    app["webhook_handler"] = handler
+    app["started_at"] = time.monotonic()
+
+    async def healthz(request: web.Request) -> web.Response:
+        # 503 во время остановки — балансировщик снимает реплику с трафика
+        status = 503 if handler.draining else 200
+        return web.json_response({
+            "status": "draining" if handler.draining else "ok",
+            "in_flight": handler.in_flight,
+            "processed": handler.processed,
+            "rejected": handler.rejected,
+            "concurrency": handler.concurrency,
+            "max_backlog": handler.max_backlog,
+            "uptime": round(time.monotonic() - app["started_at"], 1),
+        }, status=status)
+
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics_handler)
+    # startup/shutdown диспетчера вызываются вместе с приложением
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    """Запуск webhook-сервера до SIGTERM/SIGINT с плавной остановкой"""
+    from config import (
+        WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+        WEBHOOK_CONCURRENCY, WEBHOOK_MAX_BACKLOG, WEBHOOK_DRAIN_TIMEOUT, WEBHOOK_MAX_CONNECTIONS
+    )
+
+    app = create_app(dispatcher, bot, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_BACKLOG)
+    handler: LimitedRequestHandler = app["webhook_handler"]
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    # Несколько реплик за балансировщиком регистрируют один и тот же URL
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info(f"✅ Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await stop.wait()
+        logger.info("🛑 Получен сигнал остановки")
+        await handler.drain(WEBHOOK_DRAIN_TIMEOUT)
+    finally:
+        # cleanup вызывает on_shutdown диспетчера: очередь, пул, сессии
+        await runner.cleanup()